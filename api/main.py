@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 import uvicorn
 from pathlib import Path
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 import routers.崩滑物源算法_接口
 import routers.坡面物源算法_接口
 import routers.沟道物源算法_接口
+import routers.数据集_接口
+import routers.存储管理_接口
+import routers.瓦片_接口
+import routers.DEM差分_接口
 
 
 
@@ -33,17 +37,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 前端按 Range 读取 COG 时需要读取这些响应头
+    expose_headers=["Accept-Ranges", "Content-Range", "Content-Length", "ETag"],
 )
 
 app.include_router(routers.崩滑物源算法_接口.router)
 app.include_router(routers.坡面物源算法_接口.router)
 app.include_router(routers.沟道物源算法_接口.router)
+app.include_router(routers.数据集_接口.router)
+app.include_router(routers.存储管理_接口.router)
+app.include_router(routers.瓦片_接口.router)
+app.include_router(routers.DEM差分_接口.router)
 
 base_dir = Path(__file__).parent
 outputs_dir = base_dir / "outputs"
 outputs_dir.mkdir(exist_ok=True)
 app.mount("/files", StaticFiles(directory=str(outputs_dir)), name="files")
 
+# 记录 /files 访问，刷新所属任务/数据集的最近访问时间，供 LRU 清理使用
+@app.middleware("http")
+async def track_file_access(request: Request, call_next):
+    path = request.scope.get("path", "")
+    if path.startswith("/files/"):
+        routers.存储管理_接口.outputs_store.touch_path(path[len("/files/"):])
+    return await call_next(request)
+
 @app.get("/test")
 def test_endpoint():
     return {"message": "test接口正常工作"}
@@ -0,0 +1,142 @@
+from fastapi import APIRouter, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse
+from pathlib import Path
+import os
+import sys
+import uuid
+import asyncio
+import importlib
+import traceback
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.append(root_dir)
+
+from submod.公共.数据集 import DatasetStore
+from submod.公共.上传 import UploadLimitRoute, resolve_input
+from submod.公共.输出仓库 import OutputsStore
+from submod.公共.栅格输出 import cogify_dir
+from submod.公共.统计 import result_summary
+from submod.DEM差分算法 import GRID_CHOICES
+
+# 超过上传上限的请求在解析表单前即返回 413
+router = APIRouter(route_class=UploadLimitRoute)
+
+base_dir = Path(root_dir)
+outputs_dir = base_dir / "outputs"
+outputs_dir.mkdir(exist_ok=True)
+dataset_store = DatasetStore(outputs_dir / "datasets")
+outputs_store = OutputsStore(outputs_dir)
+
+
+def locate_dem(meta):
+    """DEM 数据集为 ZIP 时取其中最大的 tif（/vsizip/ 路径），否则直接使用源文件"""
+    if meta["kind"] == "zip":
+        candidates = dataset_store.archive_paths(meta, [".tif", ".tiff"], exclude_aux=True, largest_first=True)
+        if not candidates:
+            return None, {"error": "no_tif_found_in_zip"}
+        return candidates[0], None
+    return dataset_store.source_path(meta), None
+
+
+def locate_zones(meta):
+    """分区矢量：ZIP 中的 .shp（/vsizip/ 路径），或直接上传的 KML/GeoJSON/GPKG"""
+    if meta["kind"] == "zip":
+        candidates = dataset_store.archive_paths(meta, [".shp"])
+        if not candidates:
+            return None, {"error": "no_shp_found_in_zip"}
+        return candidates[0], None
+    return dataset_store.source_path(meta), None
+
+
+@router.post("/dem-diff")
+async def dem_diff(pre_dem: UploadFile = File(None), post_dem: UploadFile = File(None), zones: UploadFile = File(None),
+                   pre_dataset_id: str = Form(None), post_dataset_id: str = Form(None), zones_dataset_id: str = Form(None),
+                   zone_field: str = Form(None), grid: str = Form("coarser"), resolution: float = Form(None),
+                   request: Request = None):
+    """
+    功能
+    - 前后两期 DEM 差分（如泥石流前后 LiDAR）：对齐到同一网格后逐块计算 后期 − 前期 高差，输出挖方/填方/净体积、高差 COG 与分区体积
+    - 接口路径：`POST /dem-diff`
+    - 请求类型：`multipart/form-data`
+
+    输入参数
+    - `pre_dem`/`post_dem`：前期/后期 DEM（`tif` 或含 `tif` 的 Zip）
+    - `zones`：可选，分区多边形（shp Zip、KML、GeoJSON）；提供时只统计分区内像元，并按多边形输出体积
+    - `pre_dataset_id`/`post_dataset_id`/`zones_dataset_id`：可选，`POST /datasets` 返回的数据集 id，提供时代替对应上传文件；超过 `UPLOAD_MAX_BYTES` 的请求在解析表单前即返回 HTTP 413；大文件请先经 `POST /datasets`、`PUT /datasets/stream` 或 `/uploads` 上传，再以 `*_dataset_id` 传入
+    - `zone_field`：可选，分区名称字段，默认按要素顺序编号
+    - `grid`：对齐网格 `coarser`（默认，分辨率较粗的一幅）/`finer`/`pre`/`post`，投影与分辨率取自所选 DEM
+    - `resolution`：可选，对齐分辨率（米），覆盖 `grid` 所选 DEM 的分辨率
+
+    输出结果
+    - `volume`：`{ count, pixel_area, fill_volume（填方/堆积）, cut_volume（挖方/侵蚀）, net_volume, volume（净体积绝对值） }`，单位立方米
+    - `zones`：分区体积列表 `{ zone, name, count, pixel_area, fill_volume, cut_volume, net_volume, volume }`（仅提供分区时）
+    - `grid`：对齐网格 `{ reference, width, height, resolution, bounds, crs }`
+    - `diff_tif_url`、`diff_stats`、`diff_preview_url`：高差 COG（NaN 为 NODATA）及其统计、预览
+    - `zones_csv_url`：分区体积 CSV（仅提供分区时）
+
+    错误返回
+    - `{"error": "invalid_grid"}`、`{"error": "invalid_resolution"}`：参数不合法（HTTP 400）
+    - `{"error": "invalid_dem_pair", "message": ...}`：无法打开、无重叠区域或分区无效（HTTP 400）
+    - `{"error": "dem_diff_failed", "message": ...}`：计算过程出错（HTTP 500）
+    """
+    if grid not in GRID_CHOICES:
+        return JSONResponse({"error": "invalid_grid", "grid": grid, "allowed": list(GRID_CHOICES)}, status_code=400)
+    if resolution is not None and resolution <= 0:
+        return JSONResponse({"error": "invalid_resolution", "resolution": resolution}, status_code=400)
+
+    pre_meta, err = await resolve_input(dataset_store, pre_dem, pre_dataset_id, "pre_dem")
+    if err:
+        return err
+    post_meta, err = await resolve_input(dataset_store, post_dem, post_dataset_id, "post_dem")
+    if err:
+        return err
+    pre_path, err = locate_dem(pre_meta)
+    if err:
+        return err
+    post_path, err = locate_dem(post_meta)
+    if err:
+        return err
+    datasets = {"pre_dem": pre_meta["id"], "post_dem": post_meta["id"]}
+    zones_path = None
+    if zones is not None or zones_dataset_id:
+        zones_meta, err = await resolve_input(dataset_store, zones, zones_dataset_id, "zones")
+        if err:
+            return err
+        zones_path, err = locate_zones(zones_meta)
+        if err:
+            return err
+        datasets["zones"] = zones_meta["id"]
+
+    uid = uuid.uuid4().hex
+    out_dir = outputs_dir / f"{uid}_dem_diff"
+    out_dir.mkdir(exist_ok=True)
+    outputs_store.record_job(out_dir, datasets)
+
+    algo = importlib.import_module("submod.DEM差分算法")
+    try:
+        result = await asyncio.to_thread(algo.run_dem_diff, str(pre_path), str(post_path), str(out_dir),
+                                         zones_path=str(zones_path) if zones_path else None, zone_field=zone_field,
+                                         grid=grid, resolution=resolution)
+    except ValueError as e:
+        return JSONResponse({"error": "invalid_dem_pair", "message": str(e)}, status_code=400)
+    except Exception as e:
+        traceback.print_exc()
+        return JSONResponse({"error": "dem_diff_failed", "message": str(e)}, status_code=500)
+
+    cogify_dir(out_dir)
+    diff_path = Path(result["diff_path"])
+    diff_stats, diff_preview = result_summary(diff_path, colormap="RdBu")
+    base = str(request.base_url).rstrip("/")
+    def url(name): return f"{base}/files/{uid}_dem_diff/{name}"
+    return {
+        "id": uid,
+        "datasets": datasets,
+        "volume": {k: result[k] for k in ("count", "pixel_area", "fill_volume", "cut_volume", "net_volume", "volume")},
+        "zones": result.get("zones"),
+        "grid": result["grid"],
+        "diff_tif_url": url(diff_path.name),
+        "diff_stats": diff_stats,
+        "diff_preview_url": url(Path(diff_preview).name) if diff_preview else None,
+        "zones_csv_url": url(Path(result["zones_csv_path"]).name) if result["zones_csv_path"] else None,
+    }
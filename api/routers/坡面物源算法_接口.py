@@ -1,27 +1,50 @@
 from fastapi import APIRouter, UploadFile, File, Request, Form
+from fastapi.responses import FileResponse, JSONResponse
 from pathlib import Path
 import os
 import sys
+import asyncio
 import uuid
-import shutil
 import zipfile
 import importlib
 import numpy as np
 import json
 from typing import List
 
-router = APIRouter()
-
 current_dir = os.path.dirname(os.path.abspath(__file__))
 root_dir = os.path.dirname(current_dir)
 sys.path.append(root_dir)
 
+from submod.公共.数据集 import DatasetStore
+from submod.公共.上传 import UploadLimitRoute, resolve_input
+from submod.公共.输出仓库 import OutputsStore
+from submod.公共.栅格输出 import cogify_dir
+from submod.公共.统计 import load_stats, result_summary
+from submod.公共.压缩包 import vsizip_path
+
+# 超过上传上限的请求在解析表单前即返回 413
+router = APIRouter(route_class=UploadLimitRoute)
+
 base_dir = Path(root_dir)
 outputs_dir = base_dir / "outputs"
 outputs_dir.mkdir(exist_ok=True)
+dataset_store = DatasetStore(outputs_dir / "datasets")
+outputs_store = OutputsStore(outputs_dir)
+
+def dataset_url(base, meta):
+    return f"{base}/files/{dataset_store.relative_path(dataset_store.source_path(meta))}"
+
+def locate_shp(meta):
+    """在矢量 ZIP 数据集中定位 .shp，返回 /vsizip/ 路径（geopandas/rasterio 可直接读取，无需解压）"""
+    if meta["kind"] != "zip":
+        return None, {"error": "not_a_zip_file", "filename": meta["filename"], "size": meta["size"]}
+    shp_candidates = dataset_store.archive_paths(meta, [".shp"])
+    if not shp_candidates:
+        return None, {"error": "no_shp_found_in_zip"}
+    return shp_candidates[0], None
 
 @router.post("/c-factor")
-async def c_factor(ndvi_file: UploadFile = File(...), shp_zip: UploadFile = File(...), request: Request = None):
+async def c_factor(ndvi_file: UploadFile = File(None), shp_zip: UploadFile = File(None), ndvi_dataset_id: str = Form(None), shp_dataset_id: str = Form(None), mode: str = Form("auto"), composite: str = Form("mean"), output_format: str = Form("separate"), ndvi_soil: float = Form(None), ndvi_veg: float = Form(None), soil_percentile: float = Form(None), veg_percentile: float = Form(None), visualize: bool = Form(False), request: Request = None):
     """
     功能
     - 计算植被覆盖度 f 与 C 因子，并输出裁剪后的 NDVI、f、C 以及统计报告与可视化图片。
@@ -32,114 +55,170 @@ async def c_factor(ndvi_file: UploadFile = File(...), shp_zip: UploadFile = File
     - `ndvi_file`：NDVI 栅格文件（通常为单波段 GeoTIFF，字段名为 `ndvi_file`）
       - 用途：作为计算 f 与 C 的基础栅格数据
       - 要求：坐标参考与矢量范围一致或可裁剪；文件类型建议为 `.tif`
+      - 多时相：可为多波段 GeoTIFF（每个波段一个日期），或多个日期 `tif` 的 ZIP（网格需一致），按 `composite` 逐块合成后计算
     - `shp_zip`：矢量范围压缩包（字段名为 `shp_zip`）
       - 用途：用于裁剪 NDVI；压缩包内需包含 `.shp/.shx/.dbf/.prj` 等文件
       - 编码：自动尝试 `utf-8/gbk/cp936` 解决中文文件名
+    - `ndvi_dataset_id`/`shp_dataset_id`：可选，`POST /datasets` 返回的数据集 id，提供时代替对应上传文件；超过 `UPLOAD_MAX_BYTES` 的请求在解析表单前即返回 HTTP 413；大文件请先经 `POST /datasets`、`PUT /datasets/stream` 或 `/uploads` 上传，再以 `*_dataset_id` 传入
+    - `composite`：可选，多时相合成方法 `mean`（默认）/`max`/`median`，逐块读取全部时相，内存为 块大小 × 时相数
+    - `output_format`：可选，`separate`（默认，三个单波段 COG）/`multiband`（一个三波段 COG `C因子产品.tif`：1 裁剪后NDVI、2 f、3 C，带波段描述，在同一遍分块计算中写出，总是流式）
+    - `mode`：可选，`auto`（默认，裁剪范围超过 `C_FACTOR_STREAM_PIXELS` 像元时流式）/`memory`（整幅读入内存）/`stream`（按块两遍流式计算，内存占用只与块大小有关）
+    - `soil_percentile`/`veg_percentile`：可选，以 NDVI 的百分位（0–100，如 `5`/`95`）作为裸土/纯植被端元，避免个别水体、云像元影响 f；由分位数草图在读取时一并估计
+    - `ndvi_soil`/`ndvi_veg`：可选，直接指定端元 NDVI 值，优先于百分位；均未提供时使用裁剪范围内的最小/最大值
+    - `visualize`：可选，为 `true` 时在后台立即开始生成可视化图片；否则在首次访问 `visualization_url` 时生成
     - `request`：FastAPI `Request`，用于拼接返回的文件访问 URL
 
     输出结果（JSON）
     - `id`：本次计算的唯一标识
+    - `datasets`：各输入对应的数据集 id，后续请求可直接复用
+    - `mode`：实际使用的计算方式（`memory`/`stream`，多时相总是 `stream`）
+    - `ndvi_stats`：合成、裁剪后 NDVI 的统计，多时相时含 `composite: {method, scenes}`
     - `ndvi_tif_url`：原始 NDVI 栅格的可访问 URL
     - `shp_zip_url`：上传的矢量 ZIP 的可访问 URL
-    - `clipped_ndvi_tif_url`：按矢量范围裁剪后的 NDVI 栅格 URL（文件名：`裁剪后ndvi.tif`）
-    - `f_tif_url`：植被覆盖度 f 的栅格 URL（文件名：`植被覆盖度f.tif`）
-    - `c_tif_url`：C 因子栅格 URL（文件名：`C因子.tif`）
+    - `clipped_ndvi_tif_url`：按矢量范围裁剪后的 NDVI 栅格 URL（文件名：`裁剪后ndvi.tif`；`multiband` 时为 `null`）
+    - `f_tif_url`：植被覆盖度 f 的栅格 URL（文件名：`植被覆盖度f.tif`；`multiband` 时为 `null`）
+    - `c_tif_url`：C 因子栅格 URL（文件名：`C因子.tif`；`multiband` 时为 `null`）
+    - `product_tif_url`、`bands`：仅 `multiband`，产品 URL 与各波段 `{band, description, gdal_path（vrt:///vsicurl/...?bands=N）, tiles_url}`
     - `report_url`：统计报告文本 URL（文件名：`statistics_report.txt`）
-    - `visualization_url`：分析结果可视化图片 URL（文件名：`vegetation_analysis_results.png`）
-    - `c_stats`：C 因子统计（`min/max/mean`，浮点数；忽略 `NaN`）
-    - `f_stats`：f 统计（`min/max/mean`，浮点数；忽略 `NaN`）
+    - `visualization_url`：分析结果可视化图片 URL（`GET /c-factor/{id}/visualization.png`，不在本请求内渲染，首次访问时在后台生成并缓存）
+    - `c_stats`：C 因子统计（`count/min/max/mean/std/histogram`，由算法写出时单次累加；忽略 `NaN`）
+    - `f_stats`：f 统计（同上，另含 `classes`：低/中/高覆盖分段像素数 `low/medium/high`）
+    - `endmembers`：计算 f 使用的端元 `{ndvi_soil, ndvi_veg, soil_source, veg_source}`（来源为 `value`/`p5` 等/`min`/`max`）
 
     错误响应（JSON）
     - `{"error": "not_a_zip_file", "filename": ..., "size": ...}`：`shp_zip` 不是有效 ZIP
     - `{"error": "bad_zip_file", "filename": ..., "size": ...}`：ZIP 文件损坏
     - `{"error": "no_shp_found_in_zip"}`：ZIP 内未找到 `.shp`
+    - `{"error": "dataset_not_found", ...}`：数据集 id 不存在
+    - `{"error": "invalid_mode", ...}`：`mode` 取值无效
+    - `{"error": "invalid_composite", ...}`：`composite` 取值无效
+    - `{"error": "invalid_output_format", ...}`：`output_format` 取值无效
+    - `{"error": "no_tif_found_in_zip"}`：NDVI ZIP 内未找到 `tif`
+    - `{"error": "invalid_endmembers", ...}`：百分位不在 0–100 或土壤端元不小于植被端元
+    - HTTP 500 `{"error": "c_factor_failed", "id": ..., "mode": ...}`：C 因子计算失败（详见服务日志）
     """
+    if mode not in ("auto", "memory", "stream"):
+        return {"error": "invalid_mode", "mode": mode, "allowed": ["auto", "memory", "stream"]}
+    if output_format not in ("separate", "multiband"):
+        return {"error": "invalid_output_format", "output_format": output_format, "allowed": ["separate", "multiband"]}
+    if composite not in ("mean", "max", "median"):
+        return {"error": "invalid_composite", "composite": composite, "allowed": ["mean", "max", "median"]}
+    endmember_options = {"ndvi_soil": ndvi_soil, "ndvi_veg": ndvi_veg, "soil_percentile": soil_percentile, "veg_percentile": veg_percentile}
+    percentiles = [p for p in (soil_percentile, veg_percentile) if p is not None]
+    if any(not 0 <= p <= 100 for p in percentiles) \
+            or (soil_percentile is not None and veg_percentile is not None and soil_percentile >= veg_percentile) \
+            or (ndvi_soil is not None and ndvi_veg is not None and ndvi_soil >= ndvi_veg):
+        return {"error": "invalid_endmembers", **endmember_options}
     uid = uuid.uuid4().hex
-    ndvi_name = f"{uid}_{Path(ndvi_file.filename).stem}.tif"
-    ndvi_path = outputs_dir / ndvi_name
-    with ndvi_path.open("wb") as f:
-        ndvi_file.file.seek(0)
-        shutil.copyfileobj(ndvi_file.file, f)
-
-    shpzip_name = f"{uid}_{Path(shp_zip.filename).name}"
-    shpzip_path = outputs_dir / shpzip_name
-    with shpzip_path.open("wb") as f:
-        shp_zip.file.seek(0)
-        shutil.copyfileobj(shp_zip.file, f)
-
-    shp_extract_dir = outputs_dir / f"{uid}_shp"
-    shp_extract_dir.mkdir(exist_ok=True)
-    if not zipfile.is_zipfile(str(shpzip_path)):
-        return {"error": "not_a_zip_file", "filename": shpzip_name, "size": os.path.getsize(shpzip_path)}
-    try:
-        with zipfile.ZipFile(str(shpzip_path), 'r') as zf:
-            for info in zf.infolist():
-                name = info.filename
-                fixed = name
-                if not (info.flag_bits & 0x800):
-                    for enc in ("utf-8", "gbk", "cp936"):
-                        try:
-                            fixed = name.encode("cp437").decode(enc)
-                            break
-                        except Exception:
-                            pass
-                target_path = shp_extract_dir / fixed
-                if info.is_dir() or name.endswith("/"):
-                    target_path.mkdir(parents=True, exist_ok=True)
-                else:
-                    target_path.parent.mkdir(parents=True, exist_ok=True)
-                    with zf.open(info) as src, target_path.open("wb") as dst:
-                        shutil.copyfileobj(src, dst)
-    except zipfile.BadZipFile:
-        return {"error": "bad_zip_file", "filename": shpzip_name, "size": os.path.getsize(shpzip_path)}
-
-    shp_candidates = list(shp_extract_dir.rglob("*.shp"))
-    if not shp_candidates:
-        return {"error": "no_shp_found_in_zip"}
-    shp_path = shp_candidates[0]
+    ndvi_meta, err = await resolve_input(dataset_store, ndvi_file, ndvi_dataset_id, "ndvi_file")
+    if err:
+        return err
+    shp_meta, err = await resolve_input(dataset_store, shp_zip, shp_dataset_id, "shp_zip")
+    if err:
+        return err
+    shp_path, err = locate_shp(shp_meta)
+    if err:
+        return err
+    ndvi_paths = [str(dataset_store.source_path(ndvi_meta))]
+    if ndvi_meta["kind"] == "zip":
+        # 多个日期的 NDVI 打包为 ZIP：不解压，逐个时相通过 /vsizip/ 读取
+        ndvi_paths = dataset_store.archive_paths(ndvi_meta, [".tif", ".tiff"])
+        if not ndvi_paths:
+            return {"error": "no_tif_found_in_zip"}
 
     algo = importlib.import_module("submod.坡面物源算法.C因子")
     out_dir = outputs_dir / f"{uid}_c_factor"
     out_dir.mkdir(exist_ok=True)
-    C, f = algo.calculate_vegetation_cover_factor(str(ndvi_path), str(shp_path), output_dir=str(out_dir))
-
-    c_stats = None
-    f_stats = None
-    if C is not None and f is not None:
-        c_stats = {
-            "min": float(np.nanmin(C)),
-            "max": float(np.nanmax(C)),
-            "mean": float(np.nanmean(C))
-        }
-        f_stats = {
-            "min": float(np.nanmin(f)),
-            "max": float(np.nanmax(f)),
-            "mean": float(np.nanmean(f))
-        }
+    outputs_store.record_job(out_dir, {"ndvi_file": ndvi_meta["id"], "shp_zip": shp_meta["id"]})
+    ok, used_mode = algo.run_c_factor(ndvi_paths, str(shp_path), output_dir=str(out_dir), mode=mode, composite=composite,
+                                      output_format=output_format, **endmember_options)
+    if not ok:
+        # 计算失败时输出目录中只有不完整的栅格，不再转换 COG 或统计
+        return JSONResponse({"error": "c_factor_failed", "id": uid, "mode": used_mode}, status_code=500)
 
+    # 栅格结果转换为 COG（分块 + 金字塔），前端可按 Range 只读取所需部分
+    cogify_dir(out_dir)
+    # 统计由算法写出栅格时同步计算，预览图从概览层生成，均无需重新完整读取栅格
+    if visualize:
+        algo.request_visualization(str(out_dir))
+    layers = algo.output_layers(str(out_dir))
+    c_stats, c_preview = result_summary(layers["C"][0], colormap="RdYlGn_r", band=layers["C"][1])
+    f_stats, f_preview = result_summary(layers["f"][0], colormap="YlGn", band=layers["f"][1])
+    ndvi_stats = load_stats(*layers["ndvi"])
     base = str(request.base_url).rstrip("/")
     def url_of(name): return f"{base}/files/{uid}_c_factor/{name}"
-    clipped_ndvi_url = url_of("裁剪后ndvi.tif")
-    f_tif_url = url_of("植被覆盖度f.tif")
-    c_tif_url = url_of("C因子.tif")
     report_url = url_of("statistics_report.txt")
-    vis_url = url_of("vegetation_analysis_results.png")
+    vis_url = f"{base}/c-factor/{uid}/visualization.png"
 
-    return {
+    result = {
         "id": uid,
-        "ndvi_tif_url": f"{base}/files/{ndvi_name}",
-        "shp_zip_url": f"{base}/files/{shpzip_name}",
-        "clipped_ndvi_tif_url": clipped_ndvi_url,
-        "f_tif_url": f_tif_url,
-        "c_tif_url": c_tif_url,
+        "datasets": {"ndvi_file": ndvi_meta["id"], "shp_zip": shp_meta["id"]},
+        "mode": used_mode,
+        "output_format": output_format,
+        "ndvi_stats": ndvi_stats,
+        "ndvi_tif_url": dataset_url(base, ndvi_meta),
+        "shp_zip_url": dataset_url(base, shp_meta),
+        "clipped_ndvi_tif_url": None,
+        "f_tif_url": None,
+        "c_tif_url": None,
         "report_url": report_url,
         "visualization_url": vis_url,
         "c_stats": c_stats,
-        "f_stats": f_stats
+        "f_stats": f_stats,
+        "endmembers": f_stats.get("endmembers") if f_stats else None,
+        "c_preview_url": url_of(Path(c_preview).name) if c_preview else None,
+        "f_preview_url": url_of(Path(f_preview).name) if f_preview else None
     }
+    if output_format == "multiband":
+        # 一个三波段产品，按波段号寻址：GDAL 用 vrt:// 连接串，瓦片接口用 band 参数
+        product_url = url_of(algo.PRODUCT_FILE)
+        result["product_tif_url"] = product_url
+        result["bands"] = {
+            name: {
+                "band": band,
+                "description": algo.BAND_DESCRIPTIONS[name],
+                "gdal_path": f"vrt:///vsicurl/{product_url}?bands={band}",
+                "tiles_url": f"{base}/tiles/{uid}_c_factor/{algo.PRODUCT_FILE}/{{z}}/{{x}}/{{y}}.png?band={band}",
+            }
+            for name, band in algo.PRODUCT_BANDS.items()
+        }
+    else:
+        result["clipped_ndvi_tif_url"] = url_of(algo.LAYER_FILES["ndvi"])
+        result["f_tif_url"] = url_of(algo.LAYER_FILES["f"])
+        result["c_tif_url"] = url_of(algo.LAYER_FILES["C"])
+    return result
+
+@router.get("/c-factor/{uid}/visualization.png")
+async def c_factor_visualization(uid: str, dpi: int = None):
+    """
+    功能
+    - 返回 C 因子分析图（裁剪后 NDVI、f、C 与 f 分布直方图）。首次访问时在后台单线程中渲染并缓存，之后直接返回文件。
+    - 接口路径：`GET /c-factor/{id}/visualization.png`
+
+    输入参数（查询）
+    - `dpi`：可选，50–300，默认为环境变量 `C_FACTOR_VIS_DPI`（150）；不同 DPI 分别缓存
+
+    错误响应（JSON）
+    - HTTP 404 `{"error": "job_not_found"}`：任务不存在或结果已被清理
+    - HTTP 400 `{"error": "invalid_dpi"}`
+    - HTTP 500 `{"error": "visualization_failed", "message": ...}`
+    """
+    algo = importlib.import_module("submod.坡面物源算法.C因子")
+    dpi = algo.VIS_DPI if dpi is None else dpi
+    if not 50 <= dpi <= 300:
+        return JSONResponse({"error": "invalid_dpi", "dpi": dpi}, status_code=400)
+    job_dir = outputs_dir / f"{uid}_c_factor"
+    if not uid.isalnum() or not os.path.exists(algo.output_layers(str(job_dir))["C"][0]):
+        return JSONResponse({"error": "job_not_found", "id": uid}, status_code=404)
+    outputs_store.touch(job_dir.name)
+    try:
+        path = await asyncio.wrap_future(algo.request_visualization(str(job_dir), dpi))
+    except Exception as e:
+        return JSONResponse({"error": "visualization_failed", "message": str(e)}, status_code=500)
+    return FileResponse(path, media_type="image/png")
 
 @router.post("/k-factor")
-async def k_factor(raster_file: UploadFile = File(...), shp_zip: UploadFile = File(...), attribute_xls: UploadFile = File(...), request: Request = None):
+async def k_factor(raster_file: UploadFile = File(None), shp_zip: UploadFile = File(None), attribute_xls: UploadFile = File(None), raster_dataset_id: str = Form(None), shp_dataset_id: str = Form(None), attribute_dataset_id: str = Form(None), request: Request = None):
     """
     功能
     - 计算 K 因子，并生成：裁剪栅格、带属性的栅格/表、K 因子栅格与统计。
@@ -149,17 +228,19 @@ async def k_factor(raster_file: UploadFile = File(...), shp_zip: UploadFile = Fi
     输入参数
     - `raster_file`：待计算的栅格或压缩包（字段名为 `raster_file`）
       - 用途：作为裁剪与后续属性计算的基础数据
-      - 支持：直接栅格文件（如 `.tif`）；或 ZIP 压缩包（例如 HWSD 数据集，包含 `hwsd.bil/.hdr/.prj` 等），会自动解压并优先选择 `.bil` 作为输入
+      - 支持：直接栅格文件（如 `.tif`）；或 ZIP 压缩包（例如 HWSD 数据集，包含 `hwsd.bil/.hdr/.prj` 等），不解压，优先选择其中的 `.bil` 通过 `/vsizip/` 直接读取
     - `shp_zip`：矢量范围压缩包（字段名为 `shp_zip`）
       - 用途：用于裁剪栅格；压缩包内需包含 `.shp/.shx/.dbf/.prj` 等文件
       - 编码：自动尝试 `utf-8/gbk/cp936` 解决中文文件名
     - `attribute_xls`：属性表（Excel，字段名为 `attribute_xls`）
       - 用途：为裁剪后的栅格构建属性表并参与 K 因子计算
       - 建议：`.xls` 或 `.xlsx`
+    - `raster_dataset_id`/`shp_dataset_id`/`attribute_dataset_id`：可选，`POST /datasets` 返回的数据集 id，提供时代替对应上传文件；超过 `UPLOAD_MAX_BYTES` 的请求在解析表单前即返回 HTTP 413；大文件请先经 `POST /datasets`、`PUT /datasets/stream` 或 `/uploads` 上传，再以 `*_dataset_id` 传入
     - `request`：FastAPI `Request`，用于拼接返回的文件访问 URL
 
     输出结果（JSON）
     - `id`：本次计算的唯一标识
+    - `datasets`：各输入对应的数据集 id
     - `raster_url`：上传原始栅格的可访问 URL
     - `shp_zip_url`：上传矢量 ZIP 的可访问 URL
     - `attribute_xls_url`：上传属性 Excel 的可访问 URL
@@ -168,177 +249,87 @@ async def k_factor(raster_file: UploadFile = File(...), shp_zip: UploadFile = Fi
     - `attribute_csv_url`：由属性表生成的 CSV URL
     - `k_tif_url`：K 因子栅格 URL（文件名：`k因子.tif`）
     - `k_values_csv_url`：K 因子值的统计表 CSV URL
-    - `k_stats`：K 因子统计（`min/max/mean`，已将 `nodata` 与 `-9999` 视为缺失并忽略）
+    - `k_stats`：K 因子统计（`count/min/max/mean/std/histogram`，已将 `nodata` 与 `-9999` 视为缺失并忽略）
 
     错误响应（JSON）
     - `{"error": "not_a_zip_file", "filename": ..., "size": ...}`：`shp_zip` 不是有效 ZIP
     - `{"error": "bad_zip_file", "filename": ..., "size": ...}`：ZIP 文件损坏
     - `{"error": "no_shp_found_in_zip"}`：ZIP 内未找到 `.shp`
+    - `{"error": "dataset_not_found", ...}`：数据集 id 不存在
     """
     uid = uuid.uuid4().hex
     out_dir = outputs_dir / f"{uid}_k_factor"
     out_dir.mkdir(exist_ok=True)
-    raster_name = f"{uid}_{Path(raster_file.filename).name}"
-    raster_path = out_dir / raster_name
-    with raster_path.open("wb") as f:
-        raster_file.file.seek(0)
-        shutil.copyfileobj(raster_file.file, f)
-    shpzip_name = f"{uid}_{Path(shp_zip.filename).name}"
-    shpzip_path = out_dir / shpzip_name
-    with shpzip_path.open("wb") as f:
-        shp_zip.file.seek(0)
-        shutil.copyfileobj(shp_zip.file, f)
-    xls_ext = Path(attribute_xls.filename).suffix or ".xls"
-    xls_name = f"{uid}_{Path(attribute_xls.filename).stem}{xls_ext}"
-    xls_path = out_dir / xls_name
-    with xls_path.open("wb") as f:
-        attribute_xls.file.seek(0)
-        shutil.copyfileobj(attribute_xls.file, f)
-    shp_extract_dir = out_dir / "shp"
-    shp_extract_dir.mkdir(exist_ok=True)
-    if not zipfile.is_zipfile(str(shpzip_path)):
-        return {"error": "not_a_zip_file", "filename": shpzip_name, "size": os.path.getsize(shpzip_path)}
-    try:
-        with zipfile.ZipFile(str(shpzip_path), 'r') as zf:
-            for info in zf.infolist():
-                name = info.filename
-                fixed = name
-                if not (info.flag_bits & 0x800):
-                    for enc in ("utf-8", "gbk", "cp936"):
-                        try:
-                            fixed = name.encode("cp437").decode(enc)
-                            break
-                        except Exception:
-                            pass
-                target_path = shp_extract_dir / fixed
-                if info.is_dir() or name.endswith("/"):
-                    target_path.mkdir(parents=True, exist_ok=True)
-                else:
-                    target_path.parent.mkdir(parents=True, exist_ok=True)
-                    with zf.open(info) as src, target_path.open("wb") as dst:
-                        shutil.copyfileobj(src, dst)
-    except zipfile.BadZipFile:
-        return {"error": "bad_zip_file", "filename": shpzip_name, "size": os.path.getsize(shpzip_path)}
-    shp_candidates = list(shp_extract_dir.rglob("*.shp"))
-    if not shp_candidates:
-        return {"error": "no_shp_found_in_zip"}
-    shp_path = shp_candidates[0]
+    raster_meta, err = await resolve_input(dataset_store, raster_file, raster_dataset_id, "raster_file")
+    if err:
+        return err
+    shp_meta, err = await resolve_input(dataset_store, shp_zip, shp_dataset_id, "shp_zip")
+    if err:
+        return err
+    xls_meta, err = await resolve_input(dataset_store, attribute_xls, attribute_dataset_id, "attribute_xls")
+    if err:
+        return err
+    shp_path, err = locate_shp(shp_meta)
+    if err:
+        return err
+    xls_path = dataset_store.source_path(xls_meta)
+    outputs_store.record_job(out_dir, {"raster_file": raster_meta["id"], "shp_zip": shp_meta["id"], "attribute_xls": xls_meta["id"]})
     algo = importlib.import_module("submod.坡面物源算法.K因子")
     clipped_path = out_dir / "clipped.tif"
     attribute_tif_path = out_dir / "clipped_with_attributes.tif"
     k_tif_path = out_dir / "k因子.tif"
-    # 处理raster_file：支持ZIP（如HWSD：hwsd.bil/.hdr/.prj等）
-    raster_data_path = raster_path
-    try:
-        if zipfile.is_zipfile(str(raster_path)):
-            raster_extract_dir = out_dir / "raster"
-            raster_extract_dir.mkdir(exist_ok=True)
-            try:
-                with zipfile.ZipFile(str(raster_path), 'r') as zf:
-                    for info in zf.infolist():
-                        name = info.filename
-                        fixed = name
-                        if not (info.flag_bits & 0x800):
-                            for enc in ("utf-8", "gbk", "cp936"):
-                                try:
-                                    fixed = name.encode("cp437").decode(enc)
-                                    break
-                                except Exception:
-                                    pass
-                        target_path = raster_extract_dir / fixed
-                        if info.is_dir() or name.endswith("/"):
-                            target_path.mkdir(parents=True, exist_ok=True)
-                        else:
-                            target_path.parent.mkdir(parents=True, exist_ok=True)
-                            with zf.open(info) as src, target_path.open("wb") as dst:
-                                shutil.copyfileobj(src, dst)
-            except zipfile.BadZipFile:
-                return {"error": "bad_zip_file", "filename": raster_name, "size": os.path.getsize(raster_path)}
-            # 优先选择 .bil，其次 .tif
-            bil_candidates = list(raster_extract_dir.rglob("*.bil"))
-            tif_candidates = list(raster_extract_dir.rglob("*.tif"))
-            if bil_candidates:
-                raster_data_path = bil_candidates[0]
-            elif tif_candidates:
-                raster_data_path = tif_candidates[0]
-            else:
-                return {"error": "no_raster_found_in_zip"}
-    except Exception:
-        pass
+    # 处理raster_file：支持ZIP（如HWSD：hwsd.bil/.hdr/.prj等），通过 /vsizip/ 直接读取，.hdr/.prj 与 .bil 同目录即可被识别
+    raster_data_path = dataset_store.source_path(raster_meta)
+    if raster_meta["kind"] == "zip":
+        # 优先选择 .bil，其次 .tif
+        raster_candidates = dataset_store.archive_paths(raster_meta, [".bil", ".tif"])
+        if not raster_candidates:
+            return {"error": "no_raster_found_in_zip"}
+        raster_data_path = raster_candidates[0]
 
     clipped_raster = algo.clip_raster_with_shapefile(str(raster_data_path), str(shp_path), str(clipped_path))
     attribute_tif, attribute_csv = algo.create_raster_attribute_table(str(clipped_raster), str(xls_path), str(attribute_tif_path))
     k_tif, k_csv = algo.calculate_k_for_raster(str(attribute_tif), str(attribute_csv), str(k_tif_path))
-    import rasterio as rio
-    with rio.open(k_tif) as src:
-        data = src.read(1).astype(np.float32)
-        nodata = src.nodata
-        if nodata is not None:
-            data[data == nodata] = np.nan
-        data[data == -9999] = np.nan
-        k_stats = {
-            "min": float(np.nanmin(data)) if np.isfinite(np.nanmin(data)) else None,
-            "max": float(np.nanmax(data)) if np.isfinite(np.nanmax(data)) else None,
-            "mean": float(np.nanmean(data)) if np.isfinite(np.nanmean(data)) else None
-        }
+    cogify_dir(out_dir, categorical=("clipped.tif", "clipped_with_attributes.tif"))
+    k_stats, k_preview = result_summary(k_tif)
     base = str(request.base_url).rstrip("/")
     def url(name): return f"{base}/files/{uid}_k_factor/{name}"
     return {
         "id": uid,
-        "raster_url": url(raster_name),
-        "shp_zip_url": url(shpzip_name),
-        "attribute_xls_url": url(xls_name),
+        "datasets": {"raster_file": raster_meta["id"], "shp_zip": shp_meta["id"], "attribute_xls": xls_meta["id"]},
+        "raster_url": dataset_url(base, raster_meta),
+        "shp_zip_url": dataset_url(base, shp_meta),
+        "attribute_xls_url": dataset_url(base, xls_meta),
         "clipped_tif_url": url(Path(clipped_path).name),
         "attribute_tif_url": url(Path(attribute_tif).name),
         "attribute_csv_url": url(Path(attribute_csv).name),
         "k_tif_url": url(Path(k_tif).name),
         "k_values_csv_url": url(Path(k_csv).name),
-        "k_stats": k_stats
+        "k_stats": k_stats,
+        "k_preview_url": url(Path(k_preview).name) if k_preview else None
     }
 
 @router.post("/ls-factor")
-async def ls_factor(dem_file: UploadFile = File(...), target_resolution: float = Form(None), resample_method: str = Form("average"), chunk_size: int = Form(500), request: Request = None):
+async def ls_factor(dem_file: UploadFile = File(None), dem_dataset_id: str = Form(None), target_resolution: float = Form(None), resample_method: str = Form("average"), chunk_size: int = Form(500), request: Request = None):
+    """
+    功能
+    - LS 因子：由 DEM（`tif` 或含 `tif` 的 Zip）计算坡长坡度因子，可选重采样到 `target_resolution`
+    - `dem_dataset_id`：可选，代替 `dem_file`；超过 `UPLOAD_MAX_BYTES` 的请求在解析表单前即返回 HTTP 413；大文件请先经 `POST /datasets`、`PUT /datasets/stream` 或 `/uploads` 上传，再以 `*_dataset_id` 传入
+    """
     uid = uuid.uuid4().hex
     out_dir = outputs_dir / f"{uid}_ls_factor"
     out_dir.mkdir(exist_ok=True)
-    dem_name = f"{uid}_{Path(dem_file.filename).name}"
-    dem_path = out_dir / dem_name
-    with dem_path.open("wb") as f:
-        dem_file.file.seek(0)
-        shutil.copyfileobj(dem_file.file, f)
-    dem_data_path = dem_path
-    try:
-        if zipfile.is_zipfile(str(dem_path)):
-            dem_extract_dir = out_dir / "dem"
-            dem_extract_dir.mkdir(exist_ok=True)
-            try:
-                with zipfile.ZipFile(str(dem_path), 'r') as zf:
-                    for info in zf.infolist():
-                        name = info.filename
-                        fixed = name
-                        if not (info.flag_bits & 0x800):
-                            for enc in ("utf-8", "gbk", "cp936"):
-                                try:
-                                    fixed = name.encode("cp437").decode(enc)
-                                    break
-                                except Exception:
-                                    pass
-                        target_path = dem_extract_dir / fixed
-                        if info.is_dir() or name.endswith("/"):
-                            target_path.mkdir(parents=True, exist_ok=True)
-                        else:
-                            target_path.parent.mkdir(parents=True, exist_ok=True)
-                            with zf.open(info) as src, target_path.open("wb") as dst:
-                                shutil.copyfileobj(src, dst)
-            except zipfile.BadZipFile:
-                return {"error": "bad_zip_file", "filename": dem_name, "size": os.path.getsize(dem_path)}
-            tif_candidates = list(dem_extract_dir.rglob("*.tif")) + list(dem_extract_dir.rglob("*.tiff"))
-            if tif_candidates:
-                dem_data_path = tif_candidates[0]
-            else:
-                return {"error": "no_tif_found_in_zip"}
-    except Exception:
-        pass
+    dem_meta, err = await resolve_input(dataset_store, dem_file, dem_dataset_id, "dem_file")
+    if err:
+        return err
+    dem_data_path = dataset_store.source_path(dem_meta)
+    if dem_meta["kind"] == "zip":
+        tif_candidates = dataset_store.archive_paths(dem_meta, [".tif", ".tiff"])
+        if tif_candidates:
+            dem_data_path = tif_candidates[0]
+        else:
+            return {"error": "no_tif_found_in_zip"}
+    outputs_store.record_job(out_dir, {"dem_file": dem_meta["id"]})
     algo = importlib.import_module("submod.坡面物源算法.LS因子")
     ls_tif_path = out_dir / "LS因子.tif"
     import rasterio as rio
@@ -352,126 +343,75 @@ async def ls_factor(dem_file: UploadFile = File(...), target_resolution: float =
     result_file = algo.calculate_ls_factor(str(dem_data_path), str(ls_tif_path), cell_size=cell_size, chunk_size=int(chunk_size) if chunk_size else 500, target_resolution=target_resolution, resample_method=resample_method or "average")
     log_path = Path(str(ls_tif_path).replace(".tif", "_log.txt"))
     ls_stats = None
+    ls_preview = None
+    cogify_dir(out_dir)
     if result_file and Path(result_file).exists():
-        with rio.open(str(ls_tif_path)) as src:
-            data = src.read(1).astype(np.float32)
-            nodata = src.nodata
-            if nodata is not None:
-                data[data == nodata] = np.nan
-            data[data == -9999] = np.nan
-            ls_stats = {
-                "min": float(np.nanmin(data)) if np.isfinite(np.nanmin(data)) else None,
-                "max": float(np.nanmax(data)) if np.isfinite(np.nanmax(data)) else None,
-                "mean": float(np.nanmean(data)) if np.isfinite(np.nanmean(data)) else None
-            }
+        ls_stats, ls_preview = result_summary(ls_tif_path, colormap="magma")
     base = str(request.base_url).rstrip("/")
     def url(name): return f"{base}/files/{uid}_ls_factor/{name}"
     return {
         "id": uid,
-        "dem_url": url(dem_name),
+        "datasets": {"dem_file": dem_meta["id"]},
+        "dem_url": dataset_url(base, dem_meta),
         "ls_tif_url": url(Path(ls_tif_path).name),
         "log_url": url(Path(log_path).name),
-        "ls_stats": ls_stats
+        "ls_stats": ls_stats,
+        "ls_preview_url": url(Path(ls_preview).name) if ls_preview else None
     }
 
 @router.post("/p-factor/prepare")
-async def p_factor_prepare(category_tif: UploadFile = File(...), request: Request = None):
+async def p_factor_prepare(category_tif: UploadFile = File(None), category_dataset_id: str = Form(None), request: Request = None):
+    """
+    功能
+    - P 因子准备：列出土地利用分类栅格中的类别值，供前端填写 P 值映射
+    - `category_dataset_id`：可选，代替 `category_tif`；超过 `UPLOAD_MAX_BYTES` 的请求在解析表单前即返回 HTTP 413；大文件请先经 `POST /datasets`、`PUT /datasets/stream` 或 `/uploads` 上传，再以 `*_dataset_id` 传入
+    """
     uid = uuid.uuid4().hex
-    out_dir = outputs_dir / f"{uid}_p_factor"
-    out_dir.mkdir(exist_ok=True)
-    cat_name = f"{uid}_{Path(category_tif.filename).name}"
-    cat_path = out_dir / cat_name
-    with cat_path.open("wb") as f:
-        category_tif.file.seek(0)
-        shutil.copyfileobj(category_tif.file, f)
-    tif_path = None
-    if zipfile.is_zipfile(str(cat_path)):
-        extract_dir = out_dir / "cat"
-        extract_dir.mkdir(exist_ok=True)
-        try:
-            with zipfile.ZipFile(str(cat_path), 'r') as zf:
-                for info in zf.infolist():
-                    name = info.filename
-                    fixed = name
-                    if not (info.flag_bits & 0x800):
-                        for enc in ("utf-8", "gbk", "cp936"):
-                            try:
-                                fixed = name.encode("cp437").decode(enc)
-                                break
-                            except Exception:
-                                pass
-                    target_path = extract_dir / fixed
-                    if info.is_dir() or name.endswith("/"):
-                        target_path.mkdir(parents=True, exist_ok=True)
-                    else:
-                        target_path.parent.mkdir(parents=True, exist_ok=True)
-                        with zf.open(info) as src, target_path.open("wb") as dst:
-                            shutil.copyfileobj(src, dst)
-        except zipfile.BadZipFile:
-            return {"error": "bad_zip_file", "filename": cat_name, "size": os.path.getsize(cat_path)}
-        candidates = list(extract_dir.rglob("*.tif")) + list(extract_dir.rglob("*.tiff"))
+    cat_meta, err = await resolve_input(dataset_store, category_tif, category_dataset_id, "category_tif")
+    if err:
+        return err
+    tif_path = dataset_store.source_path(cat_meta)
+    if cat_meta["kind"] == "zip":
+        candidates = dataset_store.archive_paths(cat_meta, [".tif", ".tiff"])
         if candidates:
             tif_path = candidates[0]
         else:
             return {"error": "no_tif_found_in_zip"}
-    else:
-        tif_path = cat_path
     algo = importlib.import_module("submod.坡面物源算法.P因子")
     values = algo.prepare_p_values(str(tif_path))
     base = str(request.base_url).rstrip("/")
-    def url(name): return f"{base}/files/{uid}_p_factor/{name}"
     return {
         "id": uid,
-        "category_tif_url": url(cat_name),
+        "datasets": {"category_tif": cat_meta["id"]},
+        "category_tif_url": dataset_url(base, cat_meta),
         "values": [int(v) for v in values if int(v) != 255]
     }
 
 @router.post("/p-factor/apply")
-async def p_factor_apply(category_tif: UploadFile = File(...), value_p_mapping: str = Form(...), request: Request = None):
+async def p_factor_apply(category_tif: UploadFile = File(None), category_dataset_id: str = Form(None), value_p_mapping: str = Form(...), request: Request = None):
+    """
+    功能
+    - P 因子应用：按 `value_p_mapping`（JSON）把分类栅格映射为 P 因子栅格
+    - `category_dataset_id`：可选，代替 `category_tif`；超过 `UPLOAD_MAX_BYTES` 的请求在解析表单前即返回 HTTP 413；大文件请先经 `POST /datasets`、`PUT /datasets/stream` 或 `/uploads` 上传，再以 `*_dataset_id` 传入
+    """
     uid = uuid.uuid4().hex
     out_dir = outputs_dir / f"{uid}_p_factor"
     out_dir.mkdir(exist_ok=True)
-    cat_name = f"{uid}_{Path(category_tif.filename).name}"
-    cat_path = out_dir / cat_name
-    with cat_path.open("wb") as f:
-        category_tif.file.seek(0)
-        shutil.copyfileobj(category_tif.file, f)
     try:
         mapping = json.loads(value_p_mapping)
     except Exception:
         return {"error": "invalid_mapping_json"}
-    tif_path = None
-    if zipfile.is_zipfile(str(cat_path)):
-        extract_dir = out_dir / "cat"
-        extract_dir.mkdir(exist_ok=True)
-        try:
-            with zipfile.ZipFile(str(cat_path), 'r') as zf:
-                for info in zf.infolist():
-                    name = info.filename
-                    fixed = name
-                    if not (info.flag_bits & 0x800):
-                        for enc in ("utf-8", "gbk", "cp936"):
-                            try:
-                                fixed = name.encode("cp437").decode(enc)
-                                break
-                            except Exception:
-                                pass
-                    target_path = extract_dir / fixed
-                    if info.is_dir() or name.endswith("/"):
-                        target_path.mkdir(parents=True, exist_ok=True)
-                    else:
-                        target_path.parent.mkdir(parents=True, exist_ok=True)
-                        with zf.open(info) as src, target_path.open("wb") as dst:
-                            shutil.copyfileobj(src, dst)
-        except zipfile.BadZipFile:
-            return {"error": "bad_zip_file", "filename": cat_name, "size": os.path.getsize(cat_path)}
-        candidates = list(extract_dir.rglob("*.tif")) + list(extract_dir.rglob("*.tiff"))
+    cat_meta, err = await resolve_input(dataset_store, category_tif, category_dataset_id, "category_tif")
+    if err:
+        return err
+    tif_path = dataset_store.source_path(cat_meta)
+    if cat_meta["kind"] == "zip":
+        candidates = dataset_store.archive_paths(cat_meta, [".tif", ".tiff"])
         if candidates:
             tif_path = candidates[0]
         else:
             return {"error": "no_tif_found_in_zip"}
-    else:
-        tif_path = cat_path
+    outputs_store.record_job(out_dir, {"category_tif": cat_meta["id"]})
     algo = importlib.import_module("submod.坡面物源算法.P因子")
     output_tif = out_dir / "P因子.tif"
     result = algo.apply_p_mapping(str(tif_path), str(output_tif), mapping)
@@ -485,99 +425,150 @@ async def p_factor_apply(category_tif: UploadFile = File(...), value_p_mapping:
                 fpath = folder / f"{stem}{ext}"
                 if fpath.exists():
                     zf.write(str(fpath), arcname=f"{stem}{ext}")
+    cogify_dir(out_dir, categorical=("P因子.tif",))
+    p_stats, p_preview = result_summary(output_tif)
     base = str(request.base_url).rstrip("/")
     def url(name): return f"{base}/files/{uid}_p_factor/{name}"
     return {
         "id": uid,
-        "category_tif_url": url(cat_name),
+        "datasets": {"category_tif": cat_meta["id"]},
+        "category_tif_url": dataset_url(base, cat_meta),
         "p_tif_url": url(Path(output_tif).name),
         "attributes_zip_url": url(Path(attr_zip).name),
-        "mapping_used": result.get("mapping_used")
+        "mapping_used": result.get("mapping_used"),
+        "p_stats": p_stats,
+        "p_preview_url": url(Path(p_preview).name) if p_preview else None
     }
 
 @router.post("/r-factor")
-async def r_factor(years_zip: List[UploadFile] = File(...), shp_zip: UploadFile = File(...), scale_factor: float = Form(0.1), request: Request = None):
+async def r_factor(years_zip: List[UploadFile] = File(None), shp_zip: UploadFile = File(None), years_dataset_ids: List[str] = Form(None), shp_dataset_id: str = Form(None), scale_factor: float = Form(0.1), request: Request = None):
+    """
+    功能
+    - R 因子：由多年降雨 Zip（每年一个）与裁剪范围计算降雨侵蚀力因子
+    - `years_dataset_ids`/`shp_dataset_id`：可选，代替对应上传文件；多年降雨 Zip 通常较大，超过 `UPLOAD_MAX_BYTES` 的请求在解析表单前即返回 HTTP 413；请先经 `POST /datasets`、`PUT /datasets/stream` 或 `/uploads` 上传，再以 `*_dataset_id` 传入
+    """
     uid = uuid.uuid4().hex
     out_dir = outputs_dir / f"{uid}_r_factor"
     out_dir.mkdir(exist_ok=True)
-    def save_upload(up: UploadFile, name_suffix: str):
-        fname = f"{uid}_{Path(up.filename).name}"
-        fpath = out_dir / fname
-        with fpath.open("wb") as f:
-            up.file.seek(0)
-            shutil.copyfileobj(up.file, f)
-        return fname, fpath
-    year_zip_infos = []
-    for i, up in enumerate(years_zip):
-        name, path = save_upload(up, f"y{i+1}")
-        year_zip_infos.append((name, path))
-    shp_name, shp_zip_path = save_upload(shp_zip, "shp")
-    def extract_zip(zpath: Path, target_dir: Path):
-        target_dir.mkdir(exist_ok=True)
-        if not zipfile.is_zipfile(str(zpath)):
-            return {"error": "not_a_zip_file", "filename": zpath.name, "size": os.path.getsize(zpath)}, None
-        try:
-            with zipfile.ZipFile(str(zpath), 'r') as zf:
-                for info in zf.infolist():
-                    name = info.filename
-                    fixed = name
-                    if not (info.flag_bits & 0x800):
-                        for enc in ("utf-8", "gbk", "cp936"):
-                            try:
-                                fixed = name.encode("cp437").decode(enc)
-                                break
-                            except Exception:
-                                pass
-                    target_path = target_dir / fixed
-                    if info.is_dir() or name.endswith("/"):
-                        target_path.mkdir(parents=True, exist_ok=True)
-                    else:
-                        target_path.parent.mkdir(parents=True, exist_ok=True)
-                        with zf.open(info) as src, target_path.open("wb") as dst:
-                            shutil.copyfileobj(src, dst)
-        except zipfile.BadZipFile:
-            return {"error": "bad_zip_file", "filename": zpath.name, "size": os.path.getsize(zpath)}, None
-        return None, target_dir
-    year_dirs = []
-    for idx, (name, path) in enumerate(year_zip_infos, start=1):
-        err, ydir = extract_zip(path, out_dir / f"year{idx}")
+    year_metas = []
+    for dataset_id in years_dataset_ids or []:
+        meta, err = await resolve_input(dataset_store, None, dataset_id, "years_zip")
+        if err:
+            return err
+        year_metas.append(meta)
+    for up in years_zip or []:
+        meta, err = await resolve_input(dataset_store, up, None, "years_zip")
         if err:
             return err
-        year_dirs.append((name, ydir))
-    err3, shp_dir = extract_zip(shp_zip_path, out_dir / "shp")
-    if err3:
-        return err3
-    for _, ydir in year_dirs:
-        tifs = list(ydir.rglob("*.tif")) + list(ydir.rglob("*.tiff"))
+        year_metas.append(meta)
+    if not year_metas:
+        return {"error": "missing_input", "field": "years_zip"}
+    shp_meta, err = await resolve_input(dataset_store, shp_zip, shp_dataset_id, "shp_zip")
+    if err:
+        return err
+    year_files = []
+    for meta in year_metas:
+        if meta["kind"] != "zip":
+            return {"error": "not_a_zip_file", "filename": meta["filename"], "size": meta["size"]}
+        # 月文件可位于 ZIP 内任意层级，以 /vsizip/ 路径列表交给 R 因子直接读取
+        tifs = dataset_store.archive_paths(meta, [".tif", ".tiff"])
         if len(tifs) < 12:
-            return {"error": "insufficient_monthly_tifs", "year_dir": str(ydir), "count": len(tifs)}
-    shp_candidates = list(shp_dir.rglob("*.shp"))
-    if not shp_candidates:
-        return {"error": "no_shp_found_in_zip"}
-    shp_path = shp_candidates[0]
+            return {"error": "insufficient_monthly_tifs", "year_zip": meta["filename"], "count": len(tifs)}
+        year_files.append(tifs)
+    shp_path, err = locate_shp(shp_meta)
+    if err:
+        return err
+    outputs_store.record_job(out_dir, {"years_zip": [meta["id"] for meta in year_metas], "shp_zip": shp_meta["id"]})
     algo = importlib.import_module("submod.坡面物源算法.R因子")
     R_tif_path = out_dir / "R因子.tif"
-    folder_paths = [str(ydir) for _, ydir in year_dirs]
-    algo.calculate_rainfall_erosion_factor(folder_paths, str(shp_path), str(R_tif_path), scale_factor=scale_factor)
-    import rasterio as rio
-    R_stats = None
-    if R_tif_path.exists():
-        with rio.open(str(R_tif_path)) as src:
-            data = src.read(1).astype(np.float32)
-            nodata = src.nodata
-            if nodata is not None:
-                data[data == nodata] = np.nan
-            R_stats = {
-                "min": float(np.nanmin(data)) if np.isfinite(np.nanmin(data)) else None,
-                "max": float(np.nanmax(data)) if np.isfinite(np.nanmax(data)) else None,
-                "mean": float(np.nanmean(data)) if np.isfinite(np.nanmean(data)) else None
-            }
+    algo.calculate_rainfall_erosion_factor(year_files, str(shp_path), str(R_tif_path), scale_factor=scale_factor)
+    cogify_dir(out_dir)
+    R_stats, R_preview = result_summary(R_tif_path, colormap="Blues")
     base = str(request.base_url).rstrip("/")
     def url(name): return f"{base}/files/{uid}_r_factor/{name}"
     return {
         "id": uid,
-        "years_zip_url": [url(name) for name, _ in year_zip_infos],
-        "shp_zip_url": url(shp_name),
+        "datasets": {"years_zip": [meta["id"] for meta in year_metas], "shp_zip": shp_meta["id"]},
+        "years_zip_url": [dataset_url(base, meta) for meta in year_metas],
+        "shp_zip_url": dataset_url(base, shp_meta),
         "r_tif_url": url(Path(R_tif_path).name),
-        "r_stats": R_stats
+        "r_stats": R_stats,
+        "r_preview_url": url(Path(R_preview).name) if R_preview else None
+    }
+
+def locate_factor(meta):
+    """
+    因子栅格：ZIP 中取最大的 tif（/vsizip/ 路径），否则直接使用源文件
+    返回 (路径, 缓存用内容标识)；ZIP 的内容标识为 数据集 id + 成员名，未找到 tif 时返回 (None, None)
+    """
+    if meta["kind"] == "zip":
+        candidates = dataset_store.archive_paths(meta, [".tif", ".tiff"], exclude_aux=True, largest_first=True)
+        if not candidates:
+            return None, None
+        member = candidates[0][len(vsizip_path(dataset_store.source_path(meta), "")):]
+        return candidates[0], f"{meta['id']}:{member}"
+    return str(dataset_store.source_path(meta)), meta["id"]
+
+@router.post("/soil-loss")
+async def soil_loss(r_tif: UploadFile = File(None), k_tif: UploadFile = File(None), ls_tif: UploadFile = File(None), c_tif: UploadFile = File(None), p_tif: UploadFile = File(None),
+                    r_dataset_id: str = Form(None), k_dataset_id: str = Form(None), ls_dataset_id: str = Form(None), c_dataset_id: str = Form(None), p_dataset_id: str = Form(None), request: Request = None):
+    """
+    功能
+    - 按 RUSLE 计算土壤流失量 A = R·K·LS·C·P。
+    - 接口路径：`POST /soil-loss`
+    - 请求类型：`multipart/form-data`
+
+    输入参数
+    - `r_tif`/`k_tif`/`ls_tif`/`c_tif`/`p_tif`：各因子栅格（通常为上述因子接口的输出 `tif`，也可为含 `tif` 的 Zip，取其中最大的 `tif`）
+      - 输出网格跟随 `ls_tif`，其余因子自动重投影/重采样对齐
+    - `r_dataset_id`/`k_dataset_id`/`ls_dataset_id`/`c_dataset_id`/`p_dataset_id`：可选，数据集 id，提供时代替对应上传文件；超过 `UPLOAD_MAX_BYTES` 的请求在解析表单前即返回 HTTP 413；大文件请先经 `POST /datasets`、`PUT /datasets/stream` 或 `/uploads` 上传，再以 `*_dataset_id` 传入
+
+    缓存
+    - 对齐后的各因子与部分乘积 R·K·LS 按“内容哈希 + 参数”缓存于 `outputs/rusle_cache`
+    - 仅修改 P 映射或更换 C 的 NDVI 时，只需将缓存的 R·K·LS 与新的 C、P 分块相乘
+
+    输出结果（JSON）
+    - `id`：本次计算的唯一标识
+    - `a_tif_url`：土壤流失量栅格 URL（文件名：`土壤流失量.tif`）
+    - `a_stats`：土壤流失量统计（`count/min/max/mean/std/histogram`）
+    - `cache`：缓存统计 `{ hits, misses, entries }`，`entries` 为各因子及 `RKLS` 的 `hit/miss`
+    """
+    uid = uuid.uuid4().hex
+    out_dir = outputs_dir / f"{uid}_soil_loss"
+    out_dir.mkdir(exist_ok=True)
+    factor_paths = {}
+    factor_datasets = {}
+    content_hashes = {}
+    inputs = (
+        ("R", r_tif, r_dataset_id), ("K", k_tif, k_dataset_id), ("LS", ls_tif, ls_dataset_id),
+        ("C", c_tif, c_dataset_id), ("P", p_tif, p_dataset_id),
+    )
+    for key, up, dataset_id in inputs:
+        meta, err = await resolve_input(dataset_store, up, dataset_id, f"{key.lower()}_tif")
+        if err:
+            return err
+        factor_paths[key], content_hashes[key] = locate_factor(meta)
+        if factor_paths[key] is None:
+            return {"error": "no_tif_found_in_zip", "field": f"{key.lower()}_tif"}
+        factor_datasets[f"{key.lower()}_tif"] = meta["id"]
+    outputs_store.record_job(out_dir, factor_datasets)
+    algo = importlib.import_module("submod.坡面物源算法.土壤流失量")
+    a_tif_path = out_dir / "土壤流失量.tif"
+    try:
+        # 数据集 id 即内容 SHA-256，直接作为缓存键，不再重新读取因子栅格计算哈希；分块乘法在线程中执行，不阻塞事件循环
+        result = await asyncio.to_thread(algo.calculate_soil_loss, factor_paths, str(a_tif_path),
+                                         cache_dir=str(outputs_dir / "rusle_cache"), content_hashes=content_hashes)
+    except Exception as e:
+        return {"error": "soil_loss_failed", "message": str(e)}
+    cogify_dir(out_dir)
+    a_stats, a_preview = result_summary(a_tif_path, colormap="YlOrRd")
+    base = str(request.base_url).rstrip("/")
+    def url(name): return f"{base}/files/{uid}_soil_loss/{name}"
+    return {
+        "id": uid,
+        "datasets": factor_datasets,
+        "a_tif_url": url(a_tif_path.name),
+        "a_stats": a_stats,
+        "a_preview_url": url(Path(a_preview).name) if a_preview else None,
+        "cache": result["cache"]
     }
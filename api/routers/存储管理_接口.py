@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Header
+from fastapi.responses import JSONResponse
+from pathlib import Path
+import os
+import sys
+import asyncio
+
+router = APIRouter()
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.append(root_dir)
+
+from submod.公共.输出仓库 import OutputsStore
+
+base_dir = Path(root_dir)
+outputs_dir = base_dir / "outputs"
+outputs_dir.mkdir(exist_ok=True)
+outputs_store = OutputsStore(outputs_dir)
+
+# 设置环境变量 ADMIN_TOKEN 后，管理接口需在请求头 X-Admin-Token 中携带该值
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+
+def forbidden(token):
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    return None
+
+
+@router.get("/admin/storage")
+async def storage_usage(limit: int = 50, x_admin_token: str = Header(None)):
+    """
+    功能
+    - 查看 outputs 目录占用：配额、已用、按类型（任务/数据集/缓存）汇总，以及最久未访问的条目。
+    - 接口路径：`GET /admin/storage?limit=50`
+
+    输出结果（JSON）
+    - `quota_bytes`/`used_bytes`/`staging_bytes`（上传暂存与续传会话）
+    - `by_kind`：`{job|dataset|cache: {count, size}}`
+    - `entries`：按最近访问时间从旧到新排列的前 `limit` 个条目 `{name, kind, size, last_access, pinned}`，即下一次清理的候选顺序
+    """
+    denied = forbidden(x_admin_token)
+    if denied:
+        return denied
+    usage = await asyncio.to_thread(outputs_store.usage)
+    usage["entry_count"] = len(usage["entries"])
+    usage["entries"] = usage["entries"][:max(limit, 0)]
+    return usage
+
+
+@router.post("/admin/storage/sweep")
+async def storage_sweep(x_admin_token: str = Header(None)):
+    """
+    功能
+    - 立即执行一次清理：超出配额时按 LRU 删除未被引用的任务目录、数据集与缓存，返回被清理的条目。
+    """
+    denied = forbidden(x_admin_token)
+    if denied:
+        return denied
+    return await asyncio.to_thread(outputs_store.sweep)
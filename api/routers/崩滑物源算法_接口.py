@@ -3,52 +3,67 @@ from pathlib import Path
 import os
 import sys
 import uuid
-import shutil
 import importlib
-import numpy as np
-import rasterio
-
-router = APIRouter()
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 root_dir = os.path.dirname(current_dir)
 sys.path.append(root_dir)
 
+from submod.公共.数据集 import DatasetStore
+from submod.公共.上传 import UploadLimitRoute, resolve_input
+from submod.公共.输出仓库 import OutputsStore
+from submod.公共.栅格输出 import cogify_dir
+from submod.公共.统计 import result_summary
+
+# 超过上传上限的请求在解析表单前即返回 413
+router = APIRouter(route_class=UploadLimitRoute)
 
 base_dir = Path(root_dir)
 outputs_dir = base_dir / "outputs"
 outputs_dir.mkdir(exist_ok=True)
+dataset_store = DatasetStore(outputs_dir / "datasets")
+outputs_store = OutputsStore(outputs_dir)
 
 @router.post("/process-slbl")
-async def process_slbl(file: UploadFile = File(...), max_iter: int = Form(...), request: Request = None):
+async def process_slbl(file: UploadFile = File(None), max_iter: int = Form(...), dataset_id: str = Form(None), request: Request = None):
+    """
+    功能
+    - 崩滑物源 SLBL：由 DEM 迭代计算滑面并统计体积
+    - `dataset_id`：可选，代替 `file`；超过 `UPLOAD_MAX_BYTES` 的请求在解析表单前即返回 HTTP 413；大文件请先经 `POST /datasets`、`PUT /datasets/stream` 或 `/uploads` 上传，再以 `*_dataset_id` 传入
+    """
     uid = uuid.uuid4().hex
-    in_name = f"{uid}_{Path(file.filename).stem}.tif"
-    in_path = outputs_dir / in_name
-    with in_path.open("wb") as f:
-        shutil.copyfileobj(file.file, f)
+    in_meta, err = await resolve_input(dataset_store, file, dataset_id, "file")
+    if err:
+        return err
+    in_path = dataset_store.source_path(in_meta)
+    # 输出放在任务目录中，便于按任务统计占用与清理
+    out_dir = outputs_dir / f"{uid}_slbl"
+    out_dir.mkdir(exist_ok=True)
+    outputs_store.record_job(out_dir, {"file": in_meta["id"]})
 
-    
     algo = importlib.import_module("submod.崩滑物源算法")
-    calc_name = f"{uid}_calculated_slbl_with_correction.tif"
-    calc_path = outputs_dir / calc_name
+    calc_name = "calculated_slbl_with_correction.tif"
+    calc_path = out_dir / calc_name
     algo.main1(str(in_path), max_iter=max_iter, output_slbl_path=str(calc_path))
-    reproj_name = f"{uid}_ReprojectImage.tif"
-    reproj_path = outputs_dir / reproj_name
+    reproj_name = "ReprojectImage.tif"
+    reproj_path = out_dir / reproj_name
     algo.inputfilePath = str(calc_path)
     algo.referencefilefilePath = str(in_path)
     algo.outputfilePath = str(reproj_path)
     algo.ReprojectImages()
-    valid_mask, elevation_diff, output_data = algo.compute_volume_difference()
-    with rasterio.open(str(reproj_path)) as src:
-        transform = src.transform
-        pixel_area = abs(transform.a * transform.e)
-    total_volume_diff = abs(float(np.nansum(elevation_diff[valid_mask] * pixel_area)))
+    volume = algo.compute_volume_difference()
+    cogify_dir(out_dir)
+    calc_stats, calc_preview = result_summary(calc_path, colormap="terrain")
     base = str(request.base_url).rstrip("/")
     return {
         "id": uid,
-        "volume_diff_m3": total_volume_diff,
-        "calculated_tif_url": f"{base}/files/{calc_name}",
-        "reprojected_tif_url": f"{base}/files/{reproj_name}",
-        "input_tif_url": f"{base}/files/{in_name}"
+        "datasets": {"file": in_meta["id"]},
+        "volume_diff_m3": volume["volume"],
+        "volume": {k: volume[k] for k in ("count", "pixel_area", "fill_volume", "cut_volume", "net_volume")},
+        "calculated_tif_url": f"{base}/files/{uid}_slbl/{calc_name}",
+        "reprojected_tif_url": f"{base}/files/{uid}_slbl/{reproj_name}",
+        "calculated_stats": calc_stats,
+        "calculated_preview_url": f"{base}/files/{uid}_slbl/{Path(calc_preview).name}" if calc_preview else None,
+        "input_tif_url": f"{base}/files/{dataset_store.relative_path(in_path)}"
     }
 
@@ -0,0 +1,234 @@
+from fastapi import APIRouter, Request, Form, Header
+from fastapi.responses import JSONResponse, Response
+from pathlib import Path
+import os
+import re
+import sys
+import zipfile
+
+router = APIRouter()
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.append(root_dir)
+
+from submod.公共.数据集 import DatasetStore
+from submod.公共.上传 import (
+    MAX_UPLOAD_BYTES, UploadTooLarge, content_length_exceeds, too_large_error, ingest_multipart, ingest_stream
+)
+from submod.公共.输出仓库 import OutputsStore
+from submod.公共.续传 import (
+    ResumableUploads, UploadRangeError, UploadNotFound, UploadBusy, UploadIncomplete, ChecksumMismatch
+)
+
+base_dir = Path(root_dir)
+outputs_dir = base_dir / "outputs"
+outputs_dir.mkdir(exist_ok=True)
+dataset_store = DatasetStore(outputs_dir / "datasets")
+resumable_uploads = ResumableUploads(dataset_store)
+outputs_store = OutputsStore(outputs_dir)
+
+
+def dataset_response(meta, request):
+    # 新注册的数据集可能使占用超出配额
+    if meta.get("deduplicated") is False:
+        outputs_store.maybe_sweep()
+    base = str(request.base_url).rstrip("/")
+    data = dict(meta)
+    data["url"] = f"{base}/files/{dataset_store.relative_path(dataset_store.source_path(meta))}"
+    return data
+
+
+@router.post("/datasets")
+async def create_dataset(request: Request):
+    """
+    功能
+    - 上传数据集（DEM、NDVI、矢量 ZIP、降雨 ZIP 等），按内容 SHA-256 去重保存，ZIP 不解压，仅记录成员表，算法通过 `/vsizip/` 直接读取其中的栅格与矢量。
+    - 接口路径：`POST /datasets`
+    - 请求类型：`multipart/form-data`，文件字段名为 `file`
+    - 请求体以流的方式边接收边写入目标文件，同时计算哈希、识别类型并检查大小上限，上传大文件时不阻塞其他请求
+
+    输出结果（JSON）
+    - `id`：数据集 id（即内容 SHA-256），各算法接口的 `*_dataset_id` 参数可直接引用
+    - `filename`/`size`/`kind`（`zip`/`tif`/`file`）/`members`（ZIP 成员列表）
+    - `deduplicated`：内容已存在时为 `true`，不会重复保存
+    - `url`：原始文件的可访问 URL
+
+    错误响应（JSON）
+    - `{"error": "upload_too_large", "max_bytes": ...}`：超过 `UPLOAD_MAX_BYTES`（HTTP 413）
+    - `{"error": "bad_zip_file"}`：ZIP 文件损坏
+    - `{"error": "missing_input", "field": "file"}`：请求中没有文件
+    """
+    if content_length_exceeds(request):
+        return JSONResponse(too_large_error(), status_code=413)
+    try:
+        files, _ = await ingest_multipart(dataset_store, request)
+    except UploadTooLarge as e:
+        return JSONResponse(too_large_error(e.max_bytes), status_code=413)
+    except zipfile.BadZipFile:
+        return {"error": "bad_zip_file"}
+    metas = files.get("file") or [meta for group in files.values() for meta in group]
+    if not metas:
+        return {"error": "missing_input", "field": "file"}
+    return dataset_response(metas[0], request)
+
+
+@router.put("/datasets/stream")
+async def stream_dataset(filename: str, request: Request):
+    """
+    功能
+    - 以原始请求体（`application/octet-stream`）上传数据集，适合 GB 级 DEM：请求体逐块直接写入目标文件。
+    - 接口路径：`PUT /datasets/stream?filename=xxx.zip`
+    - 返回与 `POST /datasets` 相同
+    """
+    if content_length_exceeds(request):
+        return JSONResponse(too_large_error(), status_code=413)
+    try:
+        meta = await ingest_stream(dataset_store, request.stream(), filename, MAX_UPLOAD_BYTES)
+    except UploadTooLarge as e:
+        return JSONResponse(too_large_error(e.max_bytes), status_code=413)
+    except zipfile.BadZipFile:
+        return {"error": "bad_zip_file", "filename": filename}
+    return dataset_response(meta, request)
+
+
+@router.get("/datasets")
+async def list_datasets(request: Request = None):
+    return {"datasets": [dataset_response(meta, request) for meta in dataset_store.list()]}
+
+
+@router.get("/datasets/{dataset_id}")
+async def get_dataset(dataset_id: str, request: Request = None):
+    meta = dataset_store.get(dataset_id)
+    if meta is None:
+        return {"error": "dataset_not_found", "dataset_id": dataset_id}
+    return dataset_response(meta, request)
+
+
+def upload_headers(progress):
+    return {"Upload-Offset": str(progress["offset"]), "Upload-Length": str(progress["size"]), "Cache-Control": "no-store"}
+
+
+def parse_patch_offset(upload_offset, content_range):
+    """从 Upload-Offset 或 Content-Range（bytes start-end/total）中取写入起始偏移"""
+    if upload_offset is not None:
+        return int(upload_offset)
+    if content_range:
+        m = re.match(r"bytes\s+(\d+)-\d+/(\d+|\*)", content_range.strip())
+        if m:
+            return int(m.group(1))
+    return None
+
+
+@router.post("/uploads")
+async def create_upload(filename: str = Form(...), size: int = Form(...), sha256: str = Form(None)):
+    """
+    功能
+    - 创建断点续传会话，适合弱网环境下上传大 DEM ZIP、多年降雨 ZIP：连接中断后只需补传缺失的字节区间。
+    - 接口路径：`POST /uploads`
+    - 请求类型：`multipart/form-data` 或 `application/x-www-form-urlencoded`
+
+    输入参数
+    - `filename`：原始文件名
+    - `size`：文件总字节数（不能为负数，否则 HTTP 400 `{"error": "invalid_size"}`）
+    - `sha256`：可选，文件的 SHA-256，完成时用于校验
+
+    输出结果（JSON）
+    - `upload_id`、`size`、`received`、`offset`（从 0 开始连续已接收的字节数）、`missing`（缺失区间 `[start, end)` 列表）、`complete`
+    """
+    if size < 0:
+        return JSONResponse({"error": "invalid_size", "size": size}, status_code=400)
+    try:
+        state = resumable_uploads.create(filename, size, sha256)
+    except UploadTooLarge as e:
+        return JSONResponse(too_large_error(e.max_bytes), status_code=413)
+    progress = resumable_uploads.describe(state)
+    return JSONResponse(progress, status_code=201, headers=upload_headers(progress))
+
+
+@router.patch("/uploads/{upload_id}")
+async def patch_upload(upload_id: str, request: Request, upload_offset: str = Header(None), content_range: str = Header(None)):
+    """
+    功能
+    - 写入一段字节区间，请求体为原始字节（`application/offset+octet-stream` 或 `application/octet-stream`）。
+    - 起始偏移由请求头 `Upload-Offset: <start>` 或 `Content-Range: bytes <start>-<end>/<total>` 指定；各区间可乱序、并发发送。
+    - 连接中断时已写入的部分同样会被记录，返回与 `GET /uploads/{upload_id}` 相同的进度信息。
+    """
+    state = resumable_uploads.get(upload_id)
+    if state is None:
+        return JSONResponse({"error": "upload_not_found", "upload_id": upload_id}, status_code=404)
+    try:
+        start = parse_patch_offset(upload_offset, content_range)
+    except ValueError:
+        start = None
+    if start is None:
+        return JSONResponse({"error": "missing_upload_offset"}, status_code=400)
+    try:
+        state = await resumable_uploads.write_range(upload_id, start, request.stream())
+    except UploadNotFound:
+        # 写入期间会话已完成或被删除
+        return JSONResponse({"error": "upload_not_found", "upload_id": upload_id}, status_code=404)
+    except UploadRangeError as e:
+        state = resumable_uploads.get(upload_id)
+        if state is None:
+            return JSONResponse({"error": "upload_not_found", "upload_id": upload_id}, status_code=404)
+        progress = resumable_uploads.describe(state)
+        progress["error"] = "range_out_of_bounds"
+        progress["detail"] = str(e)
+        return JSONResponse(progress, status_code=416, headers=upload_headers(progress))
+    progress = resumable_uploads.describe(state)
+    return JSONResponse(progress, headers=upload_headers(progress))
+
+
+@router.head("/uploads/{upload_id}")
+async def head_upload(upload_id: str):
+    state = resumable_uploads.get(upload_id)
+    if state is None:
+        return Response(status_code=404)
+    return Response(headers=upload_headers(resumable_uploads.describe(state)))
+
+
+@router.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    state = resumable_uploads.get(upload_id)
+    if state is None:
+        return JSONResponse({"error": "upload_not_found", "upload_id": upload_id}, status_code=404)
+    progress = resumable_uploads.describe(state)
+    return JSONResponse(progress, headers=upload_headers(progress))
+
+
+@router.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, request: Request):
+    """
+    功能
+    - 所有区间到齐后校验 SHA-256 并注册为数据集，返回与 `POST /datasets` 相同的数据集信息，`id` 可用于各算法接口的 `*_dataset_id`。
+
+    错误响应（JSON）
+    - `{"error": "upload_incomplete", "missing": [...]}`：仍有缺失区间（HTTP 409）
+    - `{"error": "upload_in_progress", "writers": n}`：仍有 PATCH 请求正在写入，等其结束后重试（HTTP 409）
+    - `{"error": "checksum_mismatch", "expected": ..., "actual": ...}`：与声明的 SHA-256 不一致，会话已删除需重新上传（HTTP 422）
+    - `{"error": "bad_zip_file"}`：ZIP 文件损坏
+    """
+    if resumable_uploads.get(upload_id) is None:
+        return JSONResponse({"error": "upload_not_found", "upload_id": upload_id}, status_code=404)
+    try:
+        meta = await resumable_uploads.finalize(upload_id)
+    except UploadNotFound:
+        return JSONResponse({"error": "upload_not_found", "upload_id": upload_id}, status_code=404)
+    except UploadBusy as e:
+        return JSONResponse({"error": "upload_in_progress", "writers": e.writers}, status_code=409)
+    except UploadIncomplete as e:
+        return JSONResponse({"error": "upload_incomplete", "missing": e.missing}, status_code=409)
+    except ChecksumMismatch as e:
+        return JSONResponse({"error": "checksum_mismatch", "expected": e.expected, "actual": e.actual}, status_code=422)
+    except zipfile.BadZipFile:
+        return {"error": "bad_zip_file"}
+    return dataset_response(meta, request)
+
+
+@router.delete("/uploads/{upload_id}")
+async def delete_upload(upload_id: str):
+    if resumable_uploads.get(upload_id) is None:
+        return JSONResponse({"error": "upload_not_found", "upload_id": upload_id}, status_code=404)
+    resumable_uploads.delete(upload_id)
+    return {"upload_id": upload_id, "deleted": True}
@@ -1,24 +1,34 @@
 
-from fastapi import APIRouter, UploadFile, File, Request
+from fastapi import APIRouter, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse
 from pathlib import Path
+from typing import List
 import os
 import sys
 import uuid
-import shutil
-import zipfile
-import re
+import asyncio
+import traceback
 import importlib
 import importlib.util
 
-router = APIRouter()
-
 current_dir = os.path.dirname(os.path.abspath(__file__))
 root_dir = os.path.dirname(current_dir)
 sys.path.append(root_dir)
 
+from submod.公共.数据集 import DatasetStore
+from submod.公共.上传 import UploadLimitRoute, resolve_input
+from submod.公共.输出仓库 import OutputsStore
+from submod.公共.栅格输出 import cogify_dir
+from submod.公共.统计 import result_summary
+
+# 超过上传上限的请求在解析表单前即返回 413
+router = APIRouter(route_class=UploadLimitRoute)
+
 base_dir = Path(root_dir)
 outputs_dir = base_dir / "outputs"
 outputs_dir.mkdir(exist_ok=True)
+dataset_store = DatasetStore(outputs_dir / "datasets")
+outputs_store = OutputsStore(outputs_dir)
 
 # 导入封装后的算法模块
 # 注意：模块名包含中文括号，建议使用 importlib 动态导入
@@ -40,11 +50,23 @@ except Exception as e:
     print(f"Failed to import algorithm module: {e}")
     algo_module = None
 
+def locate_dem(dem_meta):
+    """DEM ZIP 不解压，取其中最大的 tif（按 ZIP 成员表中的解压后大小，过滤 aux.xml 等非数据文件）"""
+    if dem_meta["kind"] == "zip":
+        tif_candidates = dataset_store.archive_paths(dem_meta, [".tif", ".tiff"], exclude_aux=True, largest_first=True)
+        if tif_candidates:
+            return tif_candidates[0]
+    return None
+
 @router.post("/channel-source")
 async def channel_source_algorithm(
-    dem_zip: UploadFile = File(...),
-    boundary_kml: UploadFile = File(...),
-    profile_kml: UploadFile = File(...),
+    dem_zip: UploadFile = File(None),
+    boundary_kml: UploadFile = File(None),
+    profile_kml: UploadFile = File(None),
+    dem_dataset_id: str = Form(None),
+    boundary_dataset_id: str = Form(None),
+    profile_dataset_id: str = Form(None),
+    export_csv: bool = Form(True),
     request: Request = None
 ):
     """
@@ -52,6 +74,9 @@ async def channel_source_algorithm(
     - 沟道物源算法：调用后端脚本 `submod/沟道物源（完美）.py` 的 `run_algorithm` 函数。
     - 接口路径：`POST /channel-source`
     - 请求类型：`multipart/form-data`
+    - `dem_dataset_id`/`boundary_dataset_id`/`profile_dataset_id`：可选，`POST /datasets` 返回的数据集 id，提供时代替对应上传文件；超过 `UPLOAD_MAX_BYTES` 的请求在解析表单前即返回 HTTP 413；大文件请先经 `POST /datasets`、`PUT /datasets/stream` 或 `/uploads` 上传，再以 `*_dataset_id` 传入
+    - `export_csv`：可选，默认 `true`；是否导出中间点集 CSV（`files` 中的 `*_csv`），关闭时算法各阶段仍直接传递数组
+    - 返回 `volume`（体积，立方米）与 `volume_detail`（`run_algorithm` 返回的填方/挖方/净体积明细）
     """
     if not algo_module:
         return {"error": "Algorithm module not loaded"}
@@ -60,64 +85,27 @@ async def channel_source_algorithm(
     task_dir = outputs_dir / f"{uid}_channel_source"
     task_dir.mkdir(exist_ok=True)
 
-    # 1. 准备输入文件
+    # 1. 准备输入文件（上传文件或数据集 id，DEM ZIP 不解压，通过 /vsizip/ 直接读取）
     # 1.1 DEM
-    dem_zip_name = f"{uid}_{Path(dem_zip.filename).name}"
-    dem_zip_path = task_dir / dem_zip_name
-    with dem_zip_path.open("wb") as f:
-        dem_zip.file.seek(0)
-        shutil.copyfileobj(dem_zip.file, f)
-    
-    dem_extract_dir = task_dir / "dem_extracted"
-    dem_extract_dir.mkdir(exist_ok=True)
-    
-    dem_path = None
-    if zipfile.is_zipfile(str(dem_zip_path)):
-        try:
-            with zipfile.ZipFile(str(dem_zip_path), 'r') as zf:
-                for info in zf.infolist():
-                    name = info.filename
-                    # 解决中文编码
-                    try:
-                        name = name.encode('cp437').decode('gbk')
-                    except:
-                        try:
-                            name = name.encode('cp437').decode('utf-8')
-                        except:
-                            pass
-                    
-                    target_path = dem_extract_dir / name
-                    if info.is_dir() or name.endswith("/"):
-                        target_path.mkdir(parents=True, exist_ok=True)
-                    else:
-                        target_path.parent.mkdir(parents=True, exist_ok=True)
-                        with zf.open(info) as src, target_path.open("wb") as dst:
-                            shutil.copyfileobj(src, dst)
-        except Exception:
-            return {"error": "bad_zip_file"}
-            
-        tif_candidates = list(dem_extract_dir.rglob("*.tif")) + list(dem_extract_dir.rglob("*.tiff"))
-        # 过滤掉 aux.xml 等非数据文件
-        tif_candidates = [p for p in tif_candidates if "aux" not in p.name.lower()]
-        if tif_candidates:
-            # 简单策略：取最大的文件，通常是 DEM 数据
-            tif_candidates.sort(key=lambda x: x.stat().st_size, reverse=True)
-            dem_path = tif_candidates[0]
-    
+    dem_meta, err = await resolve_input(dataset_store, dem_zip, dem_dataset_id, "dem_zip")
+    if err:
+        return err
+    dem_path = locate_dem(dem_meta)
     if not dem_path:
         return {"error": "no_tif_found_in_zip"}
 
     # 1.2 Boundary KML
-    boundary_kml_path = task_dir / f"boundary_{uid}.kml"
-    with boundary_kml_path.open("wb") as f:
-        boundary_kml.file.seek(0)
-        shutil.copyfileobj(boundary_kml.file, f)
+    boundary_meta, err = await resolve_input(dataset_store, boundary_kml, boundary_dataset_id, "boundary_kml")
+    if err:
+        return err
+    boundary_kml_path = dataset_store.source_path(boundary_meta)
 
     # 1.3 Profile KML
-    profile_kml_path = task_dir / f"profile_{uid}.kml"
-    with profile_kml_path.open("wb") as f:
-        profile_kml.file.seek(0)
-        shutil.copyfileobj(profile_kml.file, f)
+    profile_meta, err = await resolve_input(dataset_store, profile_kml, profile_dataset_id, "profile_kml")
+    if err:
+        return err
+    profile_kml_path = dataset_store.source_path(profile_meta)
+    outputs_store.record_job(task_dir, {"dem_zip": dem_meta["id"], "boundary_kml": boundary_meta["id"], "profile_kml": profile_meta["id"]})
 
     # 2. 调用算法
     # 注入/Mock plt.show 以避免阻塞并保存图片
@@ -156,12 +144,13 @@ async def channel_source_algorithm(
         # 更好的做法是修改 run_algorithm 不依赖 os.chdir，而是传递 output_dir。
         # 但目前为了最小化修改，我们加个锁或者只能这样。
         
-        # 传入绝对路径
-        algo_module.run_algorithm(
-            dem_path=str(dem_path.absolute()),
+        # 传入绝对路径，返回体积计算结果字典（失败为 None）
+        volume_result = algo_module.run_algorithm(
+            dem_path=str(dem_path),
             boundary_kml=str(boundary_kml_path.absolute()),
             profile_kml=str(profile_kml_path.absolute()),
-            work_dir=str(task_dir.absolute())
+            work_dir=str(task_dir.absolute()),
+            export_csv=export_csv
         )
         
     except Exception as e:
@@ -183,7 +172,8 @@ async def channel_source_algorithm(
         # 切回原来的目录 (虽然 run_algorithm 内部已经切回去了，但为了保险)
         os.chdir(current_dir)
 
-    # 3. 收集结果
+    # 3. 收集结果（栅格结果转换为 COG）
+    cogify_dir(task_dir)
     expected_files = {
         "x123_csv": "每组X1_X2_X3坐标点.csv",
         "bspline_csv": "B样条点坐标.csv",
@@ -208,25 +198,154 @@ async def channel_source_algorithm(
         if url:
             result_urls[key] = url
 
+    # 生成的 DEM 的统计与预览图
+    raster_stats = {}
+    preview_urls = {}
+    for key in ("generated_dem", "final_clipped_dem"):
+        if key in result_urls:
+            stats, preview = result_summary(task_dir / expected_files[key], colormap="terrain")
+            raster_stats[key] = stats
+            preview_urls[key] = get_url(Path(preview).name) if preview else None
+
     # 查找生成的图片
     images = list(task_dir.glob("figure_*.png"))
     image_urls = [get_url(img.name) for img in images]
     
-    # 解析体积结果 (从 stdout)
     stdout_content = my_stdout.getvalue()
-    volume = None
-    if stdout_content:
-        match = re.search(r"修正后体积计算结果:\s*([-\d.]+)\s*立方米", stdout_content)
-        if match:
-            volume = float(match.group(1))
+    volume = volume_result["volume"] if volume_result and volume_result["count"] else None
 
     return {
         "id": uid,
+        "datasets": {"dem_zip": dem_meta["id"], "boundary_kml": boundary_meta["id"], "profile_kml": profile_meta["id"]},
         "volume": volume,
+        "volume_detail": volume_result,
         "visualization_urls": image_urls,
         "files": result_urls,
+        "stats": raster_stats,
+        "preview_urls": preview_urls,
         "logs": {
             "stdout": stdout_content[:5000],
             "stderr": my_stderr.getvalue()[:5000]
         }
     }
+
+
+async def resolve_inputs(dataset_ids, uploads, field):
+    """按“数据集 id 在前、上传文件在后”的顺序解析多个输入"""
+    metas = []
+    for dataset_id in dataset_ids or []:
+        meta, err = await resolve_input(dataset_store, None, dataset_id, field)
+        if err:
+            return None, err
+        metas.append(meta)
+    for upload in uploads or []:
+        meta, err = await resolve_input(dataset_store, upload, None, field)
+        if err:
+            return None, err
+        metas.append(meta)
+    return metas, None
+
+@router.post("/channel-source/batch")
+async def channel_source_batch(
+    dem_zip: UploadFile = File(None),
+    boundary_kmls: List[UploadFile] = File(None),
+    profile_kmls: List[UploadFile] = File(None),
+    dem_dataset_id: str = Form(None),
+    boundary_dataset_ids: List[str] = Form(None),
+    profile_dataset_ids: List[str] = Form(None),
+    workers: int = Form(None),
+    export_csv: bool = Form(True),
+    request: Request = None
+):
+    """
+    功能
+    - 沟道物源批量计算：一个 DEM + 多条沟道，DEM 只上传、准备一次，各沟道在独立进程中并行计算
+    - 接口路径：`POST /channel-source/batch`
+    - 请求类型：`multipart/form-data`
+
+    输入参数
+    - `dem_zip`/`dem_dataset_id`：DEM ZIP，同 `/channel-source`；超过 `UPLOAD_MAX_BYTES` 的请求在解析表单前即返回 HTTP 413；大文件请先经 `POST /datasets`、`PUT /datasets/stream` 或 `/uploads` 上传，再以 `*_dataset_id` 传入
+    - `boundary_kmls`、`profile_kmls`：边界/剖面线 KML，可重复；`boundary_dataset_ids`、`profile_dataset_ids` 为对应的数据集 id（排在上传文件之前）
+      - 多对：按顺序一一配对，每对为一条沟道（名称取边界 KML 文件名）
+      - 各一个：多要素模式，边界 KML 中每个多边形为一条沟道，剖面线归入与其相交的多边形
+    - `workers`：可选，并行进程数，默认 `CHANNEL_BATCH_WORKERS`（环境变量，默认 min(4, CPU 数)）
+    - `export_csv`：可选，默认 `true`，同 `/channel-source`
+
+    输出结果
+    - `gullies`：每条沟道 `{ name, status（ok/failed）, error, volume, volume_detail, files, stats, preview_urls, visualization_urls, logs }`，
+      `files` 的键与 `/channel-source` 相同，结果在任务目录 `{id}_channel_batch/{序号}_{名称}/` 下
+    - `total_volume`：成功沟道的体积合计（立方米）；`succeeded`/`failed`：成功/失败条数
+    - `unassigned_profiles`：多要素模式下未与任何多边形相交的剖面线数
+    """
+    dem_meta, err = await resolve_input(dataset_store, dem_zip, dem_dataset_id, "dem_zip")
+    if err:
+        return err
+    dem_path = locate_dem(dem_meta)
+    if not dem_path:
+        return {"error": "no_tif_found_in_zip"}
+    boundary_metas, err = await resolve_inputs(boundary_dataset_ids, boundary_kmls, "boundary_kmls")
+    if err:
+        return err
+    profile_metas, err = await resolve_inputs(profile_dataset_ids, profile_kmls, "profile_kmls")
+    if err:
+        return err
+    if not boundary_metas:
+        return {"error": "missing_input", "field": "boundary_kmls"}
+    if len(boundary_metas) != len(profile_metas):
+        return JSONResponse({"error": "boundary_profile_count_mismatch", "boundaries": len(boundary_metas),
+                             "profiles": len(profile_metas)}, status_code=400)
+    if workers is not None and workers < 1:
+        return JSONResponse({"error": "invalid_workers", "workers": workers}, status_code=400)
+
+    uid = uuid.uuid4().hex
+    task_dir = outputs_dir / f"{uid}_channel_batch"
+    task_dir.mkdir(exist_ok=True)
+    datasets = {"dem_zip": dem_meta["id"], "boundary_kmls": [m["id"] for m in boundary_metas],
+                "profile_kmls": [m["id"] for m in profile_metas]}
+    outputs_store.record_job(task_dir, datasets)
+
+    batch = importlib.import_module("submod.沟道物源批量")
+    unassigned = None
+    if len(boundary_metas) == 1:
+        try:
+            gullies, unassigned = await asyncio.to_thread(
+                batch.split_gullies, str(dataset_store.source_path(boundary_metas[0])),
+                str(dataset_store.source_path(profile_metas[0])), str(task_dir))
+        except Exception as e:
+            return JSONResponse({"error": "invalid_kml", "message": str(e)}, status_code=400)
+    else:
+        gullies = [{"name": Path(b["filename"]).stem,
+                    "boundary_kml": str(dataset_store.source_path(b).absolute()),
+                    "profile_kml": str(dataset_store.source_path(p).absolute())}
+                   for b, p in zip(boundary_metas, profile_metas)]
+
+    results = await asyncio.to_thread(batch.run_batch, str(dem_path), gullies, str(task_dir),
+                                      workers=workers, export_csv=export_csv)
+
+    base_url = str(request.base_url).rstrip("/")
+    def url(*parts): return f"{base_url}/files/{uid}_channel_batch/" + "/".join(parts)
+    items = []
+    for r in results:
+        volume = r["volume"]
+        items.append({
+            "name": r["name"],
+            "status": r["status"],
+            "error": r["error"],
+            "volume": volume["volume"] if volume and volume["count"] else None,
+            "volume_detail": volume,
+            "files": {key: url(r["dir"], name) for key, name in r["files"].items()},
+            "stats": r["stats"],
+            "preview_urls": {key: url(r["dir"], name) if name else None for key, name in r["previews"].items()},
+            "visualization_urls": [url(r["dir"], name) for name in r["figures"]],
+            "logs": r["log"],
+        })
+    ok = [item for item in items if item["status"] == "ok"]
+    return {
+        "id": uid,
+        "datasets": datasets,
+        "total_volume": sum(item["volume"] or 0 for item in ok),
+        "succeeded": len(ok),
+        "failed": len(items) - len(ok),
+        "unassigned_profiles": unassigned,
+        "gullies": items,
+    }
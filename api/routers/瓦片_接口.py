@@ -0,0 +1,71 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response
+from pathlib import Path
+import os
+import sys
+import asyncio
+
+router = APIRouter()
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(current_dir)
+sys.path.append(root_dir)
+
+from submod.公共.瓦片 import TileCache, render_tile, tilejson
+
+base_dir = Path(root_dir)
+outputs_dir = base_dir / "outputs"
+outputs_dir.mkdir(exist_ok=True)
+tile_cache = TileCache(outputs_dir / "tile_cache")
+
+
+def locate_raster(dataset):
+    """将 /files 下的相对路径解析为 outputs 内的栅格文件，越界或不存在返回 None"""
+    root = outputs_dir.resolve()
+    path = (outputs_dir / dataset).resolve()
+    if root not in path.parents or not path.is_file() or path.suffix.lower() not in (".tif", ".tiff"):
+        return None
+    return path
+
+
+@router.get("/tiles/{dataset:path}/tilejson.json")
+async def get_tilejson(dataset: str, colormap: str = "viridis", stretch: str = "p2", band: int = 1, request: Request = None):
+    path = locate_raster(dataset)
+    if path is None:
+        return JSONResponse({"error": "raster_not_found", "dataset": dataset}, status_code=404)
+    base = str(request.base_url).rstrip("/")
+    tiles_url = f"{base}/tiles/{dataset}/{{z}}/{{x}}/{{y}}.png?colormap={colormap}&stretch={stretch}" + (f"&band={band}" if band != 1 else "")
+    try:
+        return await asyncio.to_thread(tilejson, str(path), tiles_url)
+    except ValueError as e:
+        return JSONResponse({"error": "invalid_raster", "message": str(e)}, status_code=400)
+
+
+@router.get("/tiles/{dataset:path}/{z}/{x}/{y}.png")
+async def get_tile(dataset: str, z: int, x: int, y: int, colormap: str = "viridis", stretch: str = "p2",
+                   vmin: float = None, vmax: float = None, resampling: str = "bilinear", band: int = 1):
+    """
+    功能
+    - 按 XYZ（Web Mercator）切片渲染任意输出栅格为 256×256 PNG，只读取瓦片覆盖的窗口，缩小时自动使用概览层。
+    - 接口路径：`GET /tiles/{dataset}/{z}/{x}/{y}.png`，`dataset` 为 `/files/` 之后的相对路径，如 `{id}_ls_factor/LS因子.tif`
+
+    输入参数（查询）
+    - `colormap`：matplotlib 色带名，默认 `viridis`（如 `terrain`、`RdYlGn`、`Spectral`）
+    - `stretch`：自动拉伸方式 `p2`（2%–98%，默认）/`p5`/`minmax`，由最小概览层估计
+    - `vmin`/`vmax`：可选，固定拉伸范围，优先于 `stretch`
+    - `resampling`：`bilinear`（默认）/`nearest`（分类栅格）/`average`
+    - `band`：多波段栅格的波段号，默认 `1`（如 C 因子多波段产品：1 NDVI、2 f、3 C）
+
+    输出结果
+    - PNG 图片，NODATA 透明；响应头 `X-Tile-Cache` 为 `memory`/`disk`/`miss`
+    """
+    path = locate_raster(dataset)
+    if path is None:
+        return JSONResponse({"error": "raster_not_found", "dataset": dataset}, status_code=404)
+    if z < 0 or z > 24 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return JSONResponse({"error": "invalid_tile", "z": z, "x": x, "y": y}, status_code=400)
+    try:
+        png, hit = await asyncio.to_thread(render_tile, str(path), z, x, y, tile_cache, colormap, stretch, vmin, vmax, resampling, band)
+    except ValueError as e:
+        return JSONResponse({"error": "invalid_tile_request", "message": str(e)}, status_code=400)
+    return Response(png, media_type="image/png", headers={"Cache-Control": "public, max-age=3600", "X-Tile-Cache": hit})
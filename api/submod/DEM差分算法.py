@@ -0,0 +1,131 @@
+import csv
+import math
+import os
+import shutil
+import tempfile
+
+import geopandas as gpd
+from rasterio.crs import CRS
+from rasterio.warp import transform_bounds
+from shapely.geometry import mapping
+
+from submod.公共.体积 import dem_difference_volume, raster_grid, warp_to_grid
+
+# 对齐网格的选择方式：coarser/finer 取分辨率较粗/较细的一幅，pre/post 指定前期/后期 DEM
+GRID_CHOICES = ("coarser", "finer", "pre", "post")
+DIFF_FILE = "DEM差值.tif"
+ZONES_CSV = "分区体积.csv"
+
+
+def choose_reference(pre_ds, post_ds, grid):
+    """按 grid 选择参考 DEM，返回 (参考数据集, 另一幅数据集)"""
+    if grid not in GRID_CHOICES:
+        raise ValueError(f"grid 只能为 {'/'.join(GRID_CHOICES)}")
+    if grid == "pre":
+        return pre_ds, post_ds
+    if grid == "post":
+        return post_ds, pre_ds
+    pre_res = max(raster_grid(pre_ds)[2:])
+    post_res = max(raster_grid(post_ds)[2:])
+    post_first = post_res > pre_res if grid == "coarser" else post_res < pre_res
+    return (post_ds, pre_ds) if post_first else (pre_ds, post_ds)
+
+
+def intersect_bounds(a, b):
+    minx, miny = max(a[0], b[0]), max(a[1], b[1])
+    maxx, maxy = min(a[2], b[2]), min(a[3], b[3])
+    if minx >= maxx or miny >= maxy:
+        return None
+    return minx, miny, maxx, maxy
+
+
+def read_zones(zones_path, dst_wkt, zone_field=None):
+    """读取分区多边形并投影到 DEM 坐标系，返回 (GeoJSON 几何列表, 名称列表, 外包框)"""
+    gdf = gpd.read_file(zones_path)
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+    if gdf.empty:
+        raise ValueError("分区矢量中没有有效的多边形")
+    if gdf.crs is not None and dst_wkt:
+        gdf = gdf.to_crs(dst_wkt)
+    if zone_field and zone_field not in gdf.columns:
+        raise ValueError(f"分区矢量中没有字段: {zone_field}")
+    names = [str(v) for v in gdf[zone_field]] if zone_field else [str(i + 1) for i in range(len(gdf))]
+    return [mapping(geom) for geom in gdf.geometry], names, tuple(gdf.total_bounds)
+
+
+def write_zone_csv(path, zones):
+    fields = ["zone", "name", "count", "fill_volume", "cut_volume", "net_volume"]
+    with open(path, "w", newline='', encoding="utf-8-sig") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(zones)
+
+
+def run_dem_diff(pre_path, post_path, output_dir, zones_path=None, zone_field=None, grid="coarser", resolution=None):
+    """
+    前后两期 DEM 差分：对齐到同一网格后逐块计算 后期 - 前期 的高差，正值为填方（堆积），负值为挖方（侵蚀）。
+    :param grid: 对齐网格，coarser（默认）/finer/pre/post，投影与分辨率取自所选 DEM
+    :param resolution: 可选，指定对齐分辨率（米），覆盖所选 DEM 的分辨率
+    :param zones_path: 可选的分区多边形矢量；提供时只统计分区内像元，并输出各分区体积
+    :return: 结果字典（grid、体积、zones、输出文件路径）
+    """
+    # GDAL 在此处导入，接口模块可直接引用 GRID_CHOICES 而不在启动时加载 GDAL
+    from osgeo import gdal
+
+    os.makedirs(output_dir, exist_ok=True)
+    pre_ds = gdal.Open(str(pre_path), gdal.GA_ReadOnly)
+    post_ds = gdal.Open(str(post_path), gdal.GA_ReadOnly)
+    if pre_ds is None or post_ds is None:
+        raise ValueError("无法打开 DEM")
+
+    ref_ds, other_ds = choose_reference(pre_ds, post_ds, grid)
+    dst_wkt, ref_bounds, res_x, res_y = raster_grid(ref_ds)
+    if resolution:
+        res_x = res_y = float(resolution)
+
+    # 公共范围：另一幅 DEM 的范围投影到参考坐标系后取交集，有分区时再与分区外包框取交集
+    other_wkt, other_bounds, _, _ = raster_grid(other_ds)
+    if other_wkt and dst_wkt and other_wkt != dst_wkt:
+        other_bounds = transform_bounds(CRS.from_wkt(other_wkt), CRS.from_wkt(dst_wkt), *other_bounds)
+    bounds = intersect_bounds(ref_bounds, other_bounds)
+    zones, names = None, None
+    if bounds is not None and zones_path:
+        zones, names, zone_bounds = read_zones(zones_path, dst_wkt, zone_field)
+        bounds = intersect_bounds(bounds, zone_bounds)
+    if bounds is None:
+        raise ValueError("两幅 DEM（及分区）无重叠区域")
+
+    # 网格左上角取公共范围左上角，行列数向上取整覆盖整个范围
+    minx, miny, maxx, maxy = bounds
+    width = max(1, math.ceil((maxx - minx) / res_x))
+    height = max(1, math.ceil((maxy - miny) / res_y))
+    out_bounds = (minx, maxy - height * res_y, minx + width * res_x, maxy)
+    print(f"对齐网格: {width}x{height}，分辨率 {res_x}×{res_y}")
+
+    # 对齐结果写为临时分块 GTiff，差分时逐块读取，不在内存中保留整幅对齐 DEM
+    aligned_dir = tempfile.mkdtemp(prefix="aligned_", dir=output_dir)
+    try:
+        aligned = [warp_to_grid(ds, out_bounds, width, height, dst_wkt, out_path=os.path.join(aligned_dir, f"{name}.tif"),
+                                default_nodata=None, dst_nodata=float('nan'), output_type=gdal.GDT_Float32)
+                   for name, ds in (("pre", pre_ds), ("post", post_ds))]
+        diff_path = os.path.join(output_dir, DIFF_FILE)
+        result = dem_difference_volume(aligned[1], aligned[0], diff_path=diff_path, zones=zones)
+    finally:
+        aligned = None
+        shutil.rmtree(aligned_dir, ignore_errors=True)
+    print(f"填方: {result['fill_volume']:.2f} 立方米，挖方: {result['cut_volume']:.2f} 立方米，净体积: {result['net_volume']:.2f} 立方米")
+
+    result["grid"] = {
+        "reference": "post" if ref_ds is post_ds else "pre",
+        "width": width,
+        "height": height,
+        "resolution": [res_x, res_y],
+        "bounds": list(out_bounds),
+        "crs": CRS.from_wkt(dst_wkt).to_string() if dst_wkt else None,
+    }
+    result["zones_csv_path"] = None
+    if zones is not None:
+        result["zones"] = [dict(zone=i + 1, name=name, **stats) for i, (name, stats) in enumerate(zip(names, result["zones"]))]
+        result["zones_csv_path"] = os.path.join(output_dir, ZONES_CSV)
+        write_zone_csv(result["zones_csv_path"], result["zones"])
+    return result
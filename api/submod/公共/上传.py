@@ -0,0 +1,271 @@
+import os
+import shutil
+import asyncio
+import hashlib
+import zipfile
+from pathlib import Path
+
+import aiofiles
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from submod.公共.数据集 import detect_kind
+
+CHUNK_SIZE = 1 << 20
+# 单个上传文件的大小上限（字节），可通过环境变量 UPLOAD_MAX_BYTES 配置，默认 8 GiB
+MAX_UPLOAD_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 8 << 30))
+# 普通（非文件）表单字段的大小上限
+MAX_FIELD_BYTES = 1 << 20
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes):
+        super().__init__(f"上传文件超过大小上限 {max_bytes} 字节")
+        self.max_bytes = max_bytes
+
+
+def too_large_error(max_bytes=MAX_UPLOAD_BYTES):
+    return {"error": "upload_too_large", "max_bytes": max_bytes}
+
+
+def content_length_exceeds(request, max_bytes=MAX_UPLOAD_BYTES):
+    """请求头声明的长度已超过上限时返回 True，用于在读取请求体之前提前拒绝"""
+    try:
+        return int(request.headers.get("content-length", 0)) > max_bytes
+    except ValueError:
+        return False
+
+
+class UploadLimitRoute(APIRoute):
+    """
+    算法接口的路由类：在 FastAPI 解析表单之前检查 Content-Length，超过上限直接返回 HTTP 413。
+    （依赖项在表单解析之后才执行，而 Starlette 解析表单时会先把整个请求体落盘，因此只能在路由处理器外层检查。）
+    大文件应先经 POST /datasets、PUT /datasets/stream 或 /uploads 流式注册，再以 *_dataset_id 传入。
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def limited_handler(request):
+            if content_length_exceeds(request):
+                return JSONResponse(too_large_error(), status_code=413)
+            return await handler(request)
+
+        return limited_handler
+
+
+class StreamingFileWriter:
+    """
+    将数据块异步写入目标文件，同时计算 SHA-256、记录文件头用于类型识别，并在超过大小上限时立即中止。
+    数据按 CHUNK_SIZE 聚合后，哈希计算（hashlib 会释放 GIL）与磁盘写入并发执行，均不阻塞事件循环。
+    """
+
+    def __init__(self, path, max_bytes=MAX_UPLOAD_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.head = b""
+        self._hash = hashlib.sha256()
+        self._buffer = []
+        self._buffered = 0
+        self._file = None
+
+    async def open(self):
+        self._file = await aiofiles.open(self.path, "wb")
+        return self
+
+    async def write(self, data):
+        if not data:
+            return
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        if len(self.head) < 8:
+            self.head += data[:8 - len(self.head)]
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= CHUNK_SIZE:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._buffer:
+            return
+        block = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        await asyncio.gather(asyncio.to_thread(self._hash.update, block), self._file.write(block))
+
+    async def close(self):
+        """写完剩余数据并关闭文件，返回 (sha256, size)"""
+        await self._flush()
+        await self._file.close()
+        return self._hash.hexdigest(), self.size
+
+    async def abort(self):
+        if self._file is not None:
+            await self._file.close()
+        self.path.unlink(missing_ok=True)
+
+
+async def ingest_stream(store, chunks, filename, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    将异步数据块流直接写入数据集仓库的暂存目录并注册（不经过额外的临时文件）
+
+    参数:
+    store: DatasetStore
+    chunks: 异步可迭代的 bytes 块，如 request.stream()
+    filename: 原始文件名
+    """
+    filename = Path(filename or "upload").name
+    staging = store.new_staging_dir()
+    writer = StreamingFileWriter(staging / "source" / filename, max_bytes)
+    try:
+        await writer.open()
+        async for chunk in chunks:
+            await writer.write(chunk)
+        sha256, size = await writer.close()
+    except BaseException:
+        await writer.abort()
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    kind = detect_kind(writer.head, filename)
+    # 去重检查与读取 ZIP 成员表涉及磁盘 IO，放到线程中执行
+    return await asyncio.to_thread(store.commit, staging, filename, sha256, size, kind)
+
+
+async def upload_chunks(upload):
+    """按块异步读取 FastAPI UploadFile（文件已落盘时 read 在线程池中执行）"""
+    await upload.seek(0)
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def ingest_upload(store, upload, max_bytes=MAX_UPLOAD_BYTES):
+    size = getattr(upload, "size", None)
+    if size is not None and size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+    return await ingest_stream(store, upload_chunks(upload), upload.filename, max_bytes)
+
+
+async def ingest_multipart(store, request, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    流式解析 multipart/form-data 请求体：文件字段边接收边写入数据集仓库，不经 Starlette 先行落盘。
+
+    返回:
+    (files, fields) -- files 为 {字段名: [数据集元数据, ...]}，fields 为普通表单字段 {字段名: 字符串}
+    """
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise ValueError("缺少 multipart boundary")
+
+    events = []
+    callbacks = {
+        "on_part_begin": lambda: events.append(("part_begin", b"")),
+        "on_part_data": lambda data, start, end: events.append(("part_data", data[start:end])),
+        "on_part_end": lambda: events.append(("part_end", b"")),
+        "on_header_field": lambda data, start, end: events.append(("header_field", data[start:end])),
+        "on_header_value": lambda data, start, end: events.append(("header_value", data[start:end])),
+        "on_header_end": lambda: events.append(("header_end", b"")),
+        "on_headers_finished": lambda: events.append(("headers_finished", b"")),
+    }
+    parser = MultipartParser(boundary, callbacks)
+
+    files = {}
+    fields = {}
+    headers = {}
+    header_field = b""
+    header_value = b""
+    field_name = None
+    field_value = bytearray()
+    filename = None
+    staging = None
+    writer = None
+
+    async def handle(event, data):
+        nonlocal header_field, header_value, headers, field_name, field_value, filename, staging, writer
+        if event == "part_begin":
+            headers = {}
+            field_value = bytearray()
+            writer = None
+        elif event == "header_field":
+            header_field += data
+        elif event == "header_value":
+            header_value += data
+        elif event == "header_end":
+            headers[header_field.lower()] = header_value
+            header_field = b""
+            header_value = b""
+        elif event == "headers_finished":
+            _, options = parse_options_header(headers.get(b"content-disposition", b""))
+            field_name = options.get(b"name", b"").decode("utf-8", "replace")
+            raw_filename = options.get(b"filename")
+            if raw_filename is not None:
+                filename = Path(raw_filename.decode("utf-8", "replace") or "upload").name
+                staging = store.new_staging_dir()
+                writer = await StreamingFileWriter(staging / "source" / filename, max_bytes).open()
+        elif event == "part_data":
+            if writer is not None:
+                await writer.write(data)
+            else:
+                field_value += data
+                if len(field_value) > MAX_FIELD_BYTES:
+                    raise UploadTooLarge(MAX_FIELD_BYTES)
+        elif event == "part_end":
+            if writer is not None:
+                sha256, size = await writer.close()
+                kind = detect_kind(writer.head, filename)
+                current_staging, writer, staging = staging, None, None
+                meta = await asyncio.to_thread(store.commit, current_staging, filename, sha256, size, kind)
+                files.setdefault(field_name, []).append(meta)
+            else:
+                fields[field_name] = field_value.decode("utf-8", "replace")
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            pending, events[:] = list(events), []
+            for event, data in pending:
+                await handle(event, data)
+        parser.finalize()
+        for event, data in events:
+            await handle(event, data)
+    except BaseException:
+        if writer is not None:
+            await writer.abort()
+        if staging is not None:
+            shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return files, fields
+
+
+async def resolve_input(store, upload, dataset_id, field):
+    """
+    将“上传文件或数据集 id”统一解析为数据集元数据（上传文件以异步分块方式写入仓库）
+
+    返回:
+    (meta, error) -- 成功时 error 为 None；失败时 meta 为 None，error 为错误响应字典
+    """
+    if dataset_id:
+        meta = store.get(dataset_id)
+        if meta is None:
+            return None, {"error": "dataset_not_found", "field": field, "dataset_id": dataset_id}
+        return meta, None
+    if upload is None:
+        return None, {"error": "missing_input", "field": field}
+    try:
+        return await ingest_upload(store, upload), None
+    except zipfile.BadZipFile:
+        return None, {"error": "bad_zip_file", "filename": upload.filename}
+    except UploadTooLarge as e:
+        error = too_large_error(e.max_bytes)
+        error["field"] = field
+        return None, error
@@ -0,0 +1,261 @@
+import numpy as np
+from affine import Affine
+from rasterio.features import rasterize
+from shapely.geometry import shape
+
+from submod.公共.统计 import RasterStats, write_stats
+
+# 每次读取的像元数上限（按整行取块，实际块高对齐到波段的存储块高）
+BLOCK_PIXELS = 4 * 1024 * 1024
+# 三维示意图使用的降采样像元数上限
+PLOT_PIXELS = 250_000
+
+
+class VolumeStats:
+    """
+    高程差体积的流式累加器：逐块 update 有效高差，只保存 float64 标量，内存占用与栅格大小无关。
+    高差 = 上表面 - 下表面；正值计入填方（fill），负值计入挖方（cut），net 为代数和。
+    不同块/分片的累加器可用 merge 合并。
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.fill = 0.0
+        self.cut = 0.0
+
+    def update(self, diff):
+        """加入一批有效高差（调用方已剔除无效像元）"""
+        diff = np.asarray(diff, dtype=np.float64).ravel()
+        if diff.size:
+            self.count += int(diff.size)
+            self.fill += float(diff[diff > 0].sum())
+            self.cut += float(-diff[diff < 0].sum())
+        return self
+
+    @classmethod
+    def from_totals(cls, count, fill, cut):
+        stats = cls()
+        stats.count, stats.fill, stats.cut = int(count), float(fill), float(cut)
+        return stats
+
+    def merge(self, other):
+        self.count += other.count
+        self.fill += other.fill
+        self.cut += other.cut
+        return self
+
+    @property
+    def net(self):
+        return self.fill - self.cut
+
+    def to_dict(self, pixel_area):
+        """输出体积（立方米），volume 为净体积的绝对值（与原算法的体积差口径一致）"""
+        return {
+            "count": self.count,
+            "pixel_area": float(pixel_area),
+            "fill_volume": self.fill * pixel_area,
+            "cut_volume": self.cut * pixel_area,
+            "net_volume": self.net * pixel_area,
+            "volume": abs(self.net) * pixel_area,
+        }
+
+
+def valid_difference(top, bottom, top_nodata=None, bottom_nodata=None, valid_range=None, exclude_zero=False):
+    """
+    计算一块高差，无效像元为 NaN：两者任一为 NODATA、NaN/Inf、超出 valid_range (lo, hi) 开区间，
+    或 exclude_zero 时为 0 的像元均视为无效。
+    """
+    top = top.astype(np.float64, copy=False)
+    bottom = bottom.astype(np.float64, copy=False)
+    valid = np.isfinite(top) & np.isfinite(bottom)
+    for data, nodata in ((top, top_nodata), (bottom, bottom_nodata)):
+        if nodata is not None and not np.isnan(nodata):
+            valid &= data != nodata
+        if exclude_zero:
+            valid &= data != 0
+        if valid_range is not None:
+            valid &= (data > valid_range[0]) & (data < valid_range[1])
+    return np.where(valid, top - bottom, np.nan)
+
+
+def row_blocks(dataset, block_pixels=BLOCK_PIXELS):
+    """按整行划分读取窗口 (yoff, rows)，块高为波段存储块高的整数倍"""
+    width, height = dataset.RasterXSize, dataset.RasterYSize
+    block_y = max(1, dataset.GetRasterBand(1).GetBlockSize()[1])
+    rows = max(block_y, (block_pixels // max(width, 1)) // block_y * block_y)
+    for yoff in range(0, height, rows):
+        yield yoff, min(rows, height - yoff)
+
+
+def raster_grid(dataset):
+    """返回 (投影 WKT, (minx, miny, maxx, maxy), x 分辨率, y 分辨率)，分辨率取绝对值"""
+    gt = dataset.GetGeoTransform()
+    minx, maxy = gt[0], gt[3]
+    maxx = minx + gt[1] * dataset.RasterXSize
+    miny = maxy + gt[5] * dataset.RasterYSize
+    return dataset.GetProjection(), (minx, min(miny, maxy), maxx, max(miny, maxy)), abs(gt[1]), abs(gt[5])
+
+
+def warp_to_grid(src_ds, bounds, width, height, dst_wkt, out_path=None, default_nodata=0, dst_nodata=None,
+                 output_type=None):
+    """
+    把 src_ds 双线性重采样到给定网格（范围 bounds、行列数 width×height、投影 dst_wkt）。
+    源数据与目标同投影时先用 VRT 截取目标范围（外扩 2 个像元供插值使用）作为源窗口提示，
+    只读取与目标重叠的数据块；否则由 Warp 按 outputBounds 自行计算源窗口。
+    :param out_path: 为 None 时返回内存数据集（MEM），否则写出分块 GTiff（Warp 按块分批重采样，内存占用与栅格大小无关）
+    :param default_nodata: 源波段未设置 NoData 时使用的值（None 表示不设源 NoData）
+    :param dst_nodata: 输出 NoData，默认与源 NoData 相同
+    :param output_type: 输出数据类型（GDAL 类型码），默认与源波段相同
+    """
+    from osgeo import gdal, gdalconst
+
+    src_band = src_ds.GetRasterBand(1)
+    src_nodata = src_band.GetNoDataValue()
+    if src_nodata is None:
+        src_nodata = default_nodata
+    if dst_nodata is None:
+        dst_nodata = src_nodata
+
+    src = src_ds
+    if src_ds.GetProjection() == dst_wkt:
+        src_geo = src_ds.GetGeoTransform()
+        pad_x = abs(src_geo[1]) * 2
+        pad_y = abs(src_geo[5]) * 2
+        minx, miny, maxx, maxy = bounds
+        try:
+            window_ds = gdal.Translate('', src_ds, format='VRT', projWin=[minx - pad_x, maxy + pad_y, maxx + pad_x, miny - pad_y])
+        except RuntimeError as e:
+            print(f"源窗口截取失败，改为整幅输入: {e}")
+            window_ds = None
+        if window_ds is not None:
+            src = window_ds
+
+    options = dict(
+        format='GTiff' if out_path else 'MEM',
+        outputBounds=tuple(bounds),
+        width=width,
+        height=height,
+        resampleAlg=gdalconst.GRA_Bilinear,
+        outputType=output_type if output_type is not None else src_band.DataType,
+        warpOptions=['SOURCE_EXTRA=2'],
+    )
+    if out_path:
+        options['creationOptions'] = ['TILED=YES', 'BIGTIFF=IF_SAFER']
+    if dst_wkt:
+        options['dstSRS'] = dst_wkt
+    if src_nodata is not None:
+        options['srcNodata'] = src_nodata
+    if dst_nodata is not None:
+        options['dstNodata'] = dst_nodata
+    out_ds = gdal.Warp(str(out_path) if out_path else '', src, **options)
+    if out_ds is None:
+        raise ValueError(f"重采样失败: {out_path or 'MEM'}")
+    out_ds.FlushCache()
+    return out_ds
+
+
+def pixel_area(dataset):
+    gt = dataset.GetGeoTransform()
+    return abs(gt[1] * gt[5] - gt[2] * gt[4])
+
+
+def create_diff_raster(diff_path, dataset):
+    """按 dataset 的网格创建 float32 高差栅格（NaN 为 NODATA）"""
+    from osgeo import gdal
+
+    driver = gdal.GetDriverByName('GTiff')
+    out = driver.Create(str(diff_path), dataset.RasterXSize, dataset.RasterYSize, 1, gdal.GDT_Float32,
+                        options=['TILED=YES', 'COMPRESS=DEFLATE', 'PREDICTOR=3', 'BIGTIFF=IF_SAFER'])
+    out.SetGeoTransform(dataset.GetGeoTransform())
+    out.SetProjection(dataset.GetProjection())
+    out.GetRasterBand(1).SetNoDataValue(float('nan'))
+    return out
+
+
+def zone_labels(zones, bounds, transform, out_shape):
+    """
+    把与当前块相交的分区多边形栅格化为标签（第 i 个分区为 i+1，0 为分区外，重叠处后者覆盖前者）
+    :param bounds: 每个分区的外包框列表，用于跳过与当前块不相交的分区
+    """
+    rows, cols = out_shape
+    minx, maxy = transform * (0, 0)
+    maxx, miny = transform * (cols, rows)
+    shapes = [(geom, i + 1) for i, (geom, (x0, y0, x1, y1)) in enumerate(zip(zones, bounds))
+              if x0 <= maxx and x1 >= minx and y0 <= maxy and y1 >= miny]
+    if not shapes:
+        return np.zeros(out_shape, dtype=np.int32)
+    return rasterize(shapes, out_shape=out_shape, transform=transform, fill=0, dtype='int32')
+
+
+def dem_difference_volume(ds_top, ds_bottom, valid_range=None, exclude_zero=False, diff_path=None, zones=None,
+                          block_pixels=BLOCK_PIXELS):
+    """
+    逐块计算两幅已对齐 DEM（GDAL 数据集，行列数一致）的高差体积，内存占用与栅格大小无关。
+    :param valid_range: 可选的有效高程范围 (lo, hi)，用于剔除异常值
+    :param exclude_zero: 是否把高程为 0 的像元视为无效（裁剪填充值）
+    :param diff_path: 提供时同时写出高差栅格（上表面 - 下表面）及其统计 sidecar
+    :param zones: 可选的分区多边形（GeoJSON 几何字典列表，与 DEM 同投影）；提供时逐块栅格化，
+        总体积与高差栅格只统计分区内的像元，并按分区输出 zones
+    :return: VolumeStats.to_dict 的结果，另含 diff_path（及 zones）
+    """
+    if (ds_top.RasterXSize, ds_top.RasterYSize) != (ds_bottom.RasterXSize, ds_bottom.RasterYSize):
+        raise ValueError("两幅 DEM 行列数不一致，请先对齐")
+    band_top = ds_top.GetRasterBand(1)
+    band_bottom = ds_bottom.GetRasterBand(1)
+    top_nodata = band_top.GetNoDataValue()
+    bottom_nodata = band_bottom.GetNoDataValue()
+    width = ds_top.RasterXSize
+
+    volume = VolumeStats()
+    diff_ds = create_diff_raster(diff_path, ds_top) if diff_path else None
+    diff_stats = RasterStats() if diff_path else None
+    if zones is not None:
+        transform = Affine.from_gdal(*ds_top.GetGeoTransform())
+        zone_bounds = [shape(geom).bounds for geom in zones]
+        zone_count = np.zeros(len(zones) + 1, dtype=np.int64)
+        zone_fill = np.zeros(len(zones) + 1)
+        zone_cut = np.zeros(len(zones) + 1)
+    for yoff, rows in row_blocks(ds_top, block_pixels):
+        diff = valid_difference(band_top.ReadAsArray(0, yoff, width, rows),
+                                band_bottom.ReadAsArray(0, yoff, width, rows),
+                                top_nodata, bottom_nodata, valid_range, exclude_zero)
+        if zones is not None:
+            labels = zone_labels(zones, zone_bounds, transform * Affine.translation(0, yoff), diff.shape)
+            diff[labels == 0] = np.nan
+            valid = ~np.isnan(diff)
+            labels, values = labels[valid], diff[valid]
+            zone_count += np.bincount(labels, minlength=len(zone_count))
+            zone_fill += np.bincount(labels, weights=np.where(values > 0, values, 0), minlength=len(zone_fill))
+            zone_cut += np.bincount(labels, weights=np.where(values < 0, -values, 0), minlength=len(zone_cut))
+        volume.update(diff[~np.isnan(diff)])
+        if diff_ds is not None:
+            diff_ds.GetRasterBand(1).WriteArray(diff.astype(np.float32), 0, yoff)
+            diff_stats.update(diff)
+
+    if diff_ds is not None:
+        diff_ds.FlushCache()
+        diff_ds = None
+        write_stats(diff_path, diff_stats.to_dict())
+
+    area = pixel_area(ds_top)
+    result = volume.to_dict(area)
+    result["diff_path"] = str(diff_path) if diff_path else None
+    if zones is not None:
+        result["zones"] = [VolumeStats.from_totals(c, f, ct).to_dict(area)
+                           for c, f, ct in zip(zone_count[1:], zone_fill[1:], zone_cut[1:])]
+    return result
+
+
+def decimated_difference(ds_top, ds_bottom, valid_range=None, exclude_zero=False, max_pixels=PLOT_PIXELS):
+    """
+    降采样读取两幅 DEM（最近邻），返回 (valid_mask, elevation_diff, top)，供三维示意图使用
+    """
+    width, height = ds_top.RasterXSize, ds_top.RasterYSize
+    scale = max(1.0, np.sqrt(width * height / max_pixels))
+    buf_x, buf_y = max(1, int(width / scale)), max(1, int(height / scale))
+    band_top = ds_top.GetRasterBand(1)
+    band_bottom = ds_bottom.GetRasterBand(1)
+    top = band_top.ReadAsArray(buf_xsize=buf_x, buf_ysize=buf_y).astype(np.float64)
+    bottom = band_bottom.ReadAsArray(buf_xsize=buf_x, buf_ysize=buf_y).astype(np.float64)
+    diff = valid_difference(top, bottom, band_top.GetNoDataValue(), band_bottom.GetNoDataValue(), valid_range, exclude_zero)
+    return ~np.isnan(diff), diff, top
@@ -0,0 +1,56 @@
+import zipfile
+from pathlib import Path
+
+
+def decode_member_name(info):
+    """
+    修正 ZIP 成员的中文文件名
+    未设置 UTF-8 标志位（0x800）时，zipfile 按 cp437 解码，依次尝试 utf-8/gbk/cp936 还原
+    """
+    name = info.filename
+    if info.flag_bits & 0x800:
+        return name
+    for enc in ("utf-8", "gbk", "cp936"):
+        try:
+            return name.encode("cp437").decode(enc)
+        except Exception:
+            pass
+    return name
+
+
+def list_entries(zip_path):
+    """
+    列出 ZIP 内的文件成员（只读中央目录，不解压）
+
+    返回:
+    List[dict] -- [{"name": 修正中文后的文件名, "member": ZIP 内原始成员名, "size": 解压后字节数}]
+    异常:
+    zipfile.BadZipFile -- ZIP 文件损坏
+    """
+    with zipfile.ZipFile(str(zip_path), 'r') as zf:
+        return [
+            {"name": decode_member_name(info), "member": info.filename, "size": info.file_size}
+            for info in zf.infolist()
+            if not (info.is_dir() or info.filename.endswith("/"))
+        ]
+
+
+def find_entries(entries, suffixes, exclude_aux=False, largest_first=False):
+    """按后缀优先级筛选 ZIP 成员（后缀不区分大小写）"""
+    matched = []
+    for suffix in suffixes:
+        group = [e for e in entries if e["name"].lower().endswith(suffix.lower())]
+        if exclude_aux:
+            group = [e for e in group if "aux" not in Path(e["name"]).name.lower()]
+        if largest_first:
+            group.sort(key=lambda e: e["size"], reverse=True)
+        matched.extend(group)
+    return matched
+
+
+def vsizip_path(zip_path, member):
+    """
+    构造 GDAL /vsizip/ 路径，rasterio、GDAL 与 geopandas 均可直接就地打开，同目录的附属文件（.hdr/.prj/.dbf 等）也能被找到。
+    GDAL 默认按 CP437 解码未设置 UTF-8 标志位的成员名，与 zipfile 的 info.filename 一致，因此这里使用原始成员名。
+    """
+    return f"/vsizip/{Path(zip_path).resolve().as_posix()}/{member}"
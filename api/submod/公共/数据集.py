@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import zipfile
+from pathlib import Path
+
+from submod.公共.压缩包 import list_entries, find_entries, vsizip_path
+
+# 文件头特征：用于识别 ZIP 与 GeoTIFF（含 BigTIFF）
+ZIP_MAGIC = (b"PK\x03\x04", b"PK\x05\x06")
+TIF_MAGIC = (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+")
+
+
+def detect_kind(head, filename=""):
+    """根据文件头（必要时结合后缀）判断数据类型：zip / tif / file"""
+    if head.startswith(ZIP_MAGIC):
+        return "zip"
+    if head.startswith(TIF_MAGIC):
+        return "tif"
+    suffix = Path(filename).suffix.lower()
+    if suffix == ".zip":
+        return "zip"
+    if suffix in (".tif", ".tiff"):
+        return "tif"
+    return "file"
+
+
+class DatasetStore:
+    """
+    按内容 SHA-256 寻址的数据集仓库，目录结构：
+        {root}/{id}/meta.json
+        {root}/{id}/source/{原始文件名}
+    相同内容只保存一份，重复上传直接返回已有数据集。
+    ZIP 不解压：注册时记录成员表，栅格与矢量通过 /vsizip/ 就地读取。
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.tmp_root = self.root / ".tmp"
+        self.tmp_root.mkdir(exist_ok=True)
+
+    def dataset_dir(self, dataset_id):
+        return self.root / dataset_id
+
+    def get(self, dataset_id):
+        """读取数据集元数据，不存在（或 id 非法）返回 None"""
+        if not dataset_id or not all(c in "0123456789abcdef" for c in dataset_id):
+            return None
+        meta_path = self.dataset_dir(dataset_id) / "meta.json"
+        if not meta_path.exists():
+            return None
+        with meta_path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def list(self):
+        metas = []
+        for d in sorted(self.root.iterdir()):
+            if d.name.startswith("."):
+                continue
+            meta = self.get(d.name)
+            if meta:
+                metas.append(meta)
+        return metas
+
+    def source_path(self, meta):
+        return self.dataset_dir(meta["id"]) / "source" / meta["filename"]
+
+    def archive_paths(self, meta, suffixes, exclude_aux=False, largest_first=False):
+        """
+        ZIP 数据集中指定后缀的成员，返回可直接交给 GDAL/rasterio/geopandas 打开的路径（按后缀优先级排列）
+        """
+        if meta.get("kind") != "zip":
+            return []
+        entries = find_entries(meta.get("entries", []), suffixes, exclude_aux, largest_first)
+        return [vsizip_path(self.source_path(meta), e["member"]) for e in entries]
+
+    def relative_path(self, path):
+        """相对 outputs 目录的路径，用于拼接 /files URL"""
+        return Path(path).relative_to(self.root.parent).as_posix()
+
+    def new_staging_dir(self):
+        staging = self.tmp_root / uuid.uuid4().hex
+        (staging / "source").mkdir(parents=True)
+        return staging
+
+    def commit(self, staging, filename, sha256, size, kind=None):
+        """
+        将暂存目录提交为数据集：已存在则丢弃暂存并返回已有数据集（去重），
+        否则识别类型、读取 ZIP 成员表、写入元数据后原子地重命名到位。
+
+        异常:
+        zipfile.BadZipFile -- ZIP 文件损坏
+        """
+        final_dir = self.dataset_dir(sha256)
+        existing = self.get(sha256)
+        if existing:
+            shutil.rmtree(staging, ignore_errors=True)
+            existing["deduplicated"] = True
+            return existing
+        staged_path = staging / "source" / filename
+        if kind is None:
+            with staged_path.open("rb") as f:
+                kind = detect_kind(f.read(8), filename)
+        entries = None
+        try:
+            if kind == "zip":
+                entries = list_entries(staged_path)
+        except zipfile.BadZipFile:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        meta = {
+            "id": sha256,
+            "sha256": sha256,
+            "filename": filename,
+            "size": size,
+            "kind": kind,
+            "created": time.time(),
+        }
+        if entries is not None:
+            meta["members"] = sorted(e["name"] for e in entries)
+            meta["entries"] = entries
+        with (staging / "meta.json").open("w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        try:
+            os.rename(staging, final_dir)
+        except OSError:
+            # 并发上传了相同内容：以先完成者为准
+            shutil.rmtree(staging, ignore_errors=True)
+            existing = self.get(sha256)
+            if existing is None:
+                raise
+            existing["deduplicated"] = True
+            return existing
+        meta["deduplicated"] = False
+        return meta
+
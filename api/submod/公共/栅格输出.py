@@ -0,0 +1,53 @@
+import os
+from pathlib import Path
+
+import rasterio
+from rasterio.shutil import copy as rio_copy
+
+# COG 内部瓦片大小与压缩方式
+COG_BLOCKSIZE = 512
+COG_COMPRESS = "LZW"
+
+
+def is_cog(path):
+    """已按 COG 布局写出时返回 True（避免重复转换）"""
+    with rasterio.open(path) as src:
+        return src.tags(ns="IMAGE_STRUCTURE").get("LAYOUT") == "COG"
+
+
+def to_cog(path, resampling="average"):
+    """
+    将 GeoTIFF 原地转换为 Cloud-Optimized GeoTIFF：内部分块 + 金字塔（概览）+ 元数据前置，
+    前端可通过 HTTP Range 只读取所需的概览层与瓦片。GDAL COG 驱动按块流式生成，内存占用与栅格大小无关。
+
+    参数:
+    path: GeoTIFF 路径
+    resampling: 概览重采样方法，连续值用 average，分类值用 nearest
+    """
+    path = str(path)
+    if is_cog(path):
+        return path
+    tmp_path = f"{path}.cog.tmp"
+    rio_copy(
+        path, tmp_path, driver="COG",
+        BLOCKSIZE=COG_BLOCKSIZE, COMPRESS=COG_COMPRESS,
+        OVERVIEW_RESAMPLING=resampling.upper(), BIGTIFF="IF_SAFER",
+    )
+    os.replace(tmp_path, path)
+    return path
+
+
+def cogify_dir(directory, categorical=()):
+    """
+    将任务目录下的 .tif 全部转换为 COG，categorical 中的文件名使用最近邻生成概览。
+    单个文件转换失败只打印提示，不影响接口返回。
+    """
+    converted = []
+    for tif in sorted(Path(directory).glob("*.tif")):
+        resampling = "nearest" if tif.name in categorical else "average"
+        try:
+            to_cog(tif, resampling)
+            converted.append(tif.name)
+        except Exception as e:
+            print(f"转换 COG 失败: {tif} - {e}")
+    return converted
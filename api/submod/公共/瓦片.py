@@ -0,0 +1,221 @@
+import io
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import from_bounds
+from rasterio.warp import transform_bounds
+from PIL import Image
+from matplotlib import colormaps
+
+TILE_SIZE = 256
+# Web Mercator（EPSG:3857）半周长
+ORIGIN = 20037508.342789244
+# 内存中最多缓存的瓦片数，可通过环境变量 TILE_MEMORY_CACHE 配置
+MEMORY_CACHE_TILES = int(os.environ.get("TILE_MEMORY_CACHE", 2048))
+# 内存中最多缓存的拉伸范围数（栅格 × 拉伸方式 × 波段），可通过环境变量 TILE_STRETCH_CACHE 配置
+STRETCH_CACHE_SIZE = int(os.environ.get("TILE_STRETCH_CACHE", 1024))
+# 自动拉伸使用的百分位
+STRETCH_PERCENTILES = {"minmax": (0, 100), "p2": (2, 98), "p5": (5, 95)}
+RESAMPLING = {"nearest": Resampling.nearest, "bilinear": Resampling.bilinear, "average": Resampling.average}
+
+
+def tile_bounds(z, x, y):
+    """XYZ 瓦片在 EPSG:3857 下的范围 (minx, miny, maxx, maxy)"""
+    size = 2 * ORIGIN / (2 ** z)
+    minx = -ORIGIN + x * size
+    maxy = ORIGIN - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+class TileCache:
+    """渲染后的瓦片缓存：内存 LRU + 磁盘（{cache_dir}/{栅格键}/{样式}/{z}_{x}_{y}.png）"""
+
+    def __init__(self, cache_dir, max_tiles=MEMORY_CACHE_TILES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_tiles = max_tiles
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def disk_path(self, key):
+        return self.cache_dir.joinpath(*key)
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data, "memory"
+        path = self.disk_path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None, None
+        # 刷新栅格缓存目录的访问时间，供 outputs 的 LRU 清理使用
+        try:
+            os.utime(self.cache_dir / key[0], None)
+        except OSError:
+            pass
+        self._remember(key, data)
+        return data, "disk"
+
+    def put(self, key, data):
+        path = self.disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        self._remember(key, data)
+
+    def _remember(self, key, data):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_tiles:
+                self._memory.popitem(last=False)
+
+
+def raster_key(path):
+    """栅格缓存键：路径 + 大小 + 修改时间，文件被替换后旧瓦片自动失效"""
+    st = os.stat(path)
+    return hashlib.sha256(f"{Path(path).resolve()}|{st.st_size}|{st.st_mtime_ns}".encode("utf-8")).hexdigest()[:32]
+
+
+def style_key(style):
+    return hashlib.sha256(json.dumps(style, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+_stretch_cache = OrderedDict()
+_stretch_lock = threading.Lock()
+
+
+def auto_range(path, key, stretch, band=1):
+    """
+    由最小的概览层估计拉伸范围（百分位），避免读取全分辨率数据；结果按栅格键缓存
+    """
+    cache_key = (key, stretch, band)
+    with _stretch_lock:
+        if cache_key in _stretch_cache:
+            _stretch_cache.move_to_end(cache_key)
+            return _stretch_cache[cache_key]
+    lo, hi = STRETCH_PERCENTILES.get(stretch, (2, 98))
+    with rasterio.open(path) as src:
+        if not 1 <= band <= src.count:
+            raise ValueError(f"波段超出范围: {band}（共 {src.count} 个波段）")
+        factors = src.overviews(1)
+        factor = factors[-1] if factors else max(1, max(src.width, src.height) // 1024)
+        shape = (max(1, src.height // factor), max(1, src.width // factor))
+        data = src.read(band, out_shape=shape, masked=True).astype(np.float64)
+    values = data.compressed()
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        result = (0.0, 1.0)
+    else:
+        result = (float(np.percentile(values, lo)), float(np.percentile(values, hi)))
+    with _stretch_lock:
+        _stretch_cache[cache_key] = result
+        _stretch_cache.move_to_end(cache_key)
+        while len(_stretch_cache) > STRETCH_CACHE_SIZE:
+            _stretch_cache.popitem(last=False)
+    return result
+
+
+def read_tile(path, z, x, y, resampling="bilinear", band=1):
+    """
+    读取一个瓦片范围的数据（掩膜数组）。通过 WarpedVRT 投影到 EPSG:3857，降采样读取时 GDAL 自动选用合适的概览层，
+    只读取覆盖该瓦片的窗口；瓦片与栅格不相交时返回 None。
+    """
+    bounds = tile_bounds(z, x, y)
+    with rasterio.open(path) as src:
+        if src.crs is None:
+            raise ValueError("栅格缺少坐标参考，无法切片")
+        if not 1 <= band <= src.count:
+            raise ValueError(f"波段超出范围: {band}（共 {src.count} 个波段）")
+        src_bounds = transform_bounds(src.crs, "EPSG:3857", *src.bounds, densify_pts=21)
+        left, bottom = max(bounds[0], src_bounds[0]), max(bounds[1], src_bounds[1])
+        right, top = min(bounds[2], src_bounds[2]), min(bounds[3], src_bounds[3])
+        if left >= right or bottom >= top:
+            return None
+        res = (bounds[2] - bounds[0]) / TILE_SIZE
+        # 瓦片内与栅格相交部分对应的像素区域
+        col0 = int(round((left - bounds[0]) / res))
+        col1 = int(round((right - bounds[0]) / res))
+        row0 = int(round((bounds[3] - top) / res))
+        row1 = int(round((bounds[3] - bottom) / res))
+        if col1 <= col0 or row1 <= row0:
+            return None
+        tile = np.ma.masked_all((TILE_SIZE, TILE_SIZE), dtype=np.float64)
+        with WarpedVRT(src, crs="EPSG:3857", resampling=RESAMPLING.get(resampling, Resampling.bilinear)) as vrt:
+            window = from_bounds(left, bottom, right, top, vrt.transform)
+            data = vrt.read(band, window=window, out_shape=(row1 - row0, col1 - col0), masked=True,
+                            resampling=RESAMPLING.get(resampling, Resampling.bilinear))
+        tile[row0:row1, col0:col1] = data.astype(np.float64)
+        return tile
+
+
+def render_png(data, vmin, vmax, colormap="viridis"):
+    """按拉伸范围与色带渲染为 RGBA PNG，NODATA 与 NaN 透明"""
+    rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    if data is not None:
+        values = np.ma.masked_invalid(data)
+        scale = (vmax - vmin) or 1.0
+        norm = np.clip((values.filled(vmin) - vmin) / scale, 0, 1)
+        rgba = (colormaps[colormap](norm) * 255).astype(np.uint8)
+        rgba[..., 3] = np.where(np.ma.getmaskarray(values), 0, 255)
+    buf = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buf, format="PNG", optimize=False)
+    return buf.getvalue()
+
+
+def render_tile(path, z, x, y, cache, colormap="viridis", stretch="p2", vmin=None, vmax=None, resampling="bilinear", band=1):
+    """
+    渲染（或从缓存读取）一个 PNG 瓦片
+
+    返回:
+    (bytes, str) -- PNG 数据与缓存命中情况（memory/disk/miss）
+    """
+    if colormap not in colormaps:
+        raise ValueError(f"未知色带: {colormap}")
+    key = raster_key(path)
+    style = {"colormap": colormap, "stretch": stretch, "vmin": vmin, "vmax": vmax, "resampling": resampling}
+    if band != 1:
+        # 第 1 波段不写入样式，保持已有瓦片缓存有效
+        style["band"] = band
+    tile_key = (key, style_key(style), f"{z}_{x}_{y}.png")
+    data, hit = cache.get(tile_key)
+    if data is not None:
+        return data, hit
+    if vmin is None or vmax is None:
+        auto_min, auto_max = auto_range(path, key, stretch, band)
+        vmin = auto_min if vmin is None else vmin
+        vmax = auto_max if vmax is None else vmax
+    png = render_png(read_tile(path, z, x, y, resampling, band), vmin, vmax, colormap)
+    cache.put(tile_key, png)
+    return png, "miss"
+
+
+def tilejson(path, tiles_url):
+    """TileJSON 描述：经纬度范围与建议的缩放级别"""
+    with rasterio.open(path) as src:
+        if src.crs is None:
+            raise ValueError("栅格缺少坐标参考，无法切片")
+        west, south, east, north = transform_bounds(src.crs, "EPSG:4326", *src.bounds, densify_pts=21)
+        merc = transform_bounds(src.crs, "EPSG:3857", *src.bounds, densify_pts=21)
+        res = max((merc[2] - merc[0]) / src.width, (merc[3] - merc[1]) / src.height)
+    maxzoom = int(np.clip(np.ceil(np.log2(2 * ORIGIN / (TILE_SIZE * res))), 0, 22))
+    return {
+        "tilejson": "2.2.0",
+        "tiles": [tiles_url],
+        "bounds": [west, south, east, north],
+        "center": [(west + east) / 2, (south + north) / 2, max(maxzoom - 3, 0)],
+        "minzoom": 0,
+        "maxzoom": maxzoom,
+    }
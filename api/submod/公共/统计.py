@@ -0,0 +1,332 @@
+import json
+import os
+
+import numpy as np
+import rasterio
+from PIL import Image
+from matplotlib import colormaps
+
+# 直方图分箱数
+HIST_BINS = 64
+# 自适应直方图箱宽指数下限（箱宽 2**-64）：全为 0 的块没有量级，不能按值量级推算箱宽
+HIST_MIN_EXP = -64
+# 预览图最长边（像素）
+PREVIEW_SIZE = 512
+# 分位数草图的精度参数（越大越精确，内存约与之成正比）
+SKETCH_K = 256
+# 启用分位数草图时统计结果中输出的百分位
+PERCENTILES = (2, 5, 25, 50, 75, 95, 98)
+
+
+class QuantileSketch:
+    """
+    可合并的流式分位数草图（KLL）：按层保存样本，第 h 层每个样本代表 2**h 个原始值。
+    某层超过容量时排序后隔一取一（随机起点）提升到上一层，内存约为 O(k·log(n/k))，
+    分位数的秩误差约为 1/k 量级；不同块、不同分片的草图可直接合并，无需对全量数据排序。
+    """
+
+    def __init__(self, k=SKETCH_K, seed=0):
+        self.k = k
+        self.count = 0
+        self.levels = [np.empty(0, dtype=np.float64)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        # 越低的层容量越小（按 2/3 几何递减），最高层容量为 k
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - level))))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if items.size > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0, dtype=np.float64))
+                items = np.sort(items)
+                # 奇数个时保留一个在本层，其余成对压缩
+                keep = items[-1:] if items.size % 2 else items[:0]
+                pairs = items[:items.size - keep.size]
+                promoted = pairs[int(self._rng.integers(2))::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                level = 0 if level + 1 == len(self.levels) - 1 else level + 1
+            else:
+                level += 1
+
+    def update(self, values):
+        """加入一批有效值（调用方已剔除 NODATA/NaN）"""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size:
+            self.count += int(values.size)
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+        return self
+
+    def merge(self, other):
+        """合并另一个草图"""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0, dtype=np.float64))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """估计分位数，q 为 0–1 的数或数组；没有数据时返回 None"""
+        if self.count == 0:
+            return None
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(items.size, 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values, cumulative = values[order], np.cumsum(weights[order])
+        ranks = np.asarray(q, dtype=np.float64) * cumulative[-1]
+        index = np.minimum(np.searchsorted(cumulative, ranks, side="left"), values.size - 1)
+        result = values[index]
+        return float(result) if np.ndim(result) == 0 else result
+
+
+class RasterStats:
+    """
+    栅格统计的流式累加器：逐块 update，内存占用与栅格大小无关；不同块/分片的累加器可用 merge 合并。
+    统计有效像元（非 NODATA、非 NaN/Inf）的个数、最小/最大值、均值、标准差（Welford/Chan 合并公式，数值稳定），
+    以及可选的直方图与分类计数。
+
+    参数:
+    bins: 直方图分箱数，0 表示不统计直方图
+    hist_range: 固定直方图范围 (lo, hi)，范围外的值不计入直方图；为 None 时自适应：
+        箱宽取 2 的整数次幂、箱边界对齐到箱宽的整数倍，值域扩大时箱宽加倍（相邻箱合并），
+        任意两个累加器都能对齐到同一网格后精确合并
+    classes: 分类计数 {名称: 判断函数}，判断函数接收有效值数组、返回布尔数组
+    quantiles: 为 True 时同时维护 QuantileSketch，可用 quantile() 估计分位数，结果中输出 percentiles
+    """
+
+    def __init__(self, bins=HIST_BINS, hist_range=None, classes=None, quantiles=False):
+        self.bins = bins
+        self.hist_range = tuple(float(v) for v in hist_range) if hist_range is not None else None
+        self.classes = dict(classes or {})
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        # 自适应直方图：箱宽 2**hist_exp，第 0 箱左边界为 hist_start * 箱宽
+        self.hist_exp = None
+        self.hist_start = None
+        self.hist = np.zeros(bins, dtype=np.int64)
+        self.class_counts = {name: 0 for name in self.classes}
+        self.sketch = QuantileSketch() if quantiles else None
+
+    def _fit_exp(self, vmin, vmax, exp=None):
+        """不小于 exp 的最小箱宽指数，使 [vmin, vmax] 落在 bins 个对齐的箱内"""
+        if exp is None:
+            scale = max(abs(vmin), abs(vmax))
+            # 箱宽下限取值量级的 2**-40，保证 值/箱宽 在 float64 中可精确取整
+            exp = max(int(np.floor(np.log2(scale))) - 40, HIST_MIN_EXP) if scale > 0 else HIST_MIN_EXP
+        span = vmax - vmin
+        if span > 0:
+            # 直接跳到按值域估计的下限，避免从很小的 exp 逐次加一
+            exp = max(exp, int(np.ceil(np.log2(span / self.bins))))
+        while np.floor(vmax / 2.0 ** exp) - np.floor(vmin / 2.0 ** exp) >= self.bins:
+            exp += 1
+        return exp
+
+    def _regrid(self, exp, start):
+        """将直方图重排到箱宽 2**exp、起点 start 的网格（exp 不小于当前值，原箱完整落入新箱）"""
+        # 除以 2 的幂向下取整即算术右移；int64 右移 63 位已得到 0/-1，移位数截断到 63 不会溢出
+        shift = min(exp - self.hist_exp, 63)
+        filled = np.nonzero(self.hist)[0]
+        index = ((filled + self.hist_start) >> shift) - start
+        hist = np.zeros(self.bins, dtype=np.int64)
+        np.add.at(hist, index, self.hist[filled])
+        self.hist = hist
+        self.hist_exp = exp
+        self.hist_start = start
+
+    def _cover(self, vmin, vmax, exp=None):
+        """扩大自适应直方图直到覆盖 [vmin, vmax]"""
+        exp = self._fit_exp(vmin, vmax, exp if exp is not None else self.hist_exp)
+        start = int(np.floor(vmin / 2.0 ** exp))
+        if self.hist_exp is None:
+            self.hist_exp, self.hist_start = exp, start
+        elif (exp, start) != (self.hist_exp, self.hist_start):
+            self._regrid(exp, start)
+
+    def _add_moments(self, count, mean, m2):
+        """Chan 并行合并公式：合并另一组样本的 (个数, 均值, 离差平方和)"""
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def update(self, block, nodata=None):
+        """累加一个数据块（任意形状），自动剔除 NODATA 与非有限值"""
+        values = np.asarray(block, dtype=np.float64)
+        valid = np.isfinite(values)
+        if nodata is not None and np.isfinite(nodata):
+            valid &= values != nodata
+        values = values[valid]
+        if values.size == 0:
+            return self
+        vmin = float(values.min())
+        vmax = float(values.max())
+        block_mean = float(values.mean())
+        self._add_moments(int(values.size), block_mean, float(np.square(values - block_mean).sum()))
+        self.min = vmin if self.min is None else min(self.min, vmin)
+        self.max = vmax if self.max is None else max(self.max, vmax)
+        if self.bins:
+            if self.hist_range is not None:
+                self.hist += np.histogram(values, bins=self.bins, range=self.hist_range)[0]
+            else:
+                self._cover(self.min, self.max)
+                index = (np.floor(values / 2.0 ** self.hist_exp) - self.hist_start).astype(np.int64)
+                self.hist += np.bincount(index, minlength=self.bins)
+        for name, test in self.classes.items():
+            self.class_counts[name] += int(np.count_nonzero(test(values)))
+        if self.sketch is not None:
+            self.sketch.update(values)
+        return self
+
+    def merge(self, other):
+        """合并另一个累加器（例如并行处理的另一分片），两者的直方图与分类设置需一致"""
+        if self.bins != other.bins or self.hist_range != other.hist_range or set(self.classes) != set(other.classes) \
+                or (self.sketch is None) != (other.sketch is None):
+            raise ValueError("直方图或分类设置不一致，无法合并统计")
+        if other.count == 0:
+            return self
+        self._add_moments(other.count, other.mean, other.m2)
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        if self.bins:
+            if self.hist_range is not None:
+                self.hist += other.hist
+            else:
+                # 两个网格都对齐到 2 的幂，统一到较大箱宽后逐箱相加
+                other_hist = RasterStats(self.bins)
+                other_hist.hist_exp, other_hist.hist_start = other.hist_exp, other.hist_start
+                other_hist.hist = other.hist.copy()
+                exp = max(other.hist_exp, self.hist_exp if self.hist_exp is not None else other.hist_exp)
+                if self.hist_exp is None:
+                    self.hist_exp, self.hist_start = other.hist_exp, other.hist_start
+                self._cover(self.min, self.max, exp)
+                other_hist._regrid(self.hist_exp, self.hist_start)
+                self.hist += other_hist.hist
+        for name in self.class_counts:
+            self.class_counts[name] += other.class_counts[name]
+        if self.sketch is not None:
+            self.sketch.merge(other.sketch)
+        return self
+
+    def quantile(self, q):
+        """由分位数草图估计分位数（q 为 0–1），需以 quantiles=True 创建"""
+        if self.sketch is None:
+            raise ValueError("未启用分位数统计")
+        return self.sketch.quantile(q)
+
+    @property
+    def std(self):
+        """总体标准差（与 np.nanstd 一致）"""
+        return float(np.sqrt(self.m2 / self.count)) if self.count else None
+
+    def histogram_edges(self):
+        if self.hist_range is not None:
+            return np.linspace(self.hist_range[0], self.hist_range[1], self.bins + 1)
+        return (self.hist_start + np.arange(self.bins + 1)) * 2.0 ** self.hist_exp
+
+    def to_dict(self):
+        """输出 JSON 可序列化的统计结果，没有有效像元时各项为 None"""
+        result = {"count": self.count, "min": None, "max": None, "mean": None, "std": None, "histogram": None}
+        if self.count:
+            result.update(min=self.min, max=self.max, mean=self.mean, std=self.std)
+            if self.bins:
+                result["histogram"] = {
+                    "edges": [float(e) for e in self.histogram_edges()],
+                    "counts": [int(c) for c in self.hist],
+                }
+        if self.classes:
+            result["classes"] = dict(self.class_counts)
+        if self.sketch is not None and self.count:
+            values = self.sketch.quantile(np.array(PERCENTILES) / 100)
+            result["percentiles"] = {f"p{p}": float(v) for p, v in zip(PERCENTILES, values)}
+        return result
+
+
+def summarize_array(array, nodata=None):
+    """对已在内存中的数组直接统计（写出整幅栅格的算法使用）"""
+    return RasterStats().update(array, nodata).to_dict()
+
+
+def stats_path(tif_path, band=1):
+    """统计文件路径：第 1 波段为 {tif}.stats.json，其余波段为 {tif}.b{band}.stats.json"""
+    return f"{tif_path}.stats.json" if band == 1 else f"{tif_path}.b{band}.stats.json"
+
+
+def write_stats(tif_path, stats, band=1):
+    """将统计结果写为栅格旁的 {tif}.stats.json，接口直接读取，无需重新读取栅格"""
+    with open(stats_path(tif_path, band), "w", encoding="utf-8") as f:
+        json.dump(stats, f, ensure_ascii=False)
+    return stats
+
+
+def raster_stats(tif_path, band=1):
+    """按内部块单次流式读取栅格计算统计（用于没有统计文件的栅格），并写出统计文件"""
+    acc = RasterStats()
+    with rasterio.open(tif_path) as src:
+        for _, window in src.block_windows(band):
+            acc.update(src.read(band, window=window), src.nodata)
+    return write_stats(tif_path, acc.to_dict(), band)
+
+
+def load_stats(tif_path, band=1):
+    """读取算法写出的统计结果；不存在时回退为一次流式计算，栅格不存在时返回 None"""
+    if not os.path.exists(tif_path):
+        return None
+    path = stats_path(tif_path, band)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return raster_stats(tif_path, band)
+
+
+def render_preview(tif_path, png_path, stats=None, colormap="viridis", max_size=PREVIEW_SIZE, band=1):
+    """
+    生成降采样 PNG 预览（最长边 max_size，NODATA 透明）。
+    降采样读取会直接使用 COG 概览层，只读取很小的数据量；拉伸范围取统计结果的 min/max。
+    """
+    with rasterio.open(tif_path) as src:
+        scale = max(src.width, src.height) / max_size
+        shape = (max(1, int(round(src.height / max(scale, 1)))), max(1, int(round(src.width / max(scale, 1)))))
+        data = src.read(band, out_shape=shape, masked=True).astype(np.float64)
+    data = np.ma.masked_invalid(data)
+    if stats and stats.get("min") is not None:
+        vmin, vmax = stats["min"], stats["max"]
+    elif data.count():
+        vmin, vmax = float(data.min()), float(data.max())
+    else:
+        vmin, vmax = 0.0, 1.0
+    norm = np.clip((data.filled(vmin) - vmin) / ((vmax - vmin) or 1.0), 0, 1)
+    rgba = (colormaps[colormap](norm) * 255).astype(np.uint8)
+    rgba[..., 3] = np.where(np.ma.getmaskarray(data), 0, 255)
+    Image.fromarray(rgba, "RGBA").save(png_path, format="PNG")
+    return png_path
+
+
+def result_summary(tif_path, colormap="viridis", band=1):
+    """
+    接口返回用：读取统计结果并生成同名 _preview.png 预览（多波段栅格的其余波段为 _b{band}_preview.png）
+
+    返回:
+    (stats, preview_path) -- 栅格不存在时均为 None
+    """
+    stats = load_stats(str(tif_path), band)
+    if stats is None:
+        return None, None
+    suffix = "_preview.png" if band == 1 else f"_b{band}_preview.png"
+    preview_path = os.path.splitext(str(tif_path))[0] + suffix
+    try:
+        render_preview(str(tif_path), preview_path, stats, colormap, band=band)
+    except Exception as e:
+        print(f"生成预览失败: {tif_path} - {e}")
+        preview_path = None
+    return stats, preview_path
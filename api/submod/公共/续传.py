@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+from pathlib import Path
+
+import aiofiles
+
+from submod.公共.上传 import CHUNK_SIZE, MAX_UPLOAD_BYTES, UploadTooLarge
+
+# 未完成的续传会话保留时间（秒），可通过环境变量 UPLOAD_SESSION_TTL 配置，默认 7 天
+SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL", 7 * 24 * 3600))
+
+
+class UploadRangeError(Exception):
+    """写入的字节区间超出声明的文件大小"""
+
+
+class UploadNotFound(Exception):
+    """续传会话不存在（已完成、已删除或已过期）"""
+
+
+class UploadBusy(Exception):
+    """会话仍有正在写入的 PATCH 请求"""
+
+    def __init__(self, writers):
+        super().__init__("仍有正在写入的请求")
+        self.writers = writers
+
+
+class UploadIncomplete(Exception):
+    def __init__(self, missing):
+        super().__init__("上传尚未完成")
+        self.missing = missing
+
+
+class ChecksumMismatch(Exception):
+    def __init__(self, expected, actual):
+        super().__init__("文件 SHA-256 与声明值不一致")
+        self.expected = expected
+        self.actual = actual
+
+
+def merge_ranges(ranges):
+    """合并重叠或相邻的半开区间 [start, end)"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def missing_ranges(ranges, size):
+    """已接收区间之外尚缺的字节区间"""
+    missing = []
+    cursor = 0
+    for start, end in ranges:
+        if start > cursor:
+            missing.append([cursor, start])
+        cursor = max(cursor, end)
+    if cursor < size:
+        missing.append([cursor, size])
+    return missing
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResumableUploads:
+    """
+    断点续传会话（tus 风格：创建 -> 按区间 PATCH -> 完成），目录结构：
+        {数据集仓库}/.uploads/{upload_id}/state.json
+        {数据集仓库}/.uploads/{upload_id}/data.part   （预分配为声明大小，按偏移写入）
+    每次 PATCH 结束（包括连接中断）都会记录实际写入的区间，客户端只需重发缺失的区间。
+    完成时校验 SHA-256，并把文件移动到数据集仓库的暂存目录注册为数据集。
+    """
+
+    def __init__(self, store, max_bytes=MAX_UPLOAD_BYTES):
+        self.store = store
+        self.root = store.root / ".uploads"
+        self.root.mkdir(exist_ok=True)
+        self.max_bytes = max_bytes
+        self._locks = {}
+        # 各会话正在写入的 PATCH 请求数（在会话锁内增减），完成时须为 0
+        self._writers = {}
+
+    def _lock(self, upload_id):
+        return self._locks.setdefault(upload_id, asyncio.Lock())
+
+    def session_dir(self, upload_id):
+        return self.root / upload_id
+
+    def data_path(self, upload_id):
+        return self.session_dir(upload_id) / "data.part"
+
+    def _save(self, state):
+        path = self.session_dir(state["id"]) / "state.json"
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def get(self, upload_id):
+        """读取会话状态，不存在（或 id 非法）返回 None"""
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            return None
+        path = self.session_dir(upload_id) / "state.json"
+        if not path.exists():
+            return None
+        with path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def describe(self, state):
+        """会话对外展示的进度信息"""
+        received = sum(end - start for start, end in state["ranges"])
+        ranges = state["ranges"]
+        offset = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+        return {
+            "upload_id": state["id"],
+            "filename": state["filename"],
+            "size": state["size"],
+            "sha256": state.get("sha256"),
+            "received": received,
+            "offset": offset,
+            "missing": missing_ranges(ranges, state["size"]),
+            "complete": received == state["size"],
+        }
+
+    def purge_expired(self):
+        """清理超过 SESSION_TTL 未更新的会话"""
+        now = time.time()
+        for d in self.root.iterdir():
+            if self._writers.get(d.name):
+                continue
+            state = self.get(d.name)
+            updated = state["updated"] if state else d.stat().st_mtime
+            if now - updated > SESSION_TTL:
+                shutil.rmtree(d, ignore_errors=True)
+                self._locks.pop(d.name, None)
+
+    def create(self, filename, size, sha256=None):
+        """
+        创建续传会话并预分配目标文件
+
+        异常:
+        ValueError -- 声明大小为负数
+        UploadTooLarge -- 声明大小超过上限
+        """
+        if size < 0:
+            raise ValueError(f"文件大小不能为负数: {size}")
+        if size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        self.purge_expired()
+        upload_id = uuid.uuid4().hex
+        session = self.session_dir(upload_id)
+        session.mkdir()
+        with self.data_path(upload_id).open("wb") as f:
+            f.truncate(size)
+        now = time.time()
+        state = {
+            "id": upload_id,
+            "filename": Path(filename or "upload").name,
+            "size": size,
+            "sha256": sha256.lower() if sha256 else None,
+            "ranges": [],
+            "created": now,
+            "updated": now,
+        }
+        self._save(state)
+        return state
+
+    async def write_range(self, upload_id, start, chunks):
+        """
+        从 start 偏移开始写入数据块流；无论正常结束还是中断，都记录实际写入的区间。
+
+        异常:
+        UploadNotFound -- 会话不存在，或写入期间会话已被删除
+        UploadRangeError -- 区间超出文件大小
+        """
+        async with self._lock(upload_id):
+            state = self.get(upload_id)
+            if state is None:
+                raise UploadNotFound(upload_id)
+            if start < 0 or start > state["size"]:
+                raise UploadRangeError(f"偏移 {start} 超出文件大小 {state['size']}")
+            self._writers[upload_id] = self._writers.get(upload_id, 0) + 1
+        written = 0
+        try:
+            async with aiofiles.open(self.data_path(upload_id), "r+b") as f:
+                await f.seek(start)
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if start + written + len(chunk) > state["size"]:
+                        raise UploadRangeError(f"写入区间超出文件大小 {state['size']}")
+                    await f.write(chunk)
+                    written += len(chunk)
+        finally:
+            async with self._lock(upload_id):
+                remaining = self._writers.get(upload_id, 1) - 1
+                if remaining > 0:
+                    self._writers[upload_id] = remaining
+                else:
+                    self._writers.pop(upload_id, None)
+                # 重新读取状态，合并并发 PATCH 写入的区间；会话已被删除时不再记录
+                state = self.get(upload_id)
+                if written and state is not None:
+                    state["ranges"] = merge_ranges(state["ranges"] + [[start, start + written]])
+                    state["updated"] = time.time()
+                    await asyncio.to_thread(self._save, state)
+        if state is None:
+            raise UploadNotFound(upload_id)
+        return state
+
+    async def finalize(self, upload_id):
+        """
+        校验完整性与 SHA-256 后注册为数据集，并删除会话
+
+        异常:
+        UploadNotFound -- 会话不存在
+        UploadBusy -- 仍有正在写入的 PATCH 请求（等其结束后重试）
+        UploadIncomplete -- 仍有缺失区间
+        ChecksumMismatch -- 与创建时声明的 SHA-256 不一致（会话被删除，需重新上传）
+        zipfile.BadZipFile -- ZIP 文件损坏
+        """
+        async with self._lock(upload_id):
+            state = self.get(upload_id)
+            if state is None:
+                raise UploadNotFound(upload_id)
+            # 重发的区间可能仍在写入旧的 data.part，此时移动文件会使其写入已注册的数据集
+            if self._writers.get(upload_id):
+                raise UploadBusy(self._writers[upload_id])
+            missing = missing_ranges(state["ranges"], state["size"])
+            if missing:
+                raise UploadIncomplete(missing)
+            data_path = self.data_path(upload_id)
+            sha256 = await asyncio.to_thread(file_sha256, data_path)
+            if state.get("sha256") and state["sha256"] != sha256:
+                self.delete(upload_id)
+                raise ChecksumMismatch(state["sha256"], sha256)
+            staging = self.store.new_staging_dir()
+            os.replace(data_path, staging / "source" / state["filename"])
+            self.delete(upload_id)
+        return await asyncio.to_thread(self.store.commit, staging, state["filename"], sha256, state["size"])
+
+    def delete(self, upload_id):
+        shutil.rmtree(self.session_dir(upload_id), ignore_errors=True)
+        self._locks.pop(upload_id, None)
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from pathlib import Path
+
+# outputs 目录的容量上限（字节），可通过环境变量 OUTPUTS_QUOTA_BYTES 配置，默认 100 GiB
+QUOTA_BYTES = int(os.environ.get("OUTPUTS_QUOTA_BYTES", 100 << 30))
+# 超出配额时清理到配额的该比例以下，避免每个新任务都触发清理
+LOW_WATERMARK = float(os.environ.get("OUTPUTS_LOW_WATERMARK", 0.9))
+# 最近该秒数内创建或访问过的条目不会被清理（保护正在运行的任务与刚上传的数据集）
+MIN_AGE = int(os.environ.get("OUTPUTS_MIN_AGE", 3600))
+# 两次自动清理之间的最小间隔（秒）
+SWEEP_INTERVAL = int(os.environ.get("OUTPUTS_SWEEP_INTERVAL", 60))
+
+JOB_FILE = "job.json"
+
+_sweep_lock = threading.Lock()
+_last_sweep = [0.0]
+
+
+def tree_stats(path):
+    """
+    文件或目录（递归）占用的字节数，以及其中（含各级子目录）最新的修改时间。
+    任务在子目录中写文件、或反复改写已有文件时，只有这样才能反映其最近活动。
+    """
+    path = Path(path)
+    st = path.stat()
+    if not path.is_dir():
+        return st.st_size, st.st_mtime
+    total = 0
+    newest = st.st_mtime
+    stack = [str(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    entry_stat = entry.stat(follow_symlinks=False)
+                    newest = max(newest, entry_stat.st_mtime)
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry_stat.st_size
+        except FileNotFoundError:
+            pass
+    return total, newest
+
+
+def tree_size(path):
+    """文件或目录（递归）占用的字节数"""
+    return tree_stats(path)[0]
+
+
+def flatten_ids(datasets):
+    """将接口返回的 datasets（值可能是 id 或 id 列表）展开为 id 列表"""
+    ids = []
+    for value in (datasets or {}).values():
+        if isinstance(value, (list, tuple)):
+            ids.extend(v for v in value if v)
+        elif value:
+            ids.append(value)
+    return ids
+
+
+class OutputsStore:
+    """
+    outputs 目录的容量管理，按“条目”统计占用并按最近访问时间（LRU）清理：
+        {uid}_xxx/                任务目录（含 job.json 的目录，job.json 记录引用的数据集）
+        datasets/{id}/            数据集（仍被现存任务引用的不会被清理）
+        rusle_cache/{文件}        因子缓存
+        tile_cache/{栅格键}/      渲染瓦片缓存（按栅格整体清理）
+    最近访问时间取条目内（含子目录）最新的 mtime：任务写文件、/files 访问与数据集被引用时都会刷新。
+    """
+
+    def __init__(self, outputs_dir, quota_bytes=QUOTA_BYTES, datasets_dir="datasets", cache_dirs=("rusle_cache", "tile_cache")):
+        self.root = Path(outputs_dir)
+        self.quota_bytes = quota_bytes
+        self.datasets_dir = datasets_dir
+        self.cache_dirs = tuple(cache_dirs)
+
+    def entry_of(self, rel_path):
+        """由相对 outputs 的路径得到所属条目名，不属于任何可清理条目时返回 None"""
+        parts = [p for p in str(rel_path).replace("\\", "/").split("/") if p]
+        if not parts or parts[0].startswith(".") or ".." in parts:
+            return None
+        if parts[0] == self.datasets_dir or parts[0] in self.cache_dirs:
+            if len(parts) < 2 or parts[1].startswith("."):
+                return None
+            return f"{parts[0]}/{parts[1]}"
+        return parts[0]
+
+    def touch(self, entry):
+        try:
+            os.utime(self.root / entry, None)
+        except OSError:
+            pass
+
+    def touch_path(self, rel_path):
+        """记录一次文件访问（/files 请求）"""
+        entry = self.entry_of(rel_path)
+        if entry:
+            self.touch(entry)
+
+    def record_job(self, job_dir, datasets):
+        """
+        写入任务清单 job.json（引用的数据集 id），刷新这些数据集的访问时间，并按需触发后台清理
+        """
+        job_dir = Path(job_dir)
+        job_dir.mkdir(parents=True, exist_ok=True)
+        ids = flatten_ids(datasets)
+        with (job_dir / JOB_FILE).open("w", encoding="utf-8") as f:
+            json.dump({"id": job_dir.name, "datasets": ids, "created": time.time()}, f, ensure_ascii=False)
+        for dataset_id in ids:
+            self.touch(f"{self.datasets_dir}/{dataset_id}")
+        self.maybe_sweep()
+
+    def pinned_datasets(self):
+        """现存任务引用的数据集 id"""
+        pinned = set()
+        for d in self.root.iterdir():
+            job_file = d / JOB_FILE
+            if d.name.startswith(".") or not job_file.is_file():
+                continue
+            try:
+                with job_file.open("r", encoding="utf-8") as f:
+                    pinned.update(json.load(f).get("datasets", []))
+            except (OSError, ValueError):
+                continue
+        return pinned
+
+    def entries(self):
+        """列出所有可清理条目：名称、类型、占用字节、最近访问时间、是否被引用"""
+        pinned = self.pinned_datasets()
+        result = []
+        for d in self.root.iterdir():
+            if d.name.startswith("."):
+                continue
+            if d.name == self.datasets_dir or d.name in self.cache_dirs:
+                if not d.is_dir():
+                    continue
+                kind = "dataset" if d.name == self.datasets_dir else "cache"
+                children = [c for c in d.iterdir() if not c.name.startswith(".")]
+            elif (d / JOB_FILE).is_file():
+                kind = "job"
+                children = [d]
+            else:
+                # 没有 job.json 的文件或目录（如说明文件、正在创建的任务）不是任务，不参与清理
+                continue
+            for c in children:
+                try:
+                    size, last_access = tree_stats(c)
+                except FileNotFoundError:
+                    continue
+                result.append({
+                    "name": c.relative_to(self.root).as_posix(),
+                    "kind": kind,
+                    "size": size,
+                    "last_access": last_access,
+                    "pinned": kind == "dataset" and c.name in pinned,
+                })
+        return result
+
+    def usage(self):
+        entries = self.entries()
+        by_kind = {}
+        for e in entries:
+            stat = by_kind.setdefault(e["kind"], {"count": 0, "size": 0})
+            stat["count"] += 1
+            stat["size"] += e["size"]
+        # 上传暂存与续传会话不参与清理（续传会话有单独的过期时间），只计入占用
+        staging = sum(tree_size(self.root / self.datasets_dir / name) for name in (".tmp", ".uploads")
+                      if (self.root / self.datasets_dir / name).exists())
+        used = sum(e["size"] for e in entries) + staging
+        return {
+            "quota_bytes": self.quota_bytes,
+            "used_bytes": used,
+            "staging_bytes": staging,
+            "by_kind": by_kind,
+            "entries": sorted(entries, key=lambda e: e["last_access"]),
+        }
+
+    def _remove(self, entry):
+        """先移入 .trash 再删除，避免清理过程中留下半删除的任务或数据集"""
+        path = self.root / entry
+        trash = self.root / ".trash"
+        trash.mkdir(exist_ok=True)
+        target = trash / uuid.uuid4().hex
+        try:
+            os.rename(path, target)
+        except FileNotFoundError:
+            return
+        if target.is_dir():
+            shutil.rmtree(target, ignore_errors=True)
+        else:
+            target.unlink(missing_ok=True)
+
+    def sweep(self):
+        """
+        超出配额时按最近访问时间从旧到新清理，直到降到 LOW_WATERMARK·配额以下。
+        被现存任务引用的数据集与 MIN_AGE 内访问过的条目跳过；任务被清理后其数据集不再被引用，可在后续清理中回收。
+
+        返回:
+        dict -- 清理前后占用与被清理的条目
+        """
+        with _sweep_lock:
+            _last_sweep[0] = time.time()
+            shutil.rmtree(self.root / ".trash", ignore_errors=True)
+            usage = self.usage()
+            used = usage["used_bytes"]
+            evicted = []
+            if used > self.quota_bytes:
+                target = self.quota_bytes * LOW_WATERMARK
+                now = time.time()
+                for e in usage["entries"]:
+                    if used <= target:
+                        break
+                    if e["pinned"] or now - e["last_access"] < MIN_AGE:
+                        continue
+                    self._remove(e["name"])
+                    used -= e["size"]
+                    evicted.append({"name": e["name"], "kind": e["kind"], "size": e["size"]})
+                    print(f"清理 outputs 条目: {e['name']} ({e['size']} 字节)")
+            return {"before_bytes": usage["used_bytes"], "after_bytes": used, "quota_bytes": self.quota_bytes, "evicted": evicted}
+
+    def maybe_sweep(self):
+        """距上次清理超过 SWEEP_INTERVAL 时在后台线程中清理，不阻塞请求"""
+        if time.time() - _last_sweep[0] < SWEEP_INTERVAL or _sweep_lock.locked():
+            return
+        _last_sweep[0] = time.time()
+        threading.Thread(target=self.sweep, daemon=True).start()
@@ -1,14 +1,198 @@
 import numpy as np
 import rasterio
 from rasterio.mask import mask
+from rasterio.features import geometry_mask, geometry_window
+from rasterio.windows import Window, transform as window_transform
 from rasterio.plot import show
 import geopandas as gpd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
 import os
+import sys
+import threading
 import warnings
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from submod.公共.统计 import RasterStats, load_stats, write_stats
 warnings.filterwarnings("ignore", category=rasterio.errors.NotGeoreferencedWarning)
 
-def calculate_vegetation_cover_factor(ndvi_file_path, shp_file_path, output_dir="output"):
+# 植被覆盖度分段（与C因子分段函数一致），用于统计各分段像素数
+F_CLASSES = {
+    "low": lambda f: f < 0.1,
+    "medium": lambda f: (f >= 0.1) & (f <= 0.783),
+    "high": lambda f: f > 0.783,
+}
+# 裁剪范围像元数超过该值时按块流式计算（环境变量 C_FACTOR_STREAM_PIXELS）
+STREAM_PIXELS = int(os.environ.get("C_FACTOR_STREAM_PIXELS", 50_000_000))
+# 流式计算的块大小（像素，需为 16 的倍数），同时作为输出栅格的内部分块大小
+STREAM_BLOCK_SIZE = 512
+# 可视化读取的降采样尺寸（最长边像素）
+STREAM_PREVIEW_SIZE = 2048
+# 可视化图片的默认 DPI（环境变量 C_FACTOR_VIS_DPI）
+VIS_DPI = int(os.environ.get("C_FACTOR_VIS_DPI", 150))
+
+
+def vegetation_cover(ndvi, ndvi_soil, ndvi_veg):
+    """植被覆盖度 f = (NDVI - NDVI_soil) / (NDVI_veg - NDVI_soil)，截断到 [0, 1]，NaN 保持为 NaN"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.clip((ndvi - ndvi_soil) / (ndvi_veg - ndvi_soil), 0.0, 1.0)
+
+
+def resolve_endmembers(ndvi_stats, ndvi_soil=None, ndvi_veg=None, soil_percentile=None, veg_percentile=None):
+    """
+    确定裸土/纯植被的NDVI端元：优先使用给定值，其次使用百分位（由分位数草图估计，无需排序全量数据），
+    否则使用裁剪范围内NDVI的最小/最大值
+
+    返回:
+    dict -- {ndvi_soil, ndvi_veg, soil_source, veg_source}
+    """
+    def pick(value, percentile, fallback, name):
+        if value is not None:
+            return float(value), "value"
+        if percentile is not None:
+            return ndvi_stats.quantile(percentile / 100), f"p{percentile:g}"
+        return fallback, name
+
+    soil, soil_source = pick(ndvi_soil, soil_percentile, ndvi_stats.min, "min")
+    veg, veg_source = pick(ndvi_veg, veg_percentile, ndvi_stats.max, "max")
+    if not veg > soil:
+        raise ValueError(f"NDVI端元无效: 土壤 {soil} 不小于植被 {veg}")
+    return {"ndvi_soil": soil, "ndvi_veg": veg, "soil_source": soil_source, "veg_source": veg_source}
+
+
+def cover_factor(f):
+    """按分段函数由植被覆盖度 f 计算植被覆盖因子 C，NaN 保持为 NaN"""
+    C = np.full_like(f, np.nan)
+    # 条件1: f < 0.1 时, C = 1
+    C[f < 0.1] = 1.0
+    # 条件2: 0.1 <= f <= 0.783 时, C = 0.6508 - 0.3436 * lg(f)
+    medium = (f >= 0.1) & (f <= 0.783)
+    C[medium] = 0.6508 - 0.3436 * np.log10(f[medium])
+    # 条件3: f > 0.783 时, C = 0
+    C[f > 0.783] = 0.0
+    return C
+
+
+# 多波段产品：一个分块压缩的文件依次保存裁剪后NDVI、f、C 三个波段（NODATA 统一为 -9999）
+PRODUCT_FILE = "C因子产品.tif"
+PRODUCT_BANDS = {"ndvi": 1, "f": 2, "C": 3}
+BAND_DESCRIPTIONS = {"ndvi": "裁剪后NDVI", "f": "植被覆盖度f", "C": "植被覆盖因子C"}
+# 分文件输出时各结果的文件名
+LAYER_FILES = {"ndvi": "裁剪后ndvi.tif", "f": "植被覆盖度f.tif", "C": "C因子.tif"}
+
+
+def output_layers(output_dir):
+    """
+    结果栅格的位置：有多波段产品时为 {名称: (产品路径, 波段号)}，否则为 {名称: (文件路径, 1)}
+    """
+    product = os.path.join(output_dir, PRODUCT_FILE)
+    if os.path.exists(product):
+        return {name: (product, band) for name, band in PRODUCT_BANDS.items()}
+    return {name: (os.path.join(output_dir, file_name), 1) for name, file_name in LAYER_FILES.items()}
+
+
+# 多时相NDVI的时间合成方法（逐像元忽略 NaN）
+COMPOSITES = {"mean": np.nanmean, "max": np.nanmax, "median": np.nanmedian}
+
+
+def as_path_list(ndvi_file_path):
+    """单个路径或路径列表统一为列表"""
+    if isinstance(ndvi_file_path, (str, os.PathLike)):
+        return [ndvi_file_path]
+    return list(ndvi_file_path)
+
+
+def open_ndvi_stack(paths, exit_stack):
+    """
+    打开多时相NDVI：多波段文件的每个波段、或多个单景文件各算一个时相。各时相需网格一致（尺寸、变换、坐标系）
+
+    返回:
+    list -- [(dataset, 波段号)]，第一个数据集的网格作为输出网格
+    """
+    bands = []
+    for path in paths:
+        src = exit_stack.enter_context(rasterio.open(path))
+        if bands:
+            ref = bands[0][0]
+            if (src.width, src.height, src.transform, src.crs) != (ref.width, ref.height, ref.transform, ref.crs):
+                raise ValueError(f"NDVI时相的网格不一致: {path}")
+        bands.extend((src, band) for band in range(1, src.count + 1))
+    return bands
+
+
+def stack_size(ndvi_file_path):
+    """多时相NDVI的时相数（只读取文件头）"""
+    with ExitStack() as exit_stack:
+        return len(open_ndvi_stack(as_path_list(ndvi_file_path), exit_stack))
+
+
+def read_composite(bands, window, method="mean"):
+    """
+    读取一个窗口内所有时相并合成为单层NDVI（NODATA 转为 NaN），内存为 块大小 × 时相数
+
+    返回:
+    numpy.ndarray -- float32，全部时相无效的像元为 NaN
+    """
+    layers = np.empty((len(bands), int(window.height), int(window.width)), dtype=np.float32)
+    for i, (src, band) in enumerate(bands):
+        layers[i] = src.read(band, window=window)
+        if src.nodata is not None:
+            layers[i][layers[i] == src.nodata] = np.nan
+    if len(bands) == 1:
+        return layers[0]
+    with warnings.catch_warnings():
+        # 全部时相为 NaN 的像元结果为 NaN，忽略 "All-NaN slice" 等提示
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return COMPOSITES[method](layers, axis=0).astype(np.float32)
+
+
+def clip_window(ndvi_file_path, shp_file_path):
+    """裁剪范围对应的 NDVI 窗口（只读取矢量与栅格头信息），用于判断是否需要流式计算"""
+    gdf = gpd.read_file(shp_file_path)
+    with rasterio.open(as_path_list(ndvi_file_path)[0]) as src:
+        if gdf.crs is not None and gdf.crs != src.crs:
+            gdf = gdf.to_crs(src.crs)
+        return geometry_window(src, gdf.geometry.values)
+
+
+def run_c_factor(ndvi_file_path, shp_file_path, output_dir="output", mode="auto", composite="mean", output_format="separate",
+                 **endmember_options):
+    """
+    计算C因子并写出结果文件，按裁剪范围大小选择整幅内存计算或按块流式计算
+
+    参数:
+    ndvi_file_path: NDVI 路径，或多时相NDVI（多波段文件、多个单景文件的路径列表）
+    mode: auto（超过 STREAM_PIXELS 像元时流式）/ memory / stream；多时相NDVI总是流式合成
+    composite: 多时相合成方法 mean / max / median
+    output_format: separate（三个单波段文件）/ multiband（一个三波段产品，总是流式写出）
+    endmember_options: ndvi_soil/ndvi_veg/soil_percentile/veg_percentile，见 resolve_endmembers
+
+    返回:
+    (bool, str) -- 是否成功、实际使用的模式
+    """
+    try:
+        if mode != "stream" and (output_format == "multiband" or stack_size(ndvi_file_path) > 1):
+            mode = "stream"
+    except Exception as e:
+        print(f"读取NDVI时相信息失败: {e}")
+    if mode == "auto":
+        try:
+            window = clip_window(ndvi_file_path, shp_file_path)
+            mode = "stream" if window.width * window.height > STREAM_PIXELS else "memory"
+        except Exception as e:
+            print(f"估计裁剪范围失败，使用流式计算: {e}")
+            mode = "stream"
+    if mode == "stream":
+        C_file, _ = calculate_vegetation_cover_factor_streaming(ndvi_file_path, shp_file_path, output_dir,
+                                                                composite=composite, output_format=output_format,
+                                                                **endmember_options)
+        return C_file is not None, mode
+    C, _ = calculate_vegetation_cover_factor(as_path_list(ndvi_file_path)[0], shp_file_path, output_dir, **endmember_options)
+    return C is not None, mode
+
+def calculate_vegetation_cover_factor(ndvi_file_path, shp_file_path, output_dir="output", ndvi_soil=None, ndvi_veg=None,
+                                      soil_percentile=None, veg_percentile=None):
     """
     基于NDVI数据计算植被覆盖因子C
     
@@ -16,6 +200,7 @@ def calculate_vegetation_cover_factor(ndvi_file_path, shp_file_path, output_dir=
     ndvi_file_path: NDVI TIF文件路径
     shp_file_path: 裁剪用的Shp文件路径
     output_dir: 输出目录
+    ndvi_soil, ndvi_veg, soil_percentile, veg_percentile: NDVI端元设置，见 resolve_endmembers，默认取最小/最大值
     """
     # 创建输出目录
     if not os.path.exists(output_dir):
@@ -58,6 +243,9 @@ def calculate_vegetation_cover_factor(ndvi_file_path, shp_file_path, output_dir=
             clipped_ndvi_file = os.path.join(output_dir, "裁剪后ndvi.tif")
             with rasterio.open(clipped_ndvi_file, 'w', **profile) as dst:
                 dst.write(clipped_ndvi, 1)
+            # 每个数组只扫描一次：统计结果同时用于f公式、日志、统计文件与报告
+            ndvi_stats = RasterStats(quantiles=True).update(clipped_ndvi, src.nodata)
+            write_stats(clipped_ndvi_file, ndvi_stats.to_dict())
             print(f"裁剪后的NDVI已保存为: {clipped_ndvi_file}")
             
             # 处理无效值
@@ -66,41 +254,28 @@ def calculate_vegetation_cover_factor(ndvi_file_path, shp_file_path, output_dir=
                 clipped_ndvi[clipped_ndvi == src.nodata] = np.nan
             
             print(f"裁剪后NDVI数据形状: {clipped_ndvi.shape}")
-            print(f"裁剪后NDVI有效值范围: {np.nanmin(clipped_ndvi):.4f} ~ {np.nanmax(clipped_ndvi):.4f}")
+            print(f"裁剪后NDVI有效值范围: {ndvi_stats.min:.4f} ~ {ndvi_stats.max:.4f}")
             
             # 步骤1: 计算植被覆盖度f (根据图1公式)
-            # 修正后的公式: f = (NDVI - NDVI_min) / (NDVI_max - NDVI_min)
+            # 修正后的公式: f = (NDVI - NDVI_soil) / (NDVI_veg - NDVI_soil)，端元默认为NDVI最小/最大值
+            endmembers = resolve_endmembers(ndvi_stats, ndvi_soil, ndvi_veg, soil_percentile, veg_percentile)
+            print(f"NDVI端元: 土壤 {endmembers['ndvi_soil']:.4f} ({endmembers['soil_source']}), "
+                  f"植被 {endmembers['ndvi_veg']:.4f} ({endmembers['veg_source']})")
             print("正在计算植被覆盖度f...")
-            with np.errstate(divide='ignore', invalid='ignore'):
-                # 计算每个像素的f值
-                f = (clipped_ndvi - np.nanmin(clipped_ndvi)) / (np.nanmax(clipped_ndvi) - np.nanmin(clipped_ndvi))
+            f = vegetation_cover(clipped_ndvi, endmembers["ndvi_soil"], endmembers["ndvi_veg"])
             
-            print(f"植被覆盖度f范围: {np.nanmin(f):.4f} ~ {np.nanmax(f):.4f}")
+            f_stats = RasterStats(classes=F_CLASSES).update(f)
+            print(f"植被覆盖度f范围: {f_stats.min:.4f} ~ {f_stats.max:.4f}")
             
             # 步骤2: 根据图2的分段函数计算植被覆盖因子C
             print("正在计算植被覆盖因子C...")
-            # 初始化C数组
-            C = np.full_like(f, np.nan)
+            C = cover_factor(f)
+            print(f"低植被覆盖区域(f<0.1)比例: {f_stats.class_counts['low'] / f_stats.count * 100:.2f}%")
+            print(f"中等植被覆盖区域(0.1≤f≤0.783)比例: {f_stats.class_counts['medium'] / f_stats.count * 100:.2f}%")
+            print(f"高植被覆盖区域(f>0.783)比例: {f_stats.class_counts['high'] / f_stats.count * 100:.2f}%")
             
-            # 条件1: f < 0.1 时, C = 1
-            mask1 = f < 0.1
-            C[mask1] = 1.0
-            print(f"低植被覆盖区域(f<0.1)比例: {np.sum(mask1) / np.sum(~np.isnan(f)) * 100:.2f}%")
-            
-            # 条件2: 0.1 <= f <= 0.783 时, C = 0.6508 - 0.3436 * lg(f)
-            mask2 = (f >= 0.1) & (f <= 0.783)
-            # 避免对0或负数取对数
-            valid_f = f[mask2]
-            valid_f[valid_f <= 0] = 1e-10  # 避免对数计算错误
-            C[mask2] = 0.6508 - 0.3436 * np.log10(valid_f)
-            print(f"中等植被覆盖区域(0.1≤f≤0.783)比例: {np.sum(mask2) / np.sum(~np.isnan(f)) * 100:.2f}%")
-            
-            # 条件3: f > 0.783 时, C = 0
-            mask3 = f > 0.783
-            C[mask3] = 0.0
-            print(f"高植被覆盖区域(f>0.783)比例: {np.sum(mask3) / np.sum(~np.isnan(f)) * 100:.2f}%")
-            
-            print(f"植被覆盖因子C范围: {np.nanmin(C):.4f} ~ {np.nanmax(C):.4f}")
+            C_stats = RasterStats().update(C)
+            print(f"植被覆盖因子C范围: {C_stats.min:.4f} ~ {C_stats.max:.4f}")
             
             # 保存植被覆盖度f为TIF文件
             f_output_profile = profile.copy()
@@ -112,6 +287,7 @@ def calculate_vegetation_cover_factor(ndvi_file_path, shp_file_path, output_dir=
                 f_data_to_save = f.copy()
                 f_data_to_save[np.isnan(f_data_to_save)] = -9999
                 dst.write(f_data_to_save.astype(rasterio.float32), 1)
+            write_stats(f_output_file, {**f_stats.to_dict(), "endmembers": endmembers})
             print(f"植被覆盖度f已保存为: {f_output_file}")
             
             # 保存植被覆盖因子C为TIF文件
@@ -124,13 +300,11 @@ def calculate_vegetation_cover_factor(ndvi_file_path, shp_file_path, output_dir=
                 C_data_to_save = C.copy()
                 C_data_to_save[np.isnan(C_data_to_save)] = -9999
                 dst.write(C_data_to_save.astype(rasterio.float32), 1)
+            write_stats(C_output_file, C_stats.to_dict())
             print(f"植被覆盖因子C已保存为: {C_output_file}")
             
-            # 生成结果统计报告
-            generate_statistics_report(clipped_ndvi, f, C, output_dir)
-            
-            # 可视化结果
-            create_visualization(clipped_ndvi, f, C, output_dir)
+            # 生成结果统计报告（可视化图表由 request_visualization 按需在后台生成）
+            generate_statistics_report(ndvi_stats, f_stats, C_stats, output_dir, endmembers)
             
             return C, f
             
@@ -138,8 +312,163 @@ def calculate_vegetation_cover_factor(ndvi_file_path, shp_file_path, output_dir=
         print(f"处理过程中发生错误: {e}")
         return None, None
 
-def generate_statistics_report(ndvi, f, C, output_dir):
-    """生成统计报告"""
+def calculate_vegetation_cover_factor_streaming(ndvi_file_path, shp_file_path, output_dir="output", ndvi_soil=None, ndvi_veg=None,
+                                                soil_percentile=None, veg_percentile=None, composite="mean",
+                                                output_format="separate", block_size=STREAM_BLOCK_SIZE):
+    """
+    按块流式计算植被覆盖因子C，适用于无法整幅读入内存的大范围NDVI，内存占用只与块大小有关
+
+    第一遍：逐块读取裁剪窗口内的NDVI（多时相时逐块读取全部时相并做时间合成），按矢量掩膜后写出裁剪后ndvi.tif，同时累加NDVI的全局统计（最小/最大值与分位数草图）
+    第二遍：逐块读取裁剪后NDVI，计算f与C并按窗口写出植被覆盖度f.tif与C因子.tif
+    output_format 为 multiband 时两遍都写入同一个三波段产品 C因子产品.tif（按波段交错、DEFLATE 压缩、带波段描述），
+    第二遍以更新模式读取第 1 波段并写入第 2、3 波段，不再产生三个文件
+
+    参数:
+    ndvi_file_path: NDVI TIF文件路径，或多时相NDVI（多波段文件、路径列表）
+    shp_file_path: 裁剪用的Shp文件路径
+    output_dir: 输出目录
+    ndvi_soil, ndvi_veg, soil_percentile, veg_percentile: NDVI端元设置，见 resolve_endmembers
+    composite: 多时相合成方法 mean / max / median
+    output_format: separate / multiband
+    block_size: 块大小（像素，16 的倍数）
+
+    返回:
+    (str, str) -- C因子与植被覆盖度f的文件路径（multiband 时均为产品路径），失败时为 (None, None)
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    try:
+        print(f"读取Shp文件: {shp_file_path}")
+        gdf = gpd.read_file(shp_file_path)
+        
+        print(f"读取NDVI文件: {ndvi_file_path}")
+        with ExitStack() as exit_stack:
+            bands = open_ndvi_stack(as_path_list(ndvi_file_path), exit_stack)
+            src = bands[0][0]
+            if len(bands) > 1:
+                print(f"多时相NDVI: {len(bands)} 个时相，按块计算时间合成（{composite}）")
+            if gdf.crs is not None and gdf.crs != src.crs:
+                print(f"坐标系不匹配: Shp文件为{gdf.crs}, NDVI文件为{src.crs}，正在转换Shp文件坐标系...")
+                gdf = gdf.to_crs(src.crs)
+            geometries = gdf.geometry.values
+            
+            # 裁剪窗口与 mask(crop=True) 一致，只对窗口内的块做读取与掩膜
+            clip = geometry_window(src, geometries)
+            clip_transform = src.window_transform(clip)
+            profile = src.profile.copy()
+            profile.update({
+                'driver': 'GTiff',
+                'count': 1,
+                'height': int(clip.height),
+                'width': int(clip.width),
+                'transform': clip_transform,
+                'dtype': rasterio.float32,
+                'nodata': np.nan,
+                'tiled': True,
+                'blockxsize': block_size,
+                'blockysize': block_size,
+                'BIGTIFF': 'IF_SAFER',
+            })
+            print(f"裁剪窗口: {clip.height} x {clip.width}，按 {block_size} 像素分块流式计算")
+            multiband = output_format == "multiband"
+            if multiband:
+                # 按波段交错，第二遍写入第 2、3 波段时不需要改写第 1 波段的块；SPARSE_OK 避免预先写出空块
+                profile.update(count=len(PRODUCT_BANDS), nodata=-9999, compress='deflate', predictor=3,
+                               interleave='band', SPARSE_OK='TRUE')
+                clipped_ndvi_file = os.path.join(output_dir, PRODUCT_FILE)
+            else:
+                clipped_ndvi_file = os.path.join(output_dir, LAYER_FILES["ndvi"])
+            
+            # 第一遍：掩膜写出裁剪后NDVI并累加全局统计
+            ndvi_stats = RasterStats(quantiles=True)
+            with rasterio.open(clipped_ndvi_file, 'w', **profile) as dst:
+                if multiband:
+                    for name, band in PRODUCT_BANDS.items():
+                        dst.set_band_description(band, BAND_DESCRIPTIONS[name])
+                for _, window in dst.block_windows(1):
+                    src_window = Window(clip.col_off + window.col_off, clip.row_off + window.row_off, window.width, window.height)
+                    block = read_composite(bands, src_window, composite)
+                    inside = geometry_mask(geometries, out_shape=block.shape,
+                                           transform=window_transform(window, clip_transform), invert=True)
+                    block[~inside] = np.nan
+                    ndvi_stats.update(block)
+                    dst.write(np.where(np.isnan(block), -9999, block) if multiband else block, 1, window=window)
+            ndvi_summary = ndvi_stats.to_dict()
+            if len(bands) > 1:
+                ndvi_summary["composite"] = {"method": composite, "scenes": len(bands)}
+            write_stats(clipped_ndvi_file, ndvi_summary)
+            print(f"裁剪后的NDVI已保存为: {clipped_ndvi_file}")
+        
+        if ndvi_stats.count == 0:
+            print("裁剪范围内没有有效的NDVI像元")
+            return None, None
+        print(f"裁剪后NDVI有效值范围: {ndvi_stats.min:.4f} ~ {ndvi_stats.max:.4f}")
+        endmembers = resolve_endmembers(ndvi_stats, ndvi_soil, ndvi_veg, soil_percentile, veg_percentile)
+        print(f"NDVI端元: 土壤 {endmembers['ndvi_soil']:.4f} ({endmembers['soil_source']}), "
+              f"植被 {endmembers['ndvi_veg']:.4f} ({endmembers['veg_source']})")
+        
+        # 第二遍：逐块计算f与C并写出
+        print("正在计算植被覆盖度f与植被覆盖因子C...")
+        f_stats = RasterStats(classes=F_CLASSES)
+        C_stats = RasterStats()
+        with ExitStack() as exit_stack:
+            if multiband:
+                ndvi_src = f_dst = C_dst = exit_stack.enter_context(rasterio.open(clipped_ndvi_file, 'r+'))
+                f_output_file = C_output_file = clipped_ndvi_file
+                f_band, C_band = PRODUCT_BANDS["f"], PRODUCT_BANDS["C"]
+            else:
+                output_profile = profile.copy()
+                output_profile.update(nodata=-9999)
+                f_output_file = os.path.join(output_dir, LAYER_FILES["f"])
+                C_output_file = os.path.join(output_dir, LAYER_FILES["C"])
+                ndvi_src = exit_stack.enter_context(rasterio.open(clipped_ndvi_file))
+                f_dst = exit_stack.enter_context(rasterio.open(f_output_file, 'w', **output_profile))
+                C_dst = exit_stack.enter_context(rasterio.open(C_output_file, 'w', **output_profile))
+                f_band = C_band = 1
+            for _, window in ndvi_src.block_windows(1):
+                ndvi = ndvi_src.read(1, window=window, masked=True).filled(np.nan)
+                f = vegetation_cover(ndvi, endmembers["ndvi_soil"], endmembers["ndvi_veg"])
+                C = cover_factor(f)
+                f_stats.update(f)
+                C_stats.update(C)
+                f_dst.write(np.where(np.isnan(f), -9999, f).astype(np.float32), f_band, window=window)
+                C_dst.write(np.where(np.isnan(C), -9999, C).astype(np.float32), C_band, window=window)
+        write_stats(f_output_file, {**f_stats.to_dict(), "endmembers": endmembers}, f_band)
+        write_stats(C_output_file, C_stats.to_dict(), C_band)
+        print(f"植被覆盖度f范围: {f_stats.min:.4f} ~ {f_stats.max:.4f}")
+        print(f"低植被覆盖区域(f<0.1)比例: {f_stats.class_counts['low'] / f_stats.count * 100:.2f}%")
+        print(f"中等植被覆盖区域(0.1≤f≤0.783)比例: {f_stats.class_counts['medium'] / f_stats.count * 100:.2f}%")
+        print(f"高植被覆盖区域(f>0.783)比例: {f_stats.class_counts['high'] / f_stats.count * 100:.2f}%")
+        print(f"植被覆盖因子C范围: {C_stats.min:.4f} ~ {C_stats.max:.4f}")
+        print(f"植被覆盖度f已保存为: {f_output_file}")
+        print(f"植被覆盖因子C已保存为: {C_output_file}")
+        
+        generate_statistics_report(ndvi_stats, f_stats, C_stats, output_dir, endmembers)
+        
+        return C_output_file, f_output_file
+    
+    except Exception as e:
+        print(f"处理过程中发生错误: {e}")
+        return None, None
+
+def read_decimated(tif_path, max_size=STREAM_PREVIEW_SIZE, band=1):
+    """降采样读取栅格的一个波段（最长边不超过 max_size），NODATA 转为 NaN"""
+    with rasterio.open(tif_path) as src:
+        scale = max(1.0, max(src.width, src.height) / max_size)
+        shape = (max(1, int(src.height / scale)), max(1, int(src.width / scale)))
+        data = src.read(band, out_shape=shape, masked=True).astype(np.float32)
+    return data.filled(np.nan)
+
+def generate_statistics_report(ndvi_stats, f_stats, C_stats, output_dir, endmembers=None):
+    """
+    生成统计报告
+
+    参数:
+    ndvi_stats, f_stats, C_stats: 主流程中已累加的 RasterStats，f_stats 需带 F_CLASSES 分类计数
+    output_dir: 输出目录
+    endmembers: resolve_endmembers 的结果，提供时写入计算f使用的NDVI端元
+    """
     report_file = os.path.join(output_dir, "statistics_report.txt")
     
     with open(report_file, 'w') as f_report:
@@ -147,26 +476,31 @@ def generate_statistics_report(ndvi, f, C, output_dir):
         f_report.write("=" * 50 + "\n\n")
         
         f_report.write("NDVI统计:\n")
-        f_report.write(f"  最小值: {np.nanmin(ndvi):.4f}\n")
-        f_report.write(f"  最大值: {np.nanmax(ndvi):.4f}\n")
-        f_report.write(f"  平均值: {np.nanmean(ndvi):.4f}\n")
-        f_report.write(f"  标准差: {np.nanstd(ndvi):.4f}\n\n")
+        f_report.write(f"  最小值: {ndvi_stats.min:.4f}\n")
+        f_report.write(f"  最大值: {ndvi_stats.max:.4f}\n")
+        f_report.write(f"  平均值: {ndvi_stats.mean:.4f}\n")
+        f_report.write(f"  标准差: {ndvi_stats.std:.4f}\n\n")
+        
+        if endmembers:
+            f_report.write("NDVI端元:\n")
+            f_report.write(f"  土壤: {endmembers['ndvi_soil']:.4f} ({endmembers['soil_source']})\n")
+            f_report.write(f"  植被: {endmembers['ndvi_veg']:.4f} ({endmembers['veg_source']})\n\n")
         
         f_report.write("植被覆盖度f统计:\n")
-        f_report.write(f"  最小值: {np.nanmin(f):.4f}\n")
-        f_report.write(f"  最大值: {np.nanmax(f):.4f}\n")
-        f_report.write(f"  平均值: {np.nanmean(f):.4f}\n\n")
+        f_report.write(f"  最小值: {f_stats.min:.4f}\n")
+        f_report.write(f"  最大值: {f_stats.max:.4f}\n")
+        f_report.write(f"  平均值: {f_stats.mean:.4f}\n\n")
         
         f_report.write("植被覆盖因子C统计:\n")
-        f_report.write(f"  最小值: {np.nanmin(C):.4f}\n")
-        f_report.write(f"  最大值: {np.nanmax(C):.4f}\n")
-        f_report.write(f"  平均值: {np.nanmean(C):.4f}\n\n")
+        f_report.write(f"  最小值: {C_stats.min:.4f}\n")
+        f_report.write(f"  最大值: {C_stats.max:.4f}\n")
+        f_report.write(f"  平均值: {C_stats.mean:.4f}\n\n")
         
-        # 计算各分段的像素数量
-        total_pixels = np.sum(~np.isnan(f))
-        low_cover = np.sum(f < 0.1)
-        medium_cover = np.sum((f >= 0.1) & (f <= 0.783))
-        high_cover = np.sum(f > 0.783)
+        # 各分段的像素数量（在计算f时已一并统计）
+        total_pixels = f_stats.count
+        low_cover = f_stats.class_counts["low"]
+        medium_cover = f_stats.class_counts["medium"]
+        high_cover = f_stats.class_counts["high"]
         
         f_report.write("植被覆盖度分布:\n")
         f_report.write(f"  f < 0.1 (低覆盖): {low_cover} 像素 ({low_cover/total_pixels*100:.2f}%)\n")
@@ -175,27 +509,44 @@ def generate_statistics_report(ndvi, f, C, output_dir):
     
     print(f"统计报告已保存为: {report_file}")
 
-def create_visualization(ndvi, f, C, output_dir):
-    """创建可视化图表"""
-    fig, axes = plt.subplots(2, 2, figsize=(15, 12))
+def visualization_path(output_dir, dpi=VIS_DPI):
+    """可视化图片路径：默认 DPI 为 vegetation_analysis_results.png，其余 DPI 带后缀"""
+    name = "vegetation_analysis_results.png" if dpi == VIS_DPI else f"vegetation_analysis_results_{dpi}dpi.png"
+    return os.path.join(output_dir, name)
+
+def create_visualization(output_dir, dpi=VIS_DPI):
+    """
+    由已写出的裁剪后NDVI、f、C栅格创建可视化图表（降采样读取，f直方图取自统计文件，不读入整幅栅格）。
+    使用 Figure API 而非 pyplot 全局状态，可在后台线程中安全调用。
+
+    返回:
+    str -- 图片路径
+    """
+    layers = output_layers(output_dir)
+    ndvi, f, C = (read_decimated(path, band=band) for path, band in (layers[name] for name in ("ndvi", "f", "C")))
+    fig = Figure(figsize=(15, 12))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(2, 2)
     
     # 显示原始NDVI数据
     im1 = axes[0, 0].imshow(ndvi, cmap='RdYlGn', vmin=-1, vmax=1)
     axes[0, 0].set_title('裁剪后NDVI数据')
-    plt.colorbar(im1, ax=axes[0, 0])
+    fig.colorbar(im1, ax=axes[0, 0])
     
     # 显示植被覆盖度f
     im2 = axes[0, 1].imshow(f, cmap='viridis')
     axes[0, 1].set_title('植被覆盖度f')
-    plt.colorbar(im2, ax=axes[0, 1])
+    fig.colorbar(im2, ax=axes[0, 1])
     
     # 显示植被覆盖因子C
     im3 = axes[1, 0].imshow(C, cmap='plasma')
     axes[1, 0].set_title('植被覆盖因子C')
-    plt.colorbar(im3, ax=axes[1, 0])
+    fig.colorbar(im3, ax=axes[1, 0])
     
-    # 显示植被覆盖度直方图
-    axes[1, 1].hist(f[~np.isnan(f)].flatten(), bins=50, alpha=0.7, color='green')
+    # 显示植被覆盖度直方图（计算f时已统计，无需再次遍历全量数据）
+    histogram = load_stats(*layers["f"])["histogram"]
+    if histogram:
+        axes[1, 1].stairs(histogram["counts"], histogram["edges"], fill=True, alpha=0.7, color='green')
     axes[1, 1].axvline(x=0.1, color='red', linestyle='--', label='f=0.1')
     axes[1, 1].axvline(x=0.783, color='blue', linestyle='--', label='f=0.783')
     axes[1, 1].set_xlabel('植被覆盖度f')
@@ -204,11 +555,43 @@ def create_visualization(ndvi, f, C, output_dir):
     axes[1, 1].legend()
     axes[1, 1].grid(True, alpha=0.3)
     
-    plt.tight_layout()
-    visualization_file = os.path.join(output_dir, 'vegetation_analysis_results.png')
-    plt.savefig(visualization_file, dpi=300, bbox_inches='tight')
+    fig.tight_layout()
+    visualization_file = visualization_path(output_dir, dpi)
+    tmp_file = f"{visualization_file}.tmp.png"
+    fig.savefig(tmp_file, dpi=dpi, bbox_inches='tight')
+    os.replace(tmp_file, visualization_file)
     print(f"分析结果图表已保存为: {visualization_file}")
-    plt.close()
+    return visualization_file
+
+_vis_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="c-factor-vis")
+_vis_pending = {}
+_vis_lock = threading.Lock()
+
+def request_visualization(output_dir, dpi=VIS_DPI):
+    """
+    在后台单线程中生成可视化图表，已生成时直接返回；同一图片的并发请求共用一个任务
+
+    返回:
+    concurrent.futures.Future -- 结果为图片路径
+    """
+    path = visualization_path(output_dir, dpi)
+    with _vis_lock:
+        if os.path.exists(path):
+            done = Future()
+            done.set_result(path)
+            return done
+        future = _vis_pending.get(path)
+        if future is not None:
+            return future
+        future = _vis_executor.submit(create_visualization, output_dir, dpi)
+        _vis_pending[path] = future
+    # 回调须在释放锁后注册：任务已完成时回调会立即在当前线程执行并再次获取 _vis_lock
+    future.add_done_callback(lambda _: _forget_visualization(path))
+    return future
+
+def _forget_visualization(path):
+    with _vis_lock:
+        _vis_pending.pop(path, None)
 
 # 使用示例
 if __name__ == "__main__":
@@ -220,6 +603,7 @@ if __name__ == "__main__":
         print("开始计算植被覆盖因子...")
         C, f = calculate_vegetation_cover_factor(ndvi_file, shp_file)
         if C is not None:
+            create_visualization("output")
             print("计算完成！")
         else:
             print("计算失败，请检查输入文件。")
@@ -8,6 +8,9 @@ import os
 import pandas as pd
 from osgeo import gdal, osr
 import math
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from submod.公共.统计 import summarize_array, write_stats
 
 def clip_raster_with_shapefile(raster_path, shapefile_path, output_path):
     """
@@ -67,6 +70,7 @@ def clip_raster_with_shapefile(raster_path, shapefile_path, output_path):
         # 7. 保存裁剪后的栅格
         with rasterio.open(output_path, "w", **out_meta) as dest:
             dest.write(out_image)
+        write_stats(output_path, summarize_array(out_image[0], src_nodata))
     
     return output_path
 
@@ -305,6 +309,7 @@ def calculate_k_for_raster(input_tif_path, attribute_csv_path, output_tif_path):
         # 保存K值栅格
         with rasterio.open(output_tif_path, 'w', **profile) as dst:
             dst.write(k_array, 1)
+        write_stats(output_tif_path, summarize_array(k_array, -9999))
         
         print(f"K值计算完成，结果已保存至: {output_tif_path}")
         
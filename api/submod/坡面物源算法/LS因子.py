@@ -9,6 +9,9 @@ import traceback
 from tqdm import tqdm
 from osgeo import gdal
 import tempfile
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from submod.公共.统计 import RasterStats, write_stats
 
 def resample_dem_gdal(input_path, target_resolution, resampling_method='average'):
     """
@@ -270,6 +273,8 @@ def calculate_ls_factor(dem_file, output_file, cell_size=0.1, chunk_size=500,
             })
             
             # 创建输出文件
+            # 写出每个分块时同步累加统计，无需计算完成后重新读取结果
+            ls_stats = RasterStats()
             with rasterio.open(output_file, 'w', **profile) as dst:
                 # 创建进度条
                 pbar = tqdm(total=total_chunks, desc="处理分块", unit="块")
@@ -338,6 +343,7 @@ def calculate_ls_factor(dem_file, output_file, cell_size=0.1, chunk_size=500,
                             
                             # 将结果写入输出文件
                             dst.write(ls_chunk.astype(np.float32), 1, window=window)
+                            ls_stats.update(ls_chunk, -9999)
                             
                             # 更新进度条
                             pbar.update(1)
@@ -357,6 +363,7 @@ def calculate_ls_factor(dem_file, output_file, cell_size=0.1, chunk_size=500,
                 
                 # 关闭进度条
                 pbar.close()
+            write_stats(output_file, ls_stats.to_dict())
         
         log_message("\n处理完成!")
         
@@ -2,6 +2,9 @@ from osgeo import gdal, ogr
 import numpy as np
 import os
 import tempfile
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from submod.公共.统计 import summarize_array, write_stats
 
 def prepare_p_values(input_tif):
     """
@@ -92,6 +95,7 @@ def apply_p_mapping(input_tif, output_tif, value_p_mapping):
     if nodata is not None:
         dst_band.SetNoDataValue(float(nodata))
     dst_band.FlushCache()
+    write_stats(output_tif, summarize_array(remapped_data, nodata))
     # 创建属性表（临时 Shapefile），用于记录 Value 与 P
     temp_dir = tempfile.mkdtemp()
     temp_shp = os.path.join(temp_dir, "attributes.shp")
@@ -4,15 +4,32 @@ import rasterio
 from rasterio.mask import mask
 import geopandas as gpd
 from glob import glob
+import sys
 import warnings
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from submod.公共.统计 import summarize_array, write_stats
 warnings.filterwarnings('ignore')
 
+def list_monthly_tifs(folder):
+    """
+    返回某一年份的月降雨 tif 列表（按文件名排序）
+    folder 可以是文件夹路径，也可以直接是文件路径列表（如 ZIP 内成员的 /vsizip/ 路径）
+    """
+    if isinstance(folder, (list, tuple)):
+        tif_files = list(folder)
+        folder_name = os.path.basename(os.path.dirname(tif_files[0])) if tif_files else ""
+    else:
+        tif_files = glob(os.path.join(folder, "*.tif"))
+        folder_name = os.path.basename(folder)
+    tif_files.sort()
+    return folder_name, tif_files
+
 def calculate_rainfall_erosion_factor(folder_paths, shp_path, output_path, scale_factor=0.1):
     """
     计算降雨侵蚀因子R
     
     参数:
-    folder_paths: 包含多个年份文件夹的路径列表
+    folder_paths: 包含多个年份文件夹的路径列表（每项也可以是该年份12个月 tif 的路径列表）
     shp_path: 裁剪用的shp文件路径
     output_path: 输出R因子TIFF文件路径
     scale_factor: 数据缩放因子，默认为1.0（不缩放）。如果数据被放大了10倍，可设为0.1
@@ -43,9 +60,7 @@ def calculate_rainfall_erosion_factor(folder_paths, shp_path, output_path, scale
     
     # 3. 遍历每个年份文件夹
     for folder_path in folder_paths:
-        folder_name = os.path.basename(folder_path)
-        tif_files = glob(os.path.join(folder_path, "*.tif"))
-        tif_files.sort()  # 确保按月份顺序
+        folder_name, tif_files = list_monthly_tifs(folder_path)  # 确保按月份顺序
         
         if len(tif_files) != 12:
             print(f"警告: {folder_name} 文件夹中不是12个文件，跳过")
@@ -165,7 +180,7 @@ def calculate_rainfall_erosion_factor(folder_paths, shp_path, output_path, scale
     # 获取参考的元数据（使用第一个有效的tif文件）
     ref_tif = None
     for folder_path in folder_paths:
-        tif_files = glob(os.path.join(folder_path, "*.tif"))
+        _, tif_files = list_monthly_tifs(folder_path)
         if tif_files:
             ref_tif = tif_files[0]
             break
@@ -192,6 +207,7 @@ def calculate_rainfall_erosion_factor(folder_paths, shp_path, output_path, scale
                 
                 with rasterio.open(output_path, 'w', **profile) as dst:
                     dst.write(R_total.astype(np.float32), 1)
+                write_stats(output_path, summarize_array(R_total, src_nodata))
                 
                 print(f"R因子计算完成，结果已保存至: {output_path}")
             else:
@@ -0,0 +1,218 @@
+import os
+import json
+import hashlib
+import numpy as np
+import rasterio
+import sys
+from osgeo import gdal
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from submod.公共.统计 import RasterStats, write_stats
+
+NODATA = -9999.0
+
+# 各因子对齐到参考网格时使用的重采样方法：连续场用双线性，分类映射得到的因子用最近邻
+FACTOR_RESAMPLING = {
+    "R": "bilinear",
+    "K": "near",
+    "LS": "bilinear",
+    "C": "bilinear",
+    "P": "near",
+}
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """按块计算文件内容的 SHA-256"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _cache_key(*parts):
+    """由若干参数生成缓存键"""
+    text = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class FactorCache:
+    """
+    因子栅格缓存：以 内容哈希 + 参数 为键，在 cache_dir 中保存对齐后的因子及部分乘积 R·K·LS。
+    同一次计算中的命中/未命中次数记录在 hits/misses 中。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.entries = {}
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.tif")
+
+    def get_or_build(self, name, key, builder):
+        """命中则直接返回缓存路径，否则调用 builder(tmp_path) 生成后原子地放入缓存"""
+        path = self.path_for(key)
+        if os.path.exists(path):
+            self.hits += 1
+            self.entries[name] = "hit"
+            os.utime(path, None)
+            return path
+        self.misses += 1
+        self.entries[name] = "miss"
+        tmp_path = f"{path}.{os.getpid()}.tmp.tif"
+        builder(tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
+    def report(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": dict(self.entries)}
+
+
+def reference_grid(raster_path):
+    """读取参考栅格的网格定义（投影、仿射变换与行列数）"""
+    with rasterio.open(raster_path) as src:
+        return {
+            "crs": src.crs.to_wkt() if src.crs else None,
+            "transform": tuple(src.transform)[:6],
+            "width": src.width,
+            "height": src.height,
+        }
+
+
+def align_factor(src_path, grid, output_path, resample_alg="bilinear"):
+    """将因子栅格重投影/重采样到参考网格，统一为 float32 与 NODATA=-9999"""
+    a, _, c, _, e, f = grid["transform"]
+    min_x = c
+    max_y = f
+    max_x = c + a * grid["width"]
+    min_y = f + e * grid["height"]
+    options = gdal.WarpOptions(
+        format="GTiff",
+        outputBounds=(min_x, min_y, max_x, max_y),
+        width=grid["width"],
+        height=grid["height"],
+        dstSRS=grid["crs"],
+        resampleAlg=resample_alg,
+        outputType=gdal.GDT_Float32,
+        dstNodata=NODATA,
+        creationOptions=["TILED=YES", "COMPRESS=LZW", "BIGTIFF=IF_SAFER"],
+    )
+    ds = gdal.Warp(output_path, src_path, options=options)
+    if ds is None:
+        raise Exception(f"无法对齐栅格: {src_path}")
+    ds = None
+    return output_path
+
+
+def multiply_rasters(input_paths, output_path, stats=None):
+    """
+    按块将若干已对齐的栅格逐像元相乘，任一输入为 NODATA 时输出 NODATA。
+    以第一个输入的内部块为单位读写，内存占用与栅格大小无关。
+    提供 stats（RasterStats）时在写出每块的同时累加统计。
+    """
+    srcs = [rasterio.open(p) for p in input_paths]
+    try:
+        profile = srcs[0].profile.copy()
+        profile.update(dtype="float32", count=1, nodata=NODATA, driver="GTiff",
+                       tiled=True, blockxsize=256, blockysize=256, compress="lzw")
+        with rasterio.open(output_path, "w", **profile) as dst:
+            for _, window in dst.block_windows(1):
+                product = np.ones((window.height, window.width), dtype=np.float32)
+                invalid = np.zeros_like(product, dtype=bool)
+                for src in srcs:
+                    block = src.read(1, window=window).astype(np.float32)
+                    invalid |= (block == NODATA) | ~np.isfinite(block)
+                    if src.nodata is not None and src.nodata != NODATA:
+                        invalid |= block == src.nodata
+                    product *= block
+                product[invalid] = NODATA
+                dst.write(product, 1, window=window)
+                if stats is not None:
+                    stats.update(product, NODATA)
+    finally:
+        for src in srcs:
+            src.close()
+    return output_path
+
+
+def calculate_soil_loss(factor_paths, output_path, cache_dir, reference="LS", resampling=None, content_hashes=None):
+    """
+    计算土壤流失量 A = R·K·LS·C·P，并缓存对齐后的各因子及部分乘积 R·K·LS。
+
+    参数:
+    factor_paths: {"R": 路径, "K": 路径, "LS": 路径, "C": 路径, "P": 路径}
+    output_path: 输出土壤流失量 TIF 路径
+    cache_dir: 因子缓存目录（多次计算间共享）
+    reference: 作为输出网格的因子，默认 LS（DEM 分辨率最高）
+    resampling: 可选，覆盖各因子的重采样方法，如 {"R": "cubic"}
+    content_hashes: 可选，各因子文件内容的 SHA-256（如数据集 id），提供时不再重新读取文件计算哈希
+
+    返回:
+    dict -- 输出路径、部分乘积缓存路径与缓存命中统计
+
+    只修改 P 映射或更换 C 的 NDVI 年份时，R、K、LS 及其乘积均命中缓存，
+    仅需对缓存的 R·K·LS 与新的 C、P 做一次分块乘法。
+    """
+    missing = [name for name in ("R", "K", "LS", "C", "P") if not factor_paths.get(name)]
+    if missing:
+        raise Exception(f"缺少因子栅格: {', '.join(missing)}")
+
+    methods = dict(FACTOR_RESAMPLING)
+    methods.update(resampling or {})
+    cache = FactorCache(cache_dir)
+
+    grid = reference_grid(factor_paths[reference])
+    grid_key = _cache_key("grid", grid)
+
+    content_hashes = dict(content_hashes or {})
+    unhashed = [name for name in factor_paths if name not in content_hashes]
+    if unhashed:
+        print(f"计算因子内容哈希: {', '.join(unhashed)}")
+        content_hashes.update({name: file_sha256(factor_paths[name]) for name in unhashed})
+
+    aligned = {}
+    aligned_keys = {}
+    for name in ("R", "K", "LS", "C", "P"):
+        key = _cache_key("aligned", name, content_hashes[name], grid_key, methods[name])
+        aligned_keys[name] = key
+        aligned[name] = cache.get_or_build(
+            name, key,
+            lambda tmp, name=name: align_factor(factor_paths[name], grid, tmp, methods[name]),
+        )
+        print(f"{name} 因子: {cache.entries[name]}")
+
+    rkls_key = _cache_key("RKLS", aligned_keys["R"], aligned_keys["K"], aligned_keys["LS"])
+    rkls_path = cache.get_or_build(
+        "RKLS", rkls_key,
+        lambda tmp: multiply_rasters([aligned["R"], aligned["K"], aligned["LS"]], tmp),
+    )
+    print(f"R·K·LS 部分乘积: {cache.entries['RKLS']}")
+
+    a_stats = RasterStats()
+    multiply_rasters([rkls_path, aligned["C"], aligned["P"]], output_path, stats=a_stats)
+    write_stats(output_path, a_stats.to_dict())
+    print(f"土壤流失量已保存为: {output_path}")
+
+    return {
+        "output_tif": output_path,
+        "rkls_tif": rkls_path,
+        "cache": cache.report(),
+    }
+
+
+# 使用示例
+if __name__ == "__main__":
+    factors = {
+        "R": r"./input/坡面物源算法/A/R因子.tif",
+        "K": r"./input/坡面物源算法/A/k因子.tif",
+        "LS": r"./input/坡面物源算法/A/LS因子.tif",
+        "C": r"./input/坡面物源算法/A/C因子.tif",
+        "P": r"./input/坡面物源算法/A/P因子.tif",
+    }
+    if all(os.path.exists(p) for p in factors.values()):
+        result = calculate_soil_loss(factors, "土壤流失量.tif", cache_dir="rusle_cache")
+        print(result)
+    else:
+        print("请提供正确的因子文件路径。")
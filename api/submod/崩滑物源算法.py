@@ -1,5 +1,10 @@
+import os
+import sys
 import numpy as np
 import rasterio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from submod.公共.统计 import summarize_array, write_stats
+from submod.公共.体积 import dem_difference_volume, decimated_difference
 
 def compute_slbl_with_correction(dem_data, z_max, delta_x, max_value=1e4, min_value=-1e4, max_iter=10000):
     """
@@ -144,6 +149,7 @@ def save_slbl_to_tiff(slbl_surface, output_path, reference_dem_path):
     try:
         with rasterio.open(output_path, 'w', **profile) as dst:
             dst.write(slbl_surface, 1)
+        write_stats(output_path, summarize_array(slbl_surface, profile.get('nodata')))
         print(f"SLBL面已保存为 {output_path}")
     except Exception as e:
         print(f"Error saving SLBL file: {e}")
@@ -264,49 +270,25 @@ def ReprojectImages():
     # 保存输出影像
     save_output_image(output, outputfilePath)
 
-def compute_volume_difference():
+# 三维示意图中每个像元画一个立方体，降采样到该像元数以内
+PLOT_CUBES = 2500
+
+def compute_volume_difference(diff_path=None):
     """
     计算输出影像与参考影像之间的体积差
+    逐块读取、只累加挖方/填方/净体积标量，像元面积取自输出影像的地理变换。
+    :param diff_path: 可选，提供时同时写出高差栅格（输出影像 - 参考影像）
+    :return: 体积结果字典（count / fill_volume / cut_volume / net_volume / volume 等）
     """
     # 打开输出影像和参考影像
     outputrasfile = gdal.Open(outputfilePath, gdal.GA_ReadOnly)
     referencefile = gdal.Open(referencefilefilePath, gdal.GA_ReadOnly)
 
-    # 获取输出影像和参考影像的波段
-    output_band = outputrasfile.GetRasterBand(1)
-    reference_band = referencefile.GetRasterBand(1)
-
-    # 获取输出影像和参考影像的数组数据
-    output_data = output_band.ReadAsArray()
-    reference_data = reference_band.ReadAsArray()
-
-    # 获取像元的大小（假设像元大小为 5m x 5m）
-    pixel_size = 5.0  # 像元大小，单位：米
-    area_per_pixel = pixel_size ** 2  # 像元的面积，单位：平方米
-
-    # 计算高程差
-    elevation_diff = output_data - reference_data
-
-    # 移除 NoData 值
-    output_no_data = output_band.GetNoDataValue()
-    reference_no_data = reference_band.GetNoDataValue()
-    if output_no_data is not None:
-        elevation_diff[output_data == output_no_data] = np.nan
-    if reference_no_data is not None:
-        elevation_diff[reference_data == reference_no_data] = np.nan
-
-    # 跳过 NaN 和 Inf 值的像元
-    valid_mask = ~np.isnan(elevation_diff) & ~np.isinf(elevation_diff)
-
-    # 计算每个有效像元的体积差
-    valid_elevation_diff = elevation_diff[valid_mask]
-    valid_volume_diff = valid_elevation_diff * area_per_pixel  # 体积，单位：立方米
-
-    # 计算总的体积差
-    total_volume_diff = abs(np.sum(valid_volume_diff))  # 忽略无效值（NaN 和 Inf）进行求和
-    print(f"计算得到的体积差：{total_volume_diff} 立方米")
+    # 跳过 NoData、NaN 和 Inf 值的像元
+    result = dem_difference_volume(outputrasfile, referencefile, diff_path=diff_path)
+    print(f"计算得到的体积差：{result['volume']} 立方米")
 
-    return valid_mask, elevation_diff, output_data
+    return result
 
 def plot_3d_cubes_with_surface(valid_mask, elevation_diff, output_data):
     """
@@ -355,9 +337,11 @@ def main2():
     ReprojectImages()
 
     # 计算体积差
-    valid_mask, elevation_diff, output_data = compute_volume_difference()
+    compute_volume_difference()
 
-    # 3D 可视化：绘制 DEM 和小立方体
+    # 3D 可视化：降采样后绘制 DEM 和小立方体
+    valid_mask, elevation_diff, output_data = decimated_difference(
+        gdal.Open(outputfilePath), gdal.Open(referencefilefilePath), max_pixels=PLOT_CUBES)
     plot_3d_cubes_with_surface(valid_mask, elevation_diff, output_data)
 
 # 如果是直接运行脚本，则执行 main 函数
@@ -0,0 +1,215 @@
+import contextlib
+import importlib.util
+import io
+import multiprocessing
+import os
+import re
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import geopandas as gpd
+import pandas as pd
+import pyogrio
+import rasterio
+from rasterio.shutil import copy as rio_copy
+
+from submod.公共.栅格输出 import cogify_dir
+from submod.公共.统计 import result_summary
+
+ALGO_NAME = "沟道物源（完美）"
+ALGO_PATH = Path(__file__).with_name(f"{ALGO_NAME}.py")
+# 并行进程数（run_algorithm 依赖模块全局变量与 os.chdir，只能按进程并行）
+BATCH_WORKERS = int(os.environ.get("CHANNEL_BATCH_WORKERS", min(4, os.cpu_count() or 1)))
+# 每条沟道返回的日志长度上限（字符，取末尾）
+LOG_LIMIT = 5000
+# 每条沟道的结果文件（与单条接口一致）
+GULLY_FILES = {
+    "x123_csv": "每组X1_X2_X3坐标点.csv",
+    "bspline_csv": "B样条点坐标.csv",
+    "boundary_csv": "DEM边界点坐标.csv",
+    "merged_csv": "拟合点坐标.csv",
+    "generated_dem": "output_dem.tif",
+    "final_clipped_dem": "final_clip_test.tif",
+}
+PREVIEW_KEYS = ("generated_dem", "final_clipped_dem")
+
+
+def load_algorithm():
+    """按文件路径加载沟道物源算法模块（模块名含中文括号，不能直接 import）"""
+    if ALGO_NAME not in sys.modules:
+        spec = importlib.util.spec_from_file_location(ALGO_NAME, ALGO_PATH)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[ALGO_NAME] = module
+        spec.loader.exec_module(module)
+    return sys.modules[ALGO_NAME]
+
+
+def prepare_dem(dem_path, work_dir):
+    """
+    DEM 只准备一次：ZIP 内（/vsizip/）或未分块的 DEM 转存为 512×512 分块 GTiff，
+    各沟道进程只按窗口读取各自范围的数据块，不再反复解压整个 ZIP 成员。
+    :return: (供各进程读取的路径, 是否为临时文件)
+    """
+    with rasterio.open(dem_path) as src:
+        tiled = src.profile.get("tiled", False)
+    if tiled and not str(dem_path).startswith("/vsi"):
+        return str(dem_path), False
+    local_path = os.path.join(work_dir, "dem_tiled.tif")
+    rio_copy(dem_path, local_path, driver="GTiff", TILED="YES", BLOCKXSIZE=512, BLOCKYSIZE=512,
+             COMPRESS="DEFLATE", BIGTIFF="IF_SAFER")
+    print(f"DEM 已转存为分块 GTiff: {local_path}")
+    return local_path, True
+
+
+def safe_name(name):
+    # 目录名会出现在结果 URL 中，去掉路径分隔符与 URL 保留字符
+    return re.sub(r'[\\/:*?"<>|&#%\s]+', "_", str(name)).strip("_") or "gully"
+
+
+def read_kml(path):
+    """读取 KML 的全部图层（文件夹）并合并为 WGS84 的 GeoDataFrame"""
+    layers = [name for name, _ in pyogrio.list_layers(path)]
+    frames = [gpd.read_file(path, layer=layer) for layer in layers]
+    gdf = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=frames[0].crs if frames else "EPSG:4326")
+    return gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty].explode(index_parts=False, ignore_index=True)
+
+
+def kml_coordinates(coords):
+    return " ".join(",".join(f"{v:.10f}" for v in c) for c in coords)
+
+
+def write_kml(path, placemarks):
+    """把 (名称, shapely 几何) 写成 Document/Placemark 结构的 KML，与算法读取 KML 的层级一致"""
+    parts = []
+    for name, geom in placemarks:
+        if geom.geom_type == "Polygon":
+            body = f"<Polygon><outerBoundaryIs><LinearRing><coordinates>{kml_coordinates(geom.exterior.coords)}</coordinates></LinearRing></outerBoundaryIs></Polygon>"
+        else:
+            body = f"<LineString><coordinates>{kml_coordinates(geom.coords)}</coordinates></LineString>"
+        parts.append(f"<Placemark><name>{escape(str(name))}</name>{body}</Placemark>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2"><Document>')
+        f.write("".join(parts))
+        f.write("</Document></kml>")
+    return path
+
+
+def split_gullies(boundary_kml, profile_kml, out_dir):
+    """
+    多要素 KML 拆分：边界 KML 中每个多边形为一条沟道，剖面线归入与其相交的第一个多边形，
+    每条沟道写出自己的边界/剖面线 KML。
+    :return: 沟道列表 [{name, dir, boundary_kml, profile_kml}]，以及未归属任何沟道的剖面线数
+    """
+    boundaries = read_kml(boundary_kml)
+    boundaries = boundaries[boundaries.geom_type == "Polygon"].reset_index(drop=True)
+    profiles = read_kml(profile_kml)
+    profiles = profiles[profiles.geom_type == "LineString"].reset_index(drop=True)
+    if boundaries.empty:
+        raise ValueError("边界 KML 中没有多边形")
+    names = boundaries["Name"] if "Name" in boundaries.columns else pd.Series([None] * len(boundaries))
+
+    owner = [-1] * len(profiles)
+    for j, line in enumerate(profiles.geometry):
+        for i, polygon in enumerate(boundaries.geometry):
+            if line.intersects(polygon):
+                owner[j] = i
+                break
+
+    gullies = []
+    for i, polygon in enumerate(boundaries.geometry):
+        name = names.iloc[i] if pd.notna(names.iloc[i]) and str(names.iloc[i]).strip() else f"沟道{i + 1:02d}"
+        lines = [(f"{name}_{k + 1}", profiles.geometry.iloc[j]) for k, j in enumerate(j for j, o in enumerate(owner) if o == i)]
+        gully_dir = os.path.join(out_dir, f"{i + 1:02d}_{safe_name(name)}")
+        os.makedirs(gully_dir, exist_ok=True)
+        gullies.append({
+            "name": str(name),
+            "dir": gully_dir,
+            "boundary_kml": write_kml(os.path.join(gully_dir, "boundary.kml"), [(name, polygon)]),
+            "profile_kml": write_kml(os.path.join(gully_dir, "profile.kml"), lines) if lines else None,
+        })
+    return gullies, owner.count(-1)
+
+
+def run_gully(dem_path, gully, work_dir, export_csv=True):
+    """
+    在独立进程中计算一条沟道（stdout/stderr 写入日志，plt.show 改为保存图片），
+    结果栅格转换为 COG 并生成统计与预览。
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    os.makedirs(work_dir, exist_ok=True)
+    figures = []
+
+    def save_figure(*args, **kwargs):
+        path = os.path.join(work_dir, f"figure_{len(figures) + 1}.png")
+        plt.savefig(path)
+        plt.close()
+        figures.append(os.path.basename(path))
+
+    plt.show = save_figure
+    log = io.StringIO()
+    result = {"name": gully["name"], "dir": os.path.basename(work_dir), "status": "failed", "error": None, "volume": None}
+    try:
+        if not gully.get("profile_kml"):
+            raise ValueError("该沟道没有相交的剖面线")
+        algo = load_algorithm()
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            volume = algo.run_algorithm(dem_path=dem_path, boundary_kml=gully["boundary_kml"],
+                                        profile_kml=gully["profile_kml"], work_dir=work_dir, export_csv=export_csv)
+        result["volume"] = volume
+        if volume is None:
+            result["error"] = "体积计算失败"
+        else:
+            result["status"] = "ok"
+    except Exception as e:
+        result["error"] = str(e)
+        log.write(traceback.format_exc())
+
+    cogify_dir(work_dir)
+    result["files"] = {key: name for key, name in GULLY_FILES.items() if os.path.exists(os.path.join(work_dir, name))}
+    result["stats"], result["previews"] = {}, {}
+    for key in PREVIEW_KEYS:
+        if key in result["files"]:
+            stats, preview = result_summary(Path(work_dir) / GULLY_FILES[key], colormap="terrain")
+            result["stats"][key] = stats
+            result["previews"][key] = Path(preview).name if preview else None
+    result["figures"] = figures
+    result["log"] = log.getvalue()[-LOG_LIMIT:]
+    return result
+
+
+def run_batch(dem_path, gullies, out_dir, workers=None, export_csv=True):
+    """
+    批量计算多条沟道：DEM 只准备一次，各沟道在独立进程中并行计算（spawn 方式，互不共享模块全局变量与工作目录）。
+    :param gullies: [{name, boundary_kml, profile_kml, dir(可选)}]
+    :return: 与 gullies 顺序一致的结果列表
+    """
+    workers = max(1, min(workers or BATCH_WORKERS, len(gullies)))
+    dem_local, temporary = prepare_dem(dem_path, out_dir)
+    results = [None] * len(gullies)
+    try:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {}
+            for i, gully in enumerate(gullies):
+                work_dir = gully.get("dir") or os.path.join(out_dir, f"{i + 1:02d}_{safe_name(gully['name'])}")
+                futures[pool.submit(run_gully, dem_local, gully, work_dir, export_csv)] = (i, work_dir)
+            for future in as_completed(futures):
+                i, work_dir = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    # 进程异常退出等情况
+                    results[i] = {"name": gullies[i]["name"], "dir": os.path.basename(work_dir), "status": "failed",
+                                  "error": str(e), "volume": None, "files": {}, "stats": {}, "previews": {},
+                                  "figures": [], "log": ""}
+                print(f"沟道 {gullies[i]['name']}: {results[i]['status']}")
+    finally:
+        if temporary and os.path.exists(dem_local):
+            os.remove(dem_local)
+    return results
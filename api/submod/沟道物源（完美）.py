@@ -8,7 +8,7 @@ from fastkml import kml
 from pygeoif import geometry
 import geopandas as gpd
 import pandas as pd
-from shapely.geometry import Polygon, LineString
+from shapely.geometry import Polygon, LineString, mapping
 import re
 import shutil
 import os
@@ -17,9 +17,12 @@ import pandas as pd
 from scipy import interpolate
 from rasterio.mask import mask
 from rasterio.transform import from_origin
+from rasterio.windows import Window
+from scipy.spatial import Delaunay
 from rasterio.crs import CRS
 from osgeo import gdal, gdalconst
 import traceback
+from submod.公共.体积 import dem_difference_volume, decimated_difference, warp_to_grid
 
 plt.rcParams['font.sans-serif'] = ['SimHei']  # 用来正常显示中文标签
 plt.rcParams['axes.unicode_minus'] = False    # 用来正常显示负号
@@ -35,16 +38,23 @@ output_dem = 'output_dem.tif'
 outtif_裁剪 = None
 outputfilePath = 'Aligned_Reference_DEM.tif'
 input_aligned_path = 'Aligned_Input_Resampled.tif'
+# 中间结果默认只保存在内存中（边界几何、原始DEM裁剪结果、两幅对齐DEM），为 True 时同时写出文件便于调试
+保留中间文件 = False
 
-def run_algorithm(dem_path=None, boundary_kml=None, profile_kml=None, work_dir=None):
+def run_algorithm(dem_path=None, boundary_kml=None, profile_kml=None, work_dir=None, export_csv=True, grid_resolution=None,
+                  keep_intermediates=False):
     """
     封装后的主入口函数
     :param dem_path: 原始DEM路径
     :param boundary_kml: 边界KML路径
     :param profile_kml: 剖面线KML路径
     :param work_dir: 工作目录（可选，若提供则切换到该目录执行）
+    :param export_csv: 是否在结束时导出中间点集 CSV（各阶段之间直接传递数组，不读写 CSV）
+    :param grid_resolution: 沟床面插值网格分辨率（米），默认 None 表示使用 DEM 原生分辨率
+    :param keep_intermediates: 是否把中间结果写成文件；默认只写出接口返回的 output_dem 与 final_clip_test
+    :return: 体积结果字典（见 compute_volume_difference），体积计算失败时为 None
     """
-    global 原始DEM, 剖面线kml, 边界kml_path, 面shp, output_dem, outtif_裁剪, outputfilePath, input_aligned_path
+    global 原始DEM, 剖面线kml, 边界kml_path, 面shp, output_dem, outtif_裁剪, outputfilePath, input_aligned_path, 保留中间文件
     
     # 切换工作目录
     original_cwd = os.getcwd()
@@ -57,6 +67,7 @@ def run_algorithm(dem_path=None, boundary_kml=None, profile_kml=None, work_dir=N
         if dem_path: 原始DEM = dem_path
         if boundary_kml: 边界kml_path = boundary_kml
         if profile_kml: 剖面线kml = profile_kml
+        保留中间文件 = keep_intermediates
         
         # 定义坐标系和创建转换器
         wgs84 = "EPSG:4326"  # WGS84
@@ -127,16 +138,15 @@ def run_algorithm(dem_path=None, boundary_kml=None, profile_kml=None, work_dir=N
             # 您的 DEM 是 EPSG:4544
             gdf = gdf.to_crs("EPSG:4544")
 
-            # 6. 保存为临时 SHP
-            # 修改：直接保存到当前工作目录，而不是系统临时目录，方便调试
-            temp_shp_path = os.path.abspath("temp_boundary.shp")
-            
-            gdf.to_file(temp_shp_path, driver='ESRI Shapefile', encoding='utf-8')
-            
-            # 赋值给您的核心变量
-            面shp = temp_shp_path
-            
-            print(f"✅ KML 转换成功 (临时路径): {temp_shp_path}")
+            # 6. 边界几何直接以 GeoJSON 字典列表交给裁剪函数，不再落地临时 SHP
+            面shp = [mapping(geom) for geom in gdf.geometry]
+            if 保留中间文件:
+                # 调试时仍保存到当前工作目录
+                temp_shp_path = os.path.abspath("temp_boundary.shp")
+                gdf.to_file(temp_shp_path, driver='ESRI Shapefile', encoding='utf-8')
+                print(f"中间文件已保存: {temp_shp_path}")
+
+            print(f"✅ KML 转换成功，共 {len(面shp)} 个边界多边形")
 
         except Exception as e:
             print(f"❌ KML 转换失败: {e}")
@@ -148,70 +158,20 @@ def run_algorithm(dem_path=None, boundary_kml=None, profile_kml=None, work_dir=N
         
         # 按照原代码逻辑顺序：
         # Line 184: DEM = clip_raster_by_shp(原始DEM, 面shp)
-        DEM_clipped = clip_raster_by_shp(原始DEM, 面shp, custom_name="clip_original_dem")
-        if not DEM_clipped:
+        # 原始DEM裁剪结果只在内存中使用（保留中间文件时另存为 clip_original_dem.tif）
+        clipped = clip_raster_to_array(原始DEM, 面shp)
+        if clipped is None:
              raise ValueError("原始DEM裁剪失败")
+        out_image, transform, out_meta = clipped
+        if 保留中间文件:
+            write_clipped_raster(out_image, out_meta, "clip_original_dem")
+
+        elevation = out_image[0]
+        nodata = out_meta["nodata"]
+        dem_crs = out_meta["crs"]
 
-        with rasterio.open(DEM_clipped) as dem:
-            transform = dem.transform
-            elevation = dem.read(1)
-            nodata = dem.nodatavals[0]
-
-        # 读取KML文件
-        kml_file = kml.KML()
-        with open(剖面线kml, 'rb') as f:
-            kml_file.from_string(f.read())
-
-        # 提取并转换KML中所有折线段的坐标，分组存储
-        line_groups = []
-        features = list(kml_file.features())
-        for feature in features:
-            for placemark in feature.features():
-                if isinstance(placemark.geometry, geometry.LineString):
-                    line_coords = []
-                    for lon, lat, *extra in placemark.geometry.coords:
-                        x, y = transformer.transform(lon, lat)
-                        ele = extra[0] if extra else 0
-                        line_coords.append((x, y, ele))
-                    line_groups.append(line_coords)
-
-        # 对每组线段坐标执行匹配检查并找到最外侧点
-        match_groups = []
-        outermost_groups = []
-        features = list(kml_file.features())
-        for feature in features:
-            for placemark in feature.features():
-                if isinstance(placemark.geometry, geometry.LineString):
-                    line_coords = []
-                    for lon, lat, *extra in placemark.geometry.coords:
-                        x, y = transformer.transform(lon, lat)
-                        col, row = ~transform * (x, y)
-                        if 0 <= row < elevation.shape[0] and 0 <= col < elevation.shape[1]:
-                            ele = elevation[int(row), int(col)]
-                            if ele != nodata:
-                                line_coords.append((x, y, ele))
-                    if line_coords:
-                        match_groups.append(line_coords)
-                        coords_array = np.array(line_coords)
-                        center = np.mean(coords_array[:, :2], axis=0)
-                        distances = np.linalg.norm(coords_array[:, :2] - center, axis=1)
-                        max_dist_idx = distances.argsort()[-2:]
-                        # 添加判断防止重复
-                        if max_dist_idx[0] == max_dist_idx[1]:
-                            second_max_idx = distances.argsort()[-3]
-                            max_dist_idx = [max_dist_idx[0], second_max_idx]
-                        outermost_groups.append(coords_array[max_dist_idx])
-
-        # 过滤每组中X1与X2之间的点
-        filtered_groups = []
-        for line_coords, outermost_points in zip(line_groups, outermost_groups):
-            if len(outermost_points) < 2:
-                filtered_groups.append(line_coords)
-                continue
-            outermost_indices = [np.argmin(np.linalg.norm(np.array(line_coords)[:, :2] - point[:2], axis=1)) for point in outermost_points]
-            min_idx, max_idx = sorted(outermost_indices)
-            filtered_group = line_coords[:min_idx] + line_coords[max_idx+1:]
-            filtered_groups.append(filtered_group)
+        # 读取剖面线 KML（只解析一次），批量投影并查询 DEM 高程，找到每组最外侧点
+        line_groups, match_groups, outermost_groups = load_profile_lines(剖面线kml, transformer, elevation, transform, nodata)
 
         # 可视化
         # fig, ax = plt.subplots(subplot_kw={'projection': '3d'})
@@ -237,8 +197,9 @@ def run_algorithm(dem_path=None, boundary_kml=None, profile_kml=None, work_dir=N
         # ax.legend()
         # plt.show()
 
-        # 保存每组的X1, X2, X3坐标
-        coordinates_data = []
+        # 每组的 X1, X2, X3 坐标，形状 (组数, 3, 3)
+        group_ids = []
+        x123_list = []
 
         for idx, (line_coords, outermost_points) in enumerate(zip(line_groups, outermost_groups)):
             # 使用已经定义的函数计算每组的处理结果
@@ -246,59 +207,16 @@ def run_algorithm(dem_path=None, boundary_kml=None, profile_kml=None, work_dir=N
             
             # 如果存在交点，则保存结果
             if center1 is not None and center2 is not None:
-                coordinates_data.append({
-                    "Group": idx + 1,
-                    "X1": outermost_points[0],
-                    "X2": outermost_points[1],
-                    "X3": intersection_point
-                })
-
-        # 写入CSV文件
-        with open("每组X1_X2_X3坐标点.csv", "w", newline='') as file:
-            fieldnames = ['Group', 'X1 (X, Y, Z)', 'X2 (X, Y, Z)', 'X3 (X, Y, Z)']
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-
-            writer.writeheader()
-            for data in coordinates_data:
-                x1_formatted = f"({data['X1'][0]:.5f}, {data['X1'][1]:.5f}, {data['X1'][2]:.5f})"
-                x2_formatted = f"({data['X2'][0]:.5f}, {data['X2'][1]:.5f}, {data['X2'][2]:.5f})"
-                x3_formatted = f"({data['X3'][0]:.5f}, {data['X3'][1]:.5f}, {data['X3'][2]:.5f})"
-                writer.writerow({
-                    'Group': data['Group'],
-                    'X1 (X, Y, Z)': x1_formatted,
-                    'X2 (X, Y, Z)': x2_formatted,
-                    'X3 (X, Y, Z)': x3_formatted
-                })
-
-        print("坐标数据已成功保存到 '每组X1_X2_X3坐标点.csv'")
-
-        # 读取CSV文件
-        data = pd.read_csv("每组X1_X2_X3坐标点.csv")
-
-        # 存储所有曲线的坐标和用于可视化的数据
-        all_curves_data = pd.DataFrame()
-        triangle_points = []
-        bspline_curves = []
-
-        for idx, row in data.iterrows():
-            p1 = parse_coordinates(row['X1 (X, Y, Z)'])
-            p2 = parse_coordinates(row['X2 (X, Y, Z)'])
-            p3 = parse_coordinates(row['X3 (X, Y, Z)'])
-            x1, y1, z1 = p1
-            x2, y2, z2 = p2
-            x3, y3, z3 = p3
-            x0, y0, z0 = calculate_incenter(x1, y1, z1, x2, y2, z2, x3, y3, z3)
-            x = [x1, x0, x2]
-            y = [y1, y0, y2]
-            z = [z1, z0, z2]
-            x_new, y_new, z_new = calculate_bspline_curve(x, y, z)
-            curve_data = pd.DataFrame({'X': x_new, 'Y': y_new, 'Z': z_new})
-            all_curves_data = pd.concat([all_curves_data, curve_data], ignore_index=True)
-            triangle_points.append((x, y, z))
-            bspline_curves.append((x_new, y_new, z_new))
-
-        # 保存为CSV文件
-        all_curves_data.to_csv("B样条点坐标.csv", index=False)
+                group_ids.append(idx + 1)
+                x123_list.append([outermost_points[0], outermost_points[1], intersection_point])
+
+        x123 = np.asarray(x123_list, dtype=float).reshape(-1, 3, 3)
+        print(f"有效剖面组数: {len(group_ids)}")
+
+        # 三角形内心作为中间控制点，所有组的二次 B 样条一次批量求值，结果形状 (组数×100, 3)
+        x0 = calculate_incenters(x123)
+        control_points = np.stack([x123[:, 0], x0, x123[:, 1]], axis=1)
+        bspline_xyz = calculate_bspline_curves(control_points)
 
         # 1. 读取 KML (边界)
         boundary_kml_obj = kml.KML()
@@ -317,54 +235,21 @@ def run_algorithm(dem_path=None, boundary_kml=None, profile_kml=None, work_dir=N
         # 4. 执行提取
         extract_kml_coords(list(boundary_kml_obj.features()), transformer)
 
-        # 5. 保存为 CSV
-        if boundary_coordinates:
-            coordinates_df = pd.DataFrame(boundary_coordinates, columns=['X', 'Y', 'Z'])
-            coordinates_df.to_csv("DEM边界点坐标.csv", index=False)
-            print(f"已提取 {len(boundary_coordinates)} 个坐标点，并保存至 'DEM边界点坐标.csv'")
-        else:
+        if not boundary_coordinates:
             print("警告：未在 KML 文件中提取到任何坐标信息，请检查文件内容。")
+            raise ValueError("未在边界 KML 中提取到坐标点")
+        boundary_xyz = np.asarray(boundary_coordinates, dtype=float)
+        print(f"已提取 {len(boundary_xyz)} 个边界坐标点")
 
-        # 读取两个 CSV 文件
-        if os.path.exists("B样条点坐标.csv") and os.path.exists("DEM边界点坐标.csv"):
-            bspline_points_df = pd.read_csv("B样条点坐标.csv")
-            dem_boundary_points_df = pd.read_csv("DEM边界点坐标.csv")
-
-            # 按行合并（叠加坐标点）
-            merged_df = pd.concat([bspline_points_df, dem_boundary_points_df], ignore_index=True)
-
-            # 保存合并后的数据
-            merged_df.to_csv("拟合点坐标.csv", index=False)
-            print("两个 CSV 文件已合并并保存为 '拟合点坐标.csv'")
-        else:
-            raise FileNotFoundError("B样条点坐标.csv 或 DEM边界点坐标.csv 未生成")
+        # 合并 B 样条点与边界点（叠加坐标点），作为插值的拟合点
+        merged_xyz = np.vstack([bspline_xyz, boundary_xyz])
 
-        # 读取CSV文件（包含 X, Y, Z 坐标）
-        df = pd.read_csv("拟合点坐标.csv")
-        X = df['X'].values
-        Y = df['Y'].values
-        Z = df['Z'].values
+        # 插值网格：默认沿用 DEM 原生像元网格（裁剪后即边界多边形外包框），也可指定分辨率
+        grid_transform, grid_shape = interpolation_grid(transform, elevation.shape, grid_resolution)
+        print(f"插值网格: {grid_shape[1]}x{grid_shape[0]}，分辨率 {grid_transform.a:.3f} m")
 
-        # 使用二维插值
-        grid_x, grid_y = np.meshgrid(np.linspace(min(X), max(X), 100), 
-                                     np.linspace(min(Y), max(Y), 100))
-
-        # 使用 'griddata' 进行插值
-        grid_z = interpolate.griddata((X, Y), Z, (grid_x, grid_y), method='linear')
-
-        # 将插值结果保存为 DEM（GeoTIFF 格式）
-        grid_z_flipped = np.flip(grid_z, axis=0)  # 反转 Z 数据以匹配反转的 Y 坐标
-
-        transform = from_origin(np.min(grid_x), np.max(grid_y), 
-                                (np.max(grid_x) - np.min(grid_x)) / 100,  # X 轴的分辨率
-                                (np.max(grid_y) - np.min(grid_y)) / 100)  # Y 轴的分辨率
-
-        # 保存为 GeoTIFF
-        with rasterio.open(output_dem, 'w', driver='GTiff', 
-                           height=grid_z_flipped.shape[0], width=grid_z_flipped.shape[1], 
-                           count=1, dtype=grid_z_flipped.dtype, crs=CRS.from_epsg(4544),
-                           transform=transform) as dst:
-            dst.write(grid_z_flipped, 1)
+        # 三角剖分只构建一次，按行块求值并写入 GeoTIFF
+        interpolate_surface(merged_xyz, grid_transform, grid_shape, output_dem, dem_crs or CRS.from_epsg(4544))
 
         print(f"DEM 已保存为 {output_dem}")
 
@@ -372,28 +257,82 @@ def run_algorithm(dem_path=None, boundary_kml=None, profile_kml=None, work_dir=N
         # 注意：这里传入的是 output_dem (插值生成的图) 和 面shp (你的GD02.shp)
         outtif_裁剪 = clip_raster_by_shp(output_dem, 面shp, custom_name="final_clip_test")
         
+        # 中间点集导出为 CSV（可选，仅作为结果文件，不参与后续计算）
+        if export_csv:
+            export_point_csvs(group_ids, x123, bspline_xyz, boundary_xyz, merged_xyz)
+
         # 主逻辑继续...
-        main_volume_calc()
+        return main_volume_calc()
 
     finally:
         # 恢复工作目录
         if work_dir:
             os.chdir(original_cwd)
 
-def clip_raster_by_shp(raster_path, shp_path, custom_name="clip_original"):
+def interpolation_grid(dem_transform, dem_shape, resolution=None):
+    """
+    计算沟床面插值网格
+    :param dem_transform: 裁剪后 DEM 的仿射变换（范围即边界多边形外包框）
+    :param dem_shape: 裁剪后 DEM 的 (行数, 列数)
+    :param resolution: 网格分辨率（米），None 时直接使用 DEM 原生网格
+    :return: (grid_transform, (rows, cols))
+    """
+    if resolution is None:
+        return dem_transform, tuple(dem_shape)
+    left, top = dem_transform.c, dem_transform.f
+    width = dem_transform.a * dem_shape[1]
+    height = -dem_transform.e * dem_shape[0]
+    cols = max(1, int(np.ceil(width / resolution)))
+    rows = max(1, int(np.ceil(height / resolution)))
+    return from_origin(left, top, resolution, resolution), (rows, cols)
+
+def interpolate_surface(points_xyz, grid_transform, grid_shape, out_path, crs, block_rows=256):
+    """
+    线性插值生成沟床面 DEM：Delaunay 三角剖分只构建一次，按行块在像元中心求值并逐块写出，
+    内存占用只与块大小有关。凸包以外为 NaN（NoData）。
+    """
+    tri = Delaunay(points_xyz[:, :2])
+    interpolator = interpolate.LinearNDInterpolator(tri, points_xyz[:, 2])
+
+    rows, cols = grid_shape
+    xs = grid_transform.c + (np.arange(cols) + 0.5) * grid_transform.a
+    profile = {
+        'driver': 'GTiff', 'height': rows, 'width': cols, 'count': 1,
+        'dtype': 'float32', 'nodata': np.nan, 'crs': crs, 'transform': grid_transform,
+        'tiled': True, 'blockxsize': 256, 'blockysize': 256, 'compress': 'deflate',
+    }
+    with rasterio.open(out_path, 'w', **profile) as dst:
+        for row_off in range(0, rows, block_rows):
+            n = min(block_rows, rows - row_off)
+            ys = grid_transform.f + (np.arange(row_off, row_off + n) + 0.5) * grid_transform.e
+            grid_x, grid_y = np.meshgrid(xs, ys)
+            block = interpolator(grid_x, grid_y).astype('float32')
+            dst.write(block, 1, window=Window(0, row_off, cols, n))
+
+def read_clip_geometries(shp_path):
+    """
+    读取裁剪边界：既可以是 SHP 路径，也可以是已经准备好的 GeoJSON 几何字典列表
+    """
+    if not isinstance(shp_path, (str, os.PathLike)):
+        return list(shp_path)
+    sf = shapefile.Reader(shp_path)
+    geoms = []
+    for shape_rec in sf.shapeRecords():
+        geoms.append(shape_rec.shape.__geo_interface__)
+    return geoms
+
+def clip_raster_to_array(raster_path, shp_path):
+    """
+    按边界裁剪栅格，结果留在内存中
+    :return: (out_image, out_transform, out_meta)，失败返回 None
+    """
     print(f"--- 开始执行裁剪 ---")
     print(f"输入 DEM: {raster_path}")
-    print(f"裁剪边界: {shp_path}")
-    
-    final_output_path = None
 
-    # 1. 读取 SHP 几何体 (Safe Mode)
+    # 1. 读取边界几何体 (Safe Mode)
     try:
-        sf = shapefile.Reader(shp_path)
-        geoms = []
-        for shape_rec in sf.shapeRecords():
-            geoms.append(shape_rec.shape.__geo_interface__)
-        print(f"✅ SHP 读取成功，包含 {len(geoms)} 个几何要素")
+        geoms = read_clip_geometries(shp_path)
+        print(f"✅ 边界读取成功，包含 {len(geoms)} 个几何要素")
     except Exception as e:
         print(f"❌ SHP 读取失败: {e}")
         return None
@@ -412,13 +351,6 @@ def clip_raster_by_shp(raster_path, shp_path, custom_name="clip_original"):
             if np.all(out_image == 0):
                 print("⚠️ 警告：裁剪结果全为 0")
 
-            # 构建输出文件名
-            # 这里简化逻辑，直接用 custom_name 防止字段读取出错
-            filename = f"{custom_name}.tif"
-            final_output_path = os.path.join(os.path.dirname(raster_path), filename)
-            # 确保绝对路径
-            final_output_path = os.path.abspath(final_output_path)
-
             # 更新元数据
             out_meta = src.meta.copy()
             out_meta.update({
@@ -428,39 +360,129 @@ def clip_raster_by_shp(raster_path, shp_path, custom_name="clip_original"):
                 "transform": out_transform,
                 "nodata": 0
             })
+    except Exception as e:
+        print(f"❌ 裁剪过程出错: {e}")
+        return None
 
-            # 写入文件
-            with rasterio.open(final_output_path, "w", **out_meta) as dest:
-                dest.write(out_image)
-            
-            print(f"✅ 裁剪文件已生成: {final_output_path}")
+    return out_image, out_transform, out_meta
 
+def write_clipped_raster(out_image, out_meta, custom_name):
+    # 写入当前工作目录（任务目录），不写回输入 DEM 所在的共享数据集目录
+    final_output_path = os.path.abspath(f"{custom_name}.tif")
+    with rasterio.open(final_output_path, "w", **out_meta) as dest:
+        dest.write(out_image)
+    print(f"✅ 裁剪文件已生成: {final_output_path}")
+    return final_output_path
+
+def clip_raster_by_shp(raster_path, shp_path, custom_name="clip_original"):
+    """
+    按边界裁剪栅格并写出 {custom_name}.tif，返回文件路径，失败返回 None
+    :param shp_path: SHP 路径或 GeoJSON 几何字典列表
+    """
+    clipped = clip_raster_to_array(raster_path, shp_path)
+    if clipped is None:
+        return None
+    out_image, _, out_meta = clipped
+    try:
+        return write_clipped_raster(out_image, out_meta, custom_name)
     except Exception as e:
         print(f"❌ 裁剪过程出错: {e}")
         return None
 
-    # 【核心修复】：必须把路径 return 出去，否则外面接收到的是 None
-    return final_output_path
+def load_profile_lines(kml_path, transformer, elevation, transform, nodata):
+    """
+    解析剖面线 KML 并批量处理全部折线顶点：
+    1. KML 只解析一次，所有 LineString 顶点拼成数组，一次 transformer.transform 完成投影；
+    2. 逆仿射变换对数组整体计算行列号，越界与 NoData 用布尔掩膜剔除；
+    3. 按折线顶点数切分回各组，并找出每组距中心最远的两个点 (X1, X2)。
+    :return: (line_groups, match_groups, outermost_groups)，每组均为 (n, 3) 数组
+             line_groups 为 (x, y, KML高程)，match_groups 为 (x, y, DEM高程)
+    """
+    kml_file = kml.KML()
+    with open(kml_path, 'rb') as f:
+        kml_file.from_string(f.read())
+
+    lines = [list(placemark.geometry.coords)
+             for feature in kml_file.features()
+             for placemark in feature.features()
+             if isinstance(placemark.geometry, geometry.LineString)]
+    if not lines:
+        print("警告：剖面线 KML 中没有 LineString 要素")
+        return [], [], []
+
+    lon = np.array([c[0] for coords in lines for c in coords], dtype=float)
+    lat = np.array([c[1] for coords in lines for c in coords], dtype=float)
+    ele = np.array([c[2] if len(c) > 2 else 0 for coords in lines for c in coords], dtype=float)
+
+    # WGS84 -> CGCS2000，一次调用投影全部顶点
+    x, y = transformer.transform(lon, lat)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # 像元行列号（向下取整），越界点不参与取值
+    col, row = ~transform * (x, y)
+    col = np.floor(col)
+    row = np.floor(row)
+    valid = (row >= 0) & (row < elevation.shape[0]) & (col >= 0) & (col < elevation.shape[1])
+    dem_z = np.full(x.shape, np.nan)
+    dem_z[valid] = elevation[row[valid].astype(int), col[valid].astype(int)]
+    if nodata is not None:
+        valid &= ~np.isnan(dem_z) if np.isnan(nodata) else dem_z != nodata
+
+    # 按每条折线的顶点数切回分组
+    splits = np.cumsum([len(coords) for coords in lines])[:-1]
+    line_xyz = np.split(np.column_stack([x, y, ele]), splits)
+    dem_xyz = np.split(np.column_stack([x, y, dem_z]), splits)
+    keeps = np.split(valid, splits)
+
+    line_groups = []
+    match_groups = []
+    outermost_groups = []
+    for line, matched, keep in zip(line_xyz, dem_xyz, keeps):
+        line_groups.append(line)
+        coords_array = matched[keep]
+        if len(coords_array) == 0:
+            continue
+        match_groups.append(coords_array)
+        center = np.mean(coords_array[:, :2], axis=0)
+        distances = np.linalg.norm(coords_array[:, :2] - center, axis=1)
+        outermost_groups.append(coords_array[distances.argsort()[-2:]])
+
+    print(f"剖面线读取完成：{len(line_groups)} 条，{len(x)} 个顶点，其中 {int(valid.sum())} 个落在 DEM 有效区")
+    return line_groups, match_groups, outermost_groups
 
 def fit_line_3d(points):
     points = np.asarray(points)
     center = points.mean(axis=0)
     centered_points = points - center
-    U, S, Vt = np.linalg.svd(centered_points)
+    # 只需要主方向，精简 SVD 避免生成 n×n 的 U 矩阵
+    U, S, Vt = np.linalg.svd(centered_points, full_matrices=False)
     direction = Vt[0]
     return center, direction
 
 def process_group(line_coords, outermost_points):
+    """
+    剔除剖面线上 X1 与 X2 之间的点，按距 X1/X2 的远近把剩余点分为两侧，分别拟合空间直线并求交点 X3
+    :param line_coords: (n, 3) 剖面线坐标
+    :param outermost_points: (2, 3) 最外侧点 X1, X2
+    """
+    line_coords = np.asarray(line_coords, dtype=float)
     if len(outermost_points) < 2:
         return None, None, None, None, None, line_coords
 
-    outermost_indices = [np.argmin(np.linalg.norm(np.array(line_coords)[:, :2] - point[:2], axis=1)) for point in outermost_points]
-    min_idx, max_idx = sorted(outermost_indices)
-    filtered_group = line_coords[:min_idx] + line_coords[max_idx+1:]
+    # 每个点到 X1、X2 的平面距离矩阵 (n, 2)
+    distances = np.linalg.norm(line_coords[:, None, :2] - np.asarray(outermost_points)[None, :2, :2], axis=2)
+    min_idx, max_idx = np.sort(distances.argmin(axis=0))
+    keep = np.ones(len(line_coords), dtype=bool)
+    keep[min_idx:max_idx + 1] = False
+    filtered_group = line_coords[keep]
+    distances = distances[keep]
 
-    x1, x2 = outermost_points
-    x1_side = [point for point in filtered_group if np.linalg.norm(np.array(point[:2]) - np.array(x1[:2])) < np.linalg.norm(np.array(point[:2]) - np.array(x2[:2]))]
-    x2_side = [point for point in filtered_group if np.linalg.norm(np.array(point[:2]) - np.array(x2[:2])) < np.linalg.norm(np.array(point[:2]) - np.array(x1[:2]))]
+    x1_side = filtered_group[distances[:, 0] < distances[:, 1]]
+    x2_side = filtered_group[distances[:, 1] < distances[:, 0]]
+    if len(x1_side) == 0 or len(x2_side) == 0:
+        print("警告：剖面线一侧没有可拟合的点，跳过该组")
+        return None, None, None, None, None, filtered_group
 
     center1, direction1 = fit_line_3d(x1_side)
     center2, direction2 = fit_line_3d(x2_side)
@@ -478,24 +500,51 @@ def line_intersection(center1, direction1, center2, direction2):
 
 import csv
 
-def parse_coordinates(coord_str):
-    match = re.match(r'\(([-\d.]+),\s*([-\d.]+),\s*([-\d.]+)\)', coord_str)
-    if match:
-        return float(match.group(1)), float(match.group(2)), float(match.group(3))
-    raise ValueError(f"无法解析坐标: {coord_str}")
-
-def calculate_incenter(x1, y1, z1, x2, y2, z2, x3, y3, z3):
-    a = np.linalg.norm([x2 - x3, y2 - y3, z2 - z3])
-    b = np.linalg.norm([x3 - x1, y3 - y1, z3 - z1])
-    c = np.linalg.norm([x1 - x2, y1 - y2, z1 - z2])
-    return (a * x1 + b * x2 + c * x3) / (a + b + c), (a * y1 + b * y2 + c * y3) / (a + b + c), (a * z1 + b * z2 + c * z3) / (a + b + c)
-
-def calculate_bspline_curve(x, y, z):
-    tck_x = interpolate.splrep([0, 1, 2], x, k=2)
-    tck_y = interpolate.splrep([0, 1, 2], y, k=2)
-    tck_z = interpolate.splrep([0, 1, 2], z, k=2)
-    u_new = np.linspace(0, 2, 100)
-    return interpolate.splev(u_new, tck_x), interpolate.splev(u_new, tck_y), interpolate.splev(u_new, tck_z)
+def export_point_csvs(group_ids, x123, bspline_xyz, boundary_xyz, merged_xyz):
+    """
+    将各阶段的点集一次性写出为 CSV（文件名与格式与原流程保持一致）
+    """
+    with open("每组X1_X2_X3坐标点.csv", "w", newline='') as file:
+        fieldnames = ['Group', 'X1 (X, Y, Z)', 'X2 (X, Y, Z)', 'X3 (X, Y, Z)']
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+
+        writer.writeheader()
+        for group, points in zip(group_ids, x123):
+            row = {'Group': group}
+            for name, (x, y, z) in zip(fieldnames[1:], points):
+                row[name] = f"({x:.5f}, {y:.5f}, {z:.5f})"
+            writer.writerow(row)
+    print("坐标数据已成功保存到 '每组X1_X2_X3坐标点.csv'")
+
+    for filename, points in (("B样条点坐标.csv", bspline_xyz), ("DEM边界点坐标.csv", boundary_xyz), ("拟合点坐标.csv", merged_xyz)):
+        pd.DataFrame(points, columns=['X', 'Y', 'Z']).to_csv(filename, index=False)
+    print("B样条点、边界点与拟合点坐标已保存为 CSV")
+
+def calculate_incenters(triangles):
+    """
+    批量计算三角形内心
+    :param triangles: 形状 (组数, 3, 3)，每组为 X1, X2, X3 三个顶点的 (x, y, z)
+    :return: 形状 (组数, 3) 的内心坐标
+    """
+    p1, p2, p3 = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    a = np.linalg.norm(p2 - p3, axis=1)
+    b = np.linalg.norm(p3 - p1, axis=1)
+    c = np.linalg.norm(p1 - p2, axis=1)
+    return (a[:, None] * p1 + b[:, None] * p2 + c[:, None] * p3) / (a + b + c)[:, None]
+
+def calculate_bspline_curves(control_points, n_points=100):
+    """
+    批量计算过三个控制点的二次 B 样条曲线
+    三个节点 [0, 1, 2] 上的 k=2 插值样条（splrep）即二次拉格朗日插值，
+    因此所有组共用同一组基函数权重，一次矩阵乘法完成求值。
+    :param control_points: 形状 (组数, 3, 3)，每组依次为 X1, 内心, X2
+    :return: 形状 (组数×n_points, 3) 的曲线点
+    """
+    u = np.linspace(0, 2, n_points)
+    weights = np.column_stack([(u - 1) * (u - 2) / 2, -u * (u - 2), u * (u - 1) / 2])
+    curves = np.empty((len(control_points), n_points, 3))
+    np.matmul(weights, control_points, out=curves)
+    return curves.reshape(-1, 3)
 
 # 定义递归函数以处理 KML 可能存在的文件夹嵌套结构 (Folder/Document)
 def extract_kml_coords(features_list, transformer):
@@ -537,6 +586,8 @@ def Reproject_Reference_To_Input():
     1. 获取 inputfilePath 的【范围】(Bounds)。
     2. 获取 referencefilefilePath 的【分辨率】(Resolution)。
     3. 将两者都重投影到这个新的统一网格上，确保行列数完全一致。
+    对齐结果默认为内存数据集（MEM），保留中间文件时写出 GTiff。
+    :return: (ref_aligned_ds, input_aligned_ds)
     """
     # 动态使用全局变量
     global inputfilePath, referencefilefilePath
@@ -580,117 +631,63 @@ def Reproject_Reference_To_Input():
     
     print(f"新网格设定 -> 分辨率: {target_res_x}, 尺寸: {new_cols}x{new_rows}")
 
-    # 定义新的 GeoTransform (左上角坐标用裁剪图的，分辨率用原始图的)
-    target_geo = (min_x, target_res_x, 0, max_y, 0, target_res_y)
-    
-    # 定义内部重投影函数 (避免重复写代码)
+    # 输出范围：严格按新网格的行列数回推，保证两幅结果行列数完全一致
+    out_bounds = (min_x, max_y + new_rows * target_res_y, min_x + new_cols * target_res_x, max_y)
+    dst_wkt = in_ds.GetProjection() # 投影跟随输入图
+
+    # 定义内部重投影函数 (避免重复写代码)，源窗口截取与 gdal.Warp 见 公共/体积.warp_to_grid
     def reproject_worker(src_ds, out_path):
-        driver = gdal.GetDriverByName('GTiff')
-        out_ds = driver.Create(out_path, new_cols, new_rows, 1, src_ds.GetRasterBand(1).DataType)
-        out_ds.SetGeoTransform(target_geo)
-        out_ds.SetProjection(in_ds.GetProjection()) # 投影跟随输入图
-        
-        # 保持 NoData
-        nodata = src_ds.GetRasterBand(1).GetNoDataValue()
-        if nodata is None: nodata = 0
-        out_ds.GetRasterBand(1).SetNoDataValue(nodata)
-        
-        gdal.ReprojectImage(
-            src_ds, 
-            out_ds, 
-            src_ds.GetProjection(), 
-            in_ds.GetProjection(), 
-            gdalconst.GRA_Bilinear # 双线性插值，平滑
-        )
-        out_ds.FlushCache()
-        return out_ds
+        return warp_to_grid(src_ds, out_bounds, new_cols, new_rows, dst_wkt, out_path=out_path if 保留中间文件 else None)
 
     # 4. 执行对齐
     # (A) 处理原始 DEM -> Aligned_Reference_DEM.tif
     print(f"正在重采样原始 DEM...")
-    reproject_worker(ref_ds, outputfilePath)
+    ref_aligned_ds = reproject_worker(ref_ds, outputfilePath)
     
     # (B) 【关键步骤】处理裁剪 DEM -> Aligned_Input_Resampled.tif
     # 必须把输入图也转换到这个分辨率，否则矩阵没法相减
     print(f"正在重采样输入 DEM 以匹配分辨率...")
-    reproject_worker(in_ds, input_aligned_path)
+    input_aligned_ds = reproject_worker(in_ds, input_aligned_path)
     
     print(f"✅ 对齐完成。")
-    # 这里不需要返回 dataset，因为我们在 compute 中会重新打开文件
+    # 直接返回 dataset 交给体积计算，不再重新打开文件
+    return ref_aligned_ds, input_aligned_ds
 
-def compute_volume_difference():
+# 有效高程范围：只保留地球上合理的高程（例如 -500米 到 9000米），防止 NoData 导致数值爆炸
+VALID_ELEVATION_RANGE = (-500, 9000)
+
+def compute_volume_difference(ds_new=None, ds_ref=None):
     """
     计算体积差（修复版：增加强制数值范围过滤，防止 NoData 导致数值爆炸）
+    逐块读取两幅对齐 DEM，只累加挖方/填方/净体积标量，内存占用与 DEM 大小无关。
+    :param ds_new: 对齐后的输入 DEM 数据集（Top），None 时打开 input_aligned_path
+    :param ds_ref: 对齐后的参考 DEM 数据集（Bottom），None 时打开 outputfilePath
+    :return: 体积结果字典（count / fill_volume / cut_volume / net_volume / volume 等）
     """
-    # 1. 读取对齐后的文件
-    ds_new = gdal.Open(input_aligned_path)  # Top
-    ds_ref = gdal.Open(outputfilePath)      # Bottom
+    # 1. 读取对齐后的数据集
+    if ds_new is None:
+        ds_new = gdal.Open(input_aligned_path)  # Top
+    if ds_ref is None:
+        ds_ref = gdal.Open(outputfilePath)      # Bottom
     
     if ds_new is None or ds_ref is None:
         raise ValueError("无法打开对齐后的文件，请检查对齐步骤。")
 
-    band_new = ds_new.GetRasterBand(1)
-    band_ref = ds_ref.GetRasterBand(1)
-    
-    data_new = band_new.ReadAsArray().astype(float)
-    data_ref = band_ref.ReadAsArray().astype(float)
-    
-    # ------------------ 【Debug 核心】 ------------------
-    # 打印一下原始数据的极值，看看是不是有 -3.4e+38 这种数
-    print(f"Input 数据极值: Min={np.nanmin(data_new):.2e}, Max={np.nanmax(data_new):.2e}")
-    print(f"Ref   数据极值: Min={np.nanmin(data_ref):.2e}, Max={np.nanmax(data_ref):.2e}")
-    # ----------------------------------------------------
-
-    # 获取分辨率
-    gt = ds_new.GetGeoTransform()
-    pixel_area = abs(gt[1] * gt[5])
-    print(f"单像元面积: {pixel_area:.2f} m²")
-
-    # 2. 【强力掩膜】创建有效区域
-    # 即使读取了 NoDataValue，有时候数据里会有微小误差导致 != NoDataValue 失效
-    # 所以最稳妥的方法是：只保留地球上合理的高程范围（例如 -500米 到 9000米）
-    
-    min_valid_elevation = -500   # 根据你的研究区调整，一般不用动
-    max_valid_elevation = 9000   # 珠穆朗玛峰也就8848
-    
-    # 逻辑：非0 且 在合理高程范围内
-    mask_new = (data_new != 0) & (data_new > min_valid_elevation) & (data_new < max_valid_elevation)
-    mask_ref = (data_ref != 0) & (data_ref > min_valid_elevation) & (data_ref < max_valid_elevation)
-    
-    # 取交集
-    valid_mask = mask_new & mask_ref
+    # 2. 【强力掩膜】非0 且 在合理高程范围内，两幅取交集
+    result = dem_difference_volume(ds_new, ds_ref, valid_range=VALID_ELEVATION_RANGE, exclude_zero=True)
+    print(f"单像元面积: {result['pixel_area']:.2f} m²")
+    print(f"有效计算像元数: {result['count']}")
     
-    count_pixels = np.sum(valid_mask)
-    print(f"有效计算像元数: {count_pixels}")
-    
-    if count_pixels == 0:
+    if result['count'] == 0:
         print("⚠️ 警告：有效区域为 0！请检查 min_valid_elevation 设置或坐标系重叠情况。")
-        return None, None, data_new
+        return result
 
-    # 3. 计算高程差
-    elevation_diff = np.full_like(data_new, np.nan)
-    
-    # 只有在 mask 为 True 的地方才进行减法
-    elevation_diff[valid_mask] = data_new[valid_mask] - data_ref[valid_mask]
-    
-    # 4. 计算体积
-    # 这里再次过滤一下 diff，防止异常的高差（例如突变 1000米）
-    # 假设泥石流或地形变化不会超过 +/- 200米（根据实际情况可调整）
-    diff_values = elevation_diff[valid_mask]
-    
-    # (可选) 剔除极端异常值：例如高差超过 500米的可能是边缘伪影
-    # valid_diff_mask = np.abs(diff_values) < 500 
-    # final_diff_sum = np.nansum(diff_values[valid_diff_mask])
-    
-    final_diff_sum = np.nansum(diff_values) # 暂时不剔除，先看结果
-    
-    total_volume = abs(final_diff_sum) * pixel_area
-    
     print(f"------------------------------------------------")
-    print(f"📊 修正后体积计算结果: {total_volume:.2f} 立方米")
+    print(f"📊 修正后体积计算结果: {result['volume']:.2f} 立方米")
+    print(f"填方: {result['fill_volume']:.2f} 立方米，挖方: {result['cut_volume']:.2f} 立方米")
     print(f"------------------------------------------------")
     
-    return valid_mask, elevation_diff, data_new
+    return result
 
 def plot_3d_cubes_with_surface(valid_mask, elevation_diff, data_new):
     """
@@ -754,19 +751,24 @@ def plot_3d_cubes_with_surface(valid_mask, elevation_diff, data_new):
 
 def main_volume_calc():
     try:
-        # 1. 对齐影像 (内部生成两个对齐后的临时文件)
-        Reproject_Reference_To_Input()
+        # 1. 对齐影像 (两个对齐结果默认留在内存中)
+        ref_aligned_ds, input_aligned_ds = Reproject_Reference_To_Input()
         
-        # 2. 计算体积 (读取那两个临时文件)
-        valid_mask, elevation_diff, data_new = compute_volume_difference()
+        # 2. 计算体积 (直接使用对齐后的数据集，逐块累加)
+        result = compute_volume_difference(input_aligned_ds, ref_aligned_ds)
         
-        # 3. 绘图
-        plot_3d_cubes_with_surface(valid_mask, elevation_diff, data_new)
+        # 3. 绘图 (降采样读取)
+        if result['count']:
+            valid_mask, elevation_diff, data_new = decimated_difference(
+                input_aligned_ds, ref_aligned_ds, valid_range=VALID_ELEVATION_RANGE, exclude_zero=True)
+            plot_3d_cubes_with_surface(valid_mask, elevation_diff, data_new)
+        return result
         
     except Exception as e:
         print(f"❌ 计算过程出错: {e}")
         import traceback
         traceback.print_exc()
+        return None
 
 if __name__ == "__main__":
     # 如果直接运行，使用默认硬编码路径执行